@@ -4,6 +4,7 @@
 import sys,string
 import astropy.io.fits as pyfits
 import argparse
+from teststand.index import expand_filenames
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('-i','--image', type = str, default = None, required = True, nargs="*",
@@ -14,6 +15,7 @@ parser.add_argument('--hdu',type = str, default = 0, required = False,
                     help = 'header HDU (int or string)')
 
 args        = parser.parse_args()
+args.image  = expand_filenames(args.image)
 
 try :
     hdu = int(args.hdu)
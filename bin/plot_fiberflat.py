@@ -4,10 +4,16 @@ import numpy as np
 import astropy.io.fits as fits
 import pylab
 import argparse
+from teststand.fiberflat import rebinned_fiberflat_error
+from teststand.resample import rebin
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('-f','--fiberflat', type = str, default = None, required = True,
                     help = 'path to fiber flat file')
+parser.add_argument('--fbin', type = int, default = 50, required = False,
+                    help = 'number of fibers per displayed block')
+parser.add_argument('--wrebin', type = int, default = 100, required = False,
+                    help = 'number of wavelength pixels per bin')
 
 args        = parser.parse_args()
 h=fits.open(args.fiberflat)
@@ -16,23 +22,25 @@ h=fits.open(args.fiberflat)
 h.info()
 
 wave=h["WAVELENGTH"].data
+if wave.ndim == 2 :
+    wave=np.mean(wave,axis=0)
 #meanspec=np.mean(h[0].data,axis=0)
 meanspec=np.ones((h[0].data.shape[1]))
 ratio=h[0].data/meanspec
 ivar=h[1].data*meanspec**2
 
-wrebin=100
-rwave=wave[:(wave.size/wrebin)*wrebin].reshape((wave.size/wrebin),wrebin).mean(-1)
+wrebin=args.wrebin
+rwave=rebin(wave,wrebin,np.mean)
 
-fbin=50
-nfbin=500/fbin
+# blocks of fibers, driven by the actual number of fibers in the file
+nfibers=ratio.shape[0]
+fbin=max(1,min(args.fbin,nfibers))
+nfbin=(nfibers+fbin-1)//fbin
 for f in np.arange(0,nfbin) :
     color=pylab.cm.rainbow(f/float(nfbin))
     mratio=np.mean(ratio[fbin*f:fbin*(f+1)],axis=0)
     mivar=np.sum(ivar[fbin*f:fbin*(f+1)],axis=0)
-    rmratio=mratio[:(wave.size/wrebin)*wrebin].reshape((wave.size/wrebin),wrebin).mean(-1)
-    rmivar=mivar[:(wave.size/wrebin)*wrebin].reshape((wave.size/wrebin),wrebin).sum(-1)
-    err=1./np.sqrt(rmivar)
+    rmratio,err=rebinned_fiberflat_error(mratio,mivar,wrebin)
     pylab.fill_between(rwave,rmratio-1-err,rmratio-1+err,color=color,alpha=0.2)
     pylab.plot(rwave,rmratio-1,c=color,lw=2)
 pylab.xlabel("wavelength (A)")
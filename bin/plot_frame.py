@@ -8,6 +8,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from teststand.graph_tools         import plot_graph,parse_fibers
 from desispec.log                  import get_logger
+from teststand.index               import expand_filenames
 import os.path
                 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -26,9 +27,12 @@ parser.add_argument('-b', '--batch', action='store_true', default = False, requi
 parser.add_argument('-o','--output', type = str, default = None, required = False,
                     help = 'save figure in this file')
 parser.add_argument('-l','--legend', action='store_true',help="show legend")
+parser.add_argument('--quicklook', action='store_true', default = False, required = False,
+                    help = 'fast rendering for many fibers : spectra decimated to the figure resolution and drawn as a single collection')
 
 log         = get_logger()
 args        = parser.parse_args()
+args.frame  = expand_filenames(args.frame)
 
 fig=plt.figure()
 subplot=plt.subplot(1,1,1)
@@ -39,7 +43,7 @@ for filename in args.frame :
     frame_file  = pyfits.open(filename)
     if fibers is None :
         fibers = np.arange(frame_file[0].data.shape[0])
-    plot_graph(frame=frame_file,fibers=fibers,opt_err=args.err,opt_2d=args.image,label=os.path.basename(filename))
+    plot_graph(frame=frame_file,fibers=fibers,opt_err=args.err,opt_2d=args.image,label=os.path.basename(filename),subplot=subplot,quicklook=args.quicklook)
 
 if args.log :
     subplot.set_yscale("log")
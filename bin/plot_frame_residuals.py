@@ -7,9 +7,15 @@ import astropy.io.fits as pyfits
 from desispec.log import get_logger
 import numpy as np
 import matplotlib.pyplot as plt
+from teststand.qa.frame_chi2 import frame_chi2, parse_amp_fibers, default_amp_fibers
+
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('-f','--frame', type = str, default = None, required = True,
                     help = 'path of frame fits file')
+parser.add_argument('--amps', type = str, default = default_amp_fibers, required = False,
+                    help = 'fibers of each amplifier')
+parser.add_argument('--rebin', type = int, default = 8, required = False,
+                    help = 'number of wavelength pixels per bin')
 
 log         = get_logger()
 args        = parser.parse_args()
@@ -18,24 +24,13 @@ flux        = frame_file[0].data
 ivar        = frame_file[1].data
 wave        = frame_file["WAVELENGTH"].data
 
-
-for amp in range(2) :
-    if amp==0 :
-        fibers=np.arange(0,10)
-    else :
-        fibers=np.arange(10,20)
-
-    sw          = np.sum(ivar[fibers],axis=0)
-    mflux       = np.sum(ivar[fibers]*flux[fibers],axis=0)/(sw+(sw==0))
-    chi2        = np.sum(ivar[fibers]*(flux[fibers]-mflux)**2,axis=0)
-    rebin       = 8
-    chi2        = chi2[:(chi2.size/rebin)*rebin].reshape(chi2.size/rebin,rebin).sum(-1)
-    chi2pdf     = chi2/(fibers.size-1)/rebin
-    rwave       = wave[:(wave.size/rebin)*rebin].reshape(wave.size/rebin,rebin).mean(-1)
-    plt.plot(rwave,chi2pdf)
+res = frame_chi2(flux,ivar,wave,parse_amp_fibers(args.amps),rebin_factor=args.rebin)
+for amp in res :
+    rwave,chi2pdf = res[amp]
+    plt.plot(rwave,chi2pdf,label="AMP %s"%amp)
 
 plt.xlabel("wavelength")
 plt.ylabel("chi2/ndf")
+plt.legend(loc="upper right")
 plt.grid()
 plt.show()
-
@@ -3,16 +3,15 @@
 import numpy as np
 import astropy.io.fits as pyfits
 import pylab
-from numpy.polynomial.legendre import legval
 import desimodel.io
 import desispec.io
 #from specter.psf.gausshermite import GaussHermitePSF
+from teststand.psfparams import PSFParams
+from teststand.graph_tools import plot_lines
+from teststand.psfcompare import trace_deltas, delta_table, delta_header, format_delta_row
 import sys
 import argparse
 
-def u(wave,wavemin,wavemax) :
-    return 2.*(wave-wavemin)/(wavemax-wavemin)-1.
-
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('-p','--psf', type = str, default = None, required = True,
                     help = 'path of psf boot file')
@@ -22,33 +21,39 @@ parser.add_argument('--fig',type = str, default = None, required = False,
                     help = 'figure filename')
 parser.add_argument('--batch', action = 'store_true',help="do not display result")
 parser.add_argument('--sim', action = 'store_true',help="compare with simulation truth")
+parser.add_argument('--table',type = str, default = None, required = False,
+                    help = 'with --sim, write the max and rms of the x and y deltas per fiber and wavelength bin in this ASCII file')
+parser.add_argument('--nbins',type = int, default = 10, required = False,
+                    help = 'number of wavelength bins of the --table statistics')
 
 
 args = parser.parse_args()
 
 
-psf=pyfits.open(args.psf)
-cam=psf[0].header["CAMERA"].strip()
+psf=PSFParams(args.psf)
+cam=psf.camera
 arm=cam[0].lower()
 if not arm in ['b','r','z'] :
     print("camera arm must be b, r or z, and read '%s' in psf header"%arm)
     sys.exit(12)
 
 
-wavemin=psf[0].header["WAVEMIN"]
-wavemax=psf[0].header["WAVEMAX"]
+wavemin=psf.wmin
+wavemax=psf.wmax
 print("wavemin,wavemax=",wavemin,wavemax)
-xcoef=psf[0].data
-ycoef=psf[1].data
-sigma=psf[2].data
-print("xcoef.shape=",xcoef.shape)
-print("ycoef.shape=",ycoef.shape)
-nspec=xcoef.shape[0]
+sigma=psf.coeff["XSIGMA"]
+print("xcoef.shape=",psf.coeff["X"].shape)
+print("ycoef.shape=",psf.coeff["Y"].shape)
+nspec=psf.nspec
 print("nspec=",nspec)
 
-wave=np.linspace(wavemin,wavemax,100)
+wave=psf.wavelength_grid(100)
 mwave=np.mean(wave)
 
+# (nspec, nwave) arrays
+x=psf.eval("X",wave)
+y=psf.eval("Y",wave)
+
 
 fig = pylab.figure()
 nx=2
@@ -62,25 +67,15 @@ a1=pylab.subplot(ny,nx,pcount) ; pcount +=1
 #a3=pylab.subplot(ny,nx,pcount) ; pcount +=1
 
 
-mx=[]
-min_dwdy=100.
-max_dwdy=0.
-mean_dwdy=0.
+plot_lines(a0,x,y)
+plot_lines(a1,y,wave)
+mx=psf.eval("X",mwave)[:,0]
+dwdy=np.gradient(wave)/np.gradient(y,axis=1)
 for spec in range(nspec) :
-
-    x = legval(u(wave,wavemin,wavemax), xcoef[spec])
-    y = legval(u(wave,wavemin,wavemax), ycoef[spec])
-    a0.plot(x,y)
-    a1.plot(y,wave)
-    mx.append(legval(u(mwave,wavemin,wavemax), xcoef[spec]))
-    dy=np.gradient(y)
-    dw=np.gradient(wave)
-    dwdy=dw/dy
-    print("fiber #%d min mean max dw/dy = %f %f %f "%(spec,np.min(dwdy),np.mean(dwdy),np.max(dwdy)))
-    min_dwdy=min(min_dwdy,np.min(dwdy))
-    max_dwdy=max(max_dwdy,np.max(dwdy))
-    mean_dwdy += np.mean(dwdy)
-mean_dwdy/=nspec
+    print("fiber #%d min mean max dw/dy = %f %f %f "%(spec,np.min(dwdy[spec]),np.mean(dwdy[spec]),np.max(dwdy[spec])))
+min_dwdy=min(100.,np.min(dwdy))
+max_dwdy=max(0.,np.max(dwdy))
+mean_dwdy=np.mean(np.mean(dwdy,axis=1))
 print("total min mean max dw/dy = %f %f %f "%(min_dwdy,mean_dwdy,max_dwdy))
 
 a0.set_xlabel("X CCD")
@@ -110,18 +105,19 @@ if args.sim :
     else :
         fibers = np.arange(nspec)
         print("assuming it's the first %d fibers in the sims (if wrong, rerun with --fibermap option)"%nspec)
-    psf = desimodel.io.load_psf(arm)
+    truth_psf = desimodel.io.load_psf(arm)
     
     a0=pylab.subplot(ny,nx,pcount) ; pcount +=1
     a1=pylab.subplot(ny,nx,pcount) ; pcount +=1
-    for spec,fiber in enumerate(fibers) : 
-        print("spec #%d fiber #%d"%(spec,fiber))
-        x = legval(u(wave,wavemin,wavemax), xcoef[spec])
-        y = legval(u(wave,wavemin,wavemax), ycoef[spec])
-        x_truth = psf.x(int(fiber),wave)
-        y_truth = psf.y(int(fiber),wave)
-        a0.plot(wave,x-x_truth)
-        a1.plot(wave,y-y_truth)
+    wave, fibers, dx, dy = trace_deltas(psf,truth_psf,fibers,wave)
+    plot_lines(a0,wave,dx)
+    plot_lines(a1,wave,dy)
+    if args.table is not None :
+        file=open(args.table,"w")
+        file.write(delta_header+"\n")
+        for row in delta_table(wave,fibers,dx,dy,nbins=args.nbins) :
+            file.write(format_delta_row(row)+"\n")
+        file.close()
     a0.set_xlabel("Wavelength [A]")
     a0.set_ylabel("delta X CCD")
     a1.set_xlabel("Wavelength [A]")
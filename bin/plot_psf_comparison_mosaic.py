@@ -3,22 +3,11 @@
 import numpy as np
 import astropy.io.fits as pyfits
 import pylab
-import specter.psf
+from teststand.stampcache import read_psf_with_stamp_cache
 import sys
 import argparse
 import string
 import os.path
-def readpsf(filename) :
-    try :
-        psftype=pyfits.open(filename)[0].header["PSFTYPE"]
-    except KeyError :
-        psftype=""
-    print("PSF Type=",psftype)
-    if psftype=="GAUSS-HERMITE" :
-        return specter.psf.GaussHermitePSF(filename)
-    elif psftype=="SPOTGRID" :
-        return specter.psf.SpotGridPSF(filename)
-
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('--psf1', type = str, default = None, required = True,
                     help = 'path of psf file')
@@ -37,8 +26,8 @@ waves=[5500,6700,7600]
 
 args        = parser.parse_args()
 
-psf1=readpsf(args.psf1)
-psf2=readpsf(args.psf2)
+psf1=read_psf_with_stamp_cache(args.psf1)
+psf2=read_psf_with_stamp_cache(args.psf2)
 name1=os.path.basename(args.psf1)
 name2=os.path.basename(args.psf2)
 
@@ -68,8 +57,8 @@ for i in range(len(fibers1)) :
         y=x.T
         fpix1=psf1._value(x+xy1[0],y+xy1[1],fiber1,wave)
         fpix2=psf2._value(x+xy2[0],y+xy2[1],fiber2,wave)
-        fpix1 /= np.sum(fpix1)
-        fpix2 /= np.sum(fpix2)
+        fpix1 = fpix1/np.sum(fpix1)
+        fpix2 = fpix2/np.sum(fpix2)
 
         aa=a[j,i]
         #aa.imshow(fpix1,origin=0,interpolation="nearest",extent=(-hw,hw,-hw,hw),aspect="auto")
@@ -3,22 +3,11 @@
 import numpy as np
 import astropy.io.fits as pyfits
 import pylab
-import specter.psf
+from teststand.stampcache import read_psf_with_stamp_cache
 import sys
 import argparse
 import string
 import os.path
-def readpsf(filename) :
-    try :
-        psftype=pyfits.open(filename)[0].header["PSFTYPE"]
-    except KeyError :
-        psftype=""
-    print("PSF Type=",psftype)
-    if psftype=="GAUSS-HERMITE" :
-        return specter.psf.GaussHermitePSF(filename)
-    elif psftype=="SPOTGRID" :
-        return specter.psf.SpotGridPSF(filename)
-
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('--psf1', type = str, default = None, required = True,
                     help = 'path of psf file')
@@ -41,8 +30,8 @@ if args.fiber2 is None :
 else :
     fiber2=args.fiber2
 
-psf1=readpsf(args.psf1)
-psf2=readpsf(args.psf2)
+psf1=read_psf_with_stamp_cache(args.psf1)
+psf2=read_psf_with_stamp_cache(args.psf2)
 xy1=psf1.xy(args.fiber,args.wavelength)
 xy2=psf2.xy(fiber2,args.wavelength)
 print("for psf1, xy=",xy1)
@@ -56,8 +45,8 @@ x=np.tile(np.linspace(-hw,hw,51),(n1d,1))
 y=x.T
 fpix1=psf1._value(x+xy1[0],y+xy1[1],args.fiber,args.wavelength)
 fpix2=psf2._value(x+xy2[0],y+xy2[1],fiber2,args.wavelength)
-fpix1 /= np.sum(fpix1)
-fpix2 /= np.sum(fpix2)
+fpix1 = fpix1/np.sum(fpix1)
+fpix2 = fpix2/np.sum(fpix2)
 
 mx1=np.sum(fpix1*x)
 my1=np.sum(fpix1*y)
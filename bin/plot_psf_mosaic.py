@@ -3,7 +3,7 @@
 import numpy as np
 import astropy.io.fits as pyfits
 import pylab
-import specter.psf
+from teststand.stampcache import read_psf_with_stamp_cache
 import sys
 import argparse
 import string
@@ -17,7 +17,7 @@ parser.add_argument('-o','--output', type = str, default = None, required = Fals
 
 args        = parser.parse_args()
 
-psf=specter.psf.GaussHermitePSF(args.psf)
+psf=read_psf_with_stamp_cache(args.psf)
 wave=np.linspace(psf.wmin+200,psf.wmax-200,15)
 
 zoom=18
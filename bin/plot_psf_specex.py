@@ -3,16 +3,14 @@
 import numpy as np
 import astropy.io.fits as pyfits
 import pylab
-from numpy.polynomial.legendre import legval
 import desimodel.io
 import desispec.io
 #from specter.psf.gausshermite import GaussHermitePSF
+from teststand.psfparams import PSFParams
+from teststand.graph_tools import plot_lines
+from teststand.psfcompare import trace_deltas, delta_table, delta_header, format_delta_row
 import sys
 import argparse
-import string
-
-def u(wave,wavemin,wavemax) :
-    return 2.*(wave-wavemin)/(wavemax-wavemin)-1.
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('-p','--psf', type = str, default = None, required = True,
@@ -23,43 +21,35 @@ parser.add_argument('--fig',type = str, default = None, required = False,
                     help = 'figure filename')
 parser.add_argument('--batch', action = 'store_true',help="do not display result")
 parser.add_argument('--sim', action = 'store_true',help="compare with simulation truth")
+parser.add_argument('--table',type = str, default = None, required = False,
+                    help = 'with --sim, write the max and rms of the x and y deltas per fiber and wavelength bin in this ASCII file')
+parser.add_argument('--nbins',type = int, default = 10, required = False,
+                    help = 'number of wavelength bins of the --table statistics')
 args        = parser.parse_args()
 
-psf=pyfits.open(args.psf)
-cam=psf[1].header["CAMERA"].strip().replace("'","").strip()
+psf=PSFParams(args.psf)
+cam=psf.camera
 arm=cam[0]
 print("CAMERA=",cam,"ARM=",arm)
 
-params=psf[1].data["PARAM"]
-for i in range(params.size) :
-    params[i]=params[i].strip()
-
-xindex= np.where(params=="X")[0][0]
-yindex= np.where(params=="Y")[0][0]
-ghsigx_index= np.where(params=="GHSIGX")[0][0]
-ghsigy_index= np.where(params=="GHSIGY")[0][0]
-wavemin=psf[1].data["WAVEMIN"][xindex]
-wavemax=psf[1].data["WAVEMAX"][xindex]
-if psf[1].data["WAVEMIN"][yindex] != wavemin :
+if psf.wavemin["Y"] != psf.wmin :
     print("unexpected difference")
     sys.exit(12)
-
-fibermin=int(psf[1].header["FIBERMIN"])
-fibermax=int(psf[1].header["FIBERMAX"])
-legdeg=psf[1].header["LEGDEG"]
-table=psf[1].data
-xcoef=table["COEFF"][xindex]
-ycoef=table["COEFF"][yindex]
-ghsigx_coef=table["COEFF"][ghsigx_index]
-ghsigy_coef=table["COEFF"][ghsigy_index]
-
+wavemin=psf.wmin
+wavemax=psf.wmax
 
 print("wavemin,wavemax=",wavemin,wavemax)
-nspec=xcoef.shape[0]
+nspec=psf.nspec
 
-wave=np.linspace(wavemin,wavemax,100)
+wave=psf.wavelength_grid(100)
 refwave=int(np.mean(wave))
 
+# (nspec, nwave) arrays
+x=psf.eval("X",wave)
+y=psf.eval("Y",wave)
+ghsigx=psf.eval("GHSIGX",wave)
+ghsigy=psf.eval("GHSIGY",wave)
+
 fig=pylab.figure()
 
 nx=3
@@ -76,19 +66,12 @@ a3=pylab.subplot(ny,nx,pcount) ; pcount+=1
 a4=pylab.subplot(ny,nx,pcount) ; pcount+=1
 a5=pylab.subplot(ny,nx,pcount) ; pcount+=1
 
-for spec in range(nspec) :
-    x = legval(u(wave,wavemin,wavemax), xcoef[spec])
-    y = legval(u(wave,wavemin,wavemax), ycoef[spec])
-    a0.plot(x,y)
-    ghsigx = legval(u(wave,wavemin,wavemax), ghsigx_coef[spec])
-    a1.plot(wave,ghsigx)
-    ghsigy = legval(u(wave,wavemin,wavemax), ghsigy_coef[spec])
-    a2.plot(wave,ghsigy)
-    ghsigx = legval(u(refwave,wavemin,wavemax), ghsigx_coef[spec])
-    a3.plot(spec,ghsigx,"o")
-    ghsigy = legval(u(refwave,wavemin,wavemax), ghsigy_coef[spec])
-    a4.plot(spec,ghsigy,"o")
-    a5.plot(y,wave)
+plot_lines(a0,x,y)
+plot_lines(a1,wave,ghsigx)
+plot_lines(a2,wave,ghsigy)
+a3.plot(np.arange(nspec),psf.eval("GHSIGX",refwave)[:,0],"o")
+a4.plot(np.arange(nspec),psf.eval("GHSIGY",refwave)[:,0],"o")
+plot_lines(a5,y,wave)
 
 a0.set_xlabel("X CCD")
 a0.set_ylabel("Y CCD")
@@ -122,20 +105,22 @@ if args.sim :
         fibers = np.arange(nspec)
         print("assuming it's the first %d fibers in the sims (if wrong, rerun with --fibermap option)"%nspec)
     
-    psf = desimodel.io.load_psf(arm)
+    truth_psf = desimodel.io.load_psf(arm)
     
 
     
     a0=pylab.subplot(ny,nx,pcount) ; pcount+=1
     a1=pylab.subplot(ny,nx,pcount) ; pcount+=1
     
-    for spec,fiber in enumerate(fibers) : 
-        x = legval(u(wave,wavemin,wavemax), xcoef[spec])
-        y = legval(u(wave,wavemin,wavemax), ycoef[spec])
-        x_truth = psf.x(int(fiber),wave)
-        y_truth = psf.y(int(fiber),wave)
-        a0.plot(wave,x-x_truth)
-        a1.plot(wave,y-y_truth)
+    wave, fibers, dx, dy = trace_deltas(psf,truth_psf,fibers,wave)
+    plot_lines(a0,wave,dx)
+    plot_lines(a1,wave,dy)
+    if args.table is not None :
+        file=open(args.table,"w")
+        file.write(delta_header+"\n")
+        for row in delta_table(wave,fibers,dx,dy,nbins=args.nbins) :
+            file.write(format_delta_row(row)+"\n")
+        file.close()
     a0.set_xlabel("Wavelength [A]")
     a0.set_ylabel("delta X CCD")
     a1.set_xlabel("Wavelength [A]")
@@ -1,49 +1,73 @@
 #!/usr/bin/env python
 
 import numpy as np
-import astropy.io.fits as pyfits
-import matplotlib.pyplot as plt
-from numpy.polynomial.legendre import legval
 from teststand.graph_tools import parse_fibers
+from teststand.spots import read_spot_index, aggregate_statistics, summary_header, format_summary_row
 import sys
 import argparse
-import string
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('-p','--psf', type = str, nargs="*", default = None, required = True,
                     help = 'path of psf file')
 parser.add_argument('--fibers', type = str, required=False, default=None, help= "defines from_to which fiber to work on. (ex: --fibers=50:60,4 means that only fibers 4, and fibers from 50 to 60 (excluded) will be plotted)")
+parser.add_argument('--summary', type = str, default = None, required = False,
+                    help = 'write per fiber statistics of the spots of all the psf files in this ASCII file')
+parser.add_argument('--fig',type = str, default = None, required = False,
+                    help = 'figure filename')
+parser.add_argument('--batch', action = 'store_true',help="do not display result")
+parser.add_argument('--no-plot', action = 'store_true',help="only compute the summary")
 
 args        = parser.parse_args()
 
-plt.figure("spots")
-a1=plt.subplot(1,2,1)
-a2=plt.subplot(1,2,2)
+if not args.no_plot :
+    import matplotlib.pyplot as plt
+    fig=plt.figure("spots")
+    a1=plt.subplot(1,2,1)
+    a2=plt.subplot(1,2,2)
+    colors=plt.rcParams["axes.prop_cycle"].by_key().get("color",["b"])
 
 fibers=parse_fibers(args.fibers)
 
+statistics=[]
 for filename in args.psf :
-    psf=pyfits.open(filename)
-    spots=psf["SPOTS"].data
+    spots=read_spot_index(filename)
     if fibers is None :
-        fibers = np.unique(spots["FIBER"])
+        fibers = spots.fibers
+    statistics.append(spots.fiber_statistics(fibers))
+    if args.no_plot :
+        continue
 
-    for fiber in fibers :
-        ok1=np.where((spots["FIBER"]==fiber))[0]
-        ok2=np.where((spots["STATUS"]==1)&(spots["FIBER"]==fiber))[0]
-        a1.plot(spots["X"][ok1],spots["Y"][ok1],"x",c="gray")
-        a1.plot(spots["X"][ok2],spots["Y"][ok2],"o")
+    selected=spots.select(fibers)
+    valid=selected&spots.valid
+    # one color per fiber, as with one plot call per fiber
+    rank=np.searchsorted(np.unique(fibers),spots["FIBER"])
+    fiber_colors=np.array(colors)[rank%len(colors)]
 
+    a1.plot(spots["X"][selected],spots["Y"][selected],"x",c="gray")
+    a1.scatter(spots["X"][valid],spots["Y"][valid],c=fiber_colors[valid])
+
+    ok1=selected&spots.has_eflux
+    ok2=valid&spots.has_eflux
+    a2.plot(spots["WAVE"][ok1],spots["SNR"][ok1],"x",c="gray")
+    a2.scatter(spots["WAVE"][ok2],spots["SNR"][ok2],c=fiber_colors[ok2])
+
+if args.summary is not None :
+    summary=aggregate_statistics(statistics)
+    file=open(args.summary,"w")
+    file.write(summary_header+"\n")
+    for i in range(summary["FIBER"].size) :
+        file.write(format_summary_row(summary,i)+"\n")
+    file.close()
+
+if args.no_plot :
+    sys.exit(0)
 
-        ok1=np.where((spots["EFLUX"]>0)&(spots["FIBER"]==fiber))[0]
-        ok2=np.where((spots["STATUS"]==1)&(spots["EFLUX"]>0)&(spots["FIBER"]==fiber))[0]
-        a2.plot(spots["WAVE"][ok1],spots["FLUX"][ok1]/spots["EFLUX"][ok1],"x",c="gray")
-        a2.plot(spots["WAVE"][ok2],spots["FLUX"][ok2]/spots["EFLUX"][ok2],"o")
-        
 a1.set_xlabel("XCCD")
 a1.set_ylabel("YCCD")
 a2.set_xlabel("wavelength")
 a2.set_ylabel("S/N")
 a2.grid()        
-plt.show()
-
+if args.fig is not None :
+    fig.savefig(args.fig)
+if not args.batch :
+    plt.show()
@@ -3,7 +3,8 @@
 import numpy as np
 import astropy.io.fits as pyfits
 import matplotlib.pyplot as plt
-import specter.psf
+from teststand.psf import read_psf
+from teststand.stampcache import read_psf_with_stamp_cache
 import sys
 import argparse
 import string
@@ -11,16 +12,6 @@ import os.path
 from teststand.graph_tools import parse_fibers
 from desispec.log                  import get_logger
 
-def readpsf(filename) :
-    try :
-        psftype=pyfits.open(filename)[0].header["PSFTYPE"]
-    except KeyError :
-        psftype=""
-    if psftype=="GAUSS-HERMITE" :
-        return specter.psf.GaussHermitePSF(filename)
-    elif psftype=="SPOTGRID" :
-        return specter.psf.SpotGridPSF(filename)
-
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('--psf', type = str, nargs = "*", default = None, required = True,
                     help = 'path of psf files')
@@ -37,7 +28,7 @@ parser.add_argument('--wave', type = int, default = None, required = True,
 args        = parser.parse_args()
 log = get_logger()
 
-refpsf=readpsf(args.refpsf)
+refpsf=read_psf_with_stamp_cache(args.refpsf)
         
 #wmin=refpsf[0]._wmin_all
 #wmax=refpsf[0]._wmax_all
@@ -83,7 +74,8 @@ for filename in args.psf :
         continue
     
     log.info("reading %s"%filename)
-    psf = readpsf(filename)
+    # the coefficients of this psf are modified below, do not use the shared cache
+    psf = read_psf(filename, cache=False)
     
     ofile = open(ofilename,"w")
     ofile.write("# EXPNUM CAMID FIBER WAVE DX DY CX CY SX SY EBIAS\n")
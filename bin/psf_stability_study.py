@@ -2,25 +2,14 @@
 
 import numpy as np
 import astropy.io.fits as pyfits
-import matplotlib.pyplot as plt
-import specter.psf
+from teststand.stampcache import read_psf_with_stamp_cache
 import sys
 import argparse
 import string
 import os.path
-from teststand.graph_tools import parse_fibers
+from teststand.fibers import parse_fibers
 from desispec.log                  import get_logger
-
-def readpsf(filename) :
-    try :
-        psftype=pyfits.open(filename)[0].header["PSFTYPE"]
-    except KeyError :
-        psftype=""
-    print("PSF Type=",psftype)
-    if psftype=="GAUSS-HERMITE" :
-        return specter.psf.GaussHermitePSF(filename)
-    elif psftype=="SPOTGRID" :
-        return specter.psf.SpotGridPSF(filename)
+from teststand                     import instrument
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('--psf', type = str, nargs = "*", default = None, required = True,
@@ -30,14 +19,19 @@ parser.add_argument('--fibers', type = str, default = None, required = False,
 parser.add_argument('-o','--output', type = str, default = None, required = False,
                     help = 'path to output ascii file')
 parser.add_argument('--plot', action='store_true',help="plot result")
+instrument.add_arguments(parser)
 
 
 args        = parser.parse_args()
+instrument.init(args)
+if args.plot :
+    import matplotlib.pyplot as plt
 log = get_logger()
 psfs=[]
 for filename in args.psf :
     log.info("reading %s"%filename)
-    psfs.append(readpsf(filename))
+    with instrument.stage("read psf") :
+        psfs.append(read_psf_with_stamp_cache(filename))
 
 wmin=psfs[0]._wmin_all
 wmax=psfs[0]._wmax_all
@@ -66,6 +60,7 @@ for fiber in fibers :
         i1 = []
         xc = []
         yc = []
+        instrument.start_stage("psf stamps")
         for psf in psfs :
             xx, yy, ccdpix = psf.xypix(fiber,wave)
             xc.append(psf.x(fiber,wave))
@@ -83,6 +78,9 @@ for fiber in fibers :
             i1.append(xx.start)
             i0.append(yy.start)
         
+        instrument.stop_stage()
+        
+        instrument.start_stage("fit")
         mi0 = int(np.min(i0))
         mi1 = int(np.min(i1))
         n=len(images)
@@ -135,6 +133,7 @@ for fiber in fibers :
         res_y_rms.append(np.std(yc))
         res_fiber.append(fiber)
         res_wave.append(wave)
+        instrument.stop_stage()
         
 res_x=np.array(res_x)
 res_y=np.array(res_y)
@@ -146,11 +145,13 @@ res_x_rms=np.array(res_x_rms)
 res_y_rms=np.array(res_y_rms)
 
 if args.output :
+    instrument.start_stage("write")
     file=open(args.output,"w")
     file.write("# fiber wavelength rms_emission_line_flux rms_continuum_flux xccd yccd\n")
     for i in range(res_x.size) :
         file.write("%d %f %f %f %f %f\n"%(res_fiber[i],res_wave[i],res_emission_line_rms[i],res_continuum_rms[i],res_x[i],res_y[i]))
     file.close()
+    instrument.stop_stage()
                 
 
 if args.plot :
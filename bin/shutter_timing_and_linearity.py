@@ -6,7 +6,6 @@ import argparse
 import astropy.io.fits as pyfits
 import matplotlib.pyplot as plt
 import numpy as np
-from teststand.graph_tools         import plot_graph,parse_fibers
 from desispec.log                  import get_logger
 import os.path
 
@@ -2,22 +2,11 @@
 
 import numpy as np
 import astropy.io.fits as pyfits
-import specter.psf
+from teststand.psf import read_psf
 import sys
 import argparse
 import string
 import os.path
-def readpsf(filename) :
-    try :
-        psftype=pyfits.open(filename)[0].header["PSFTYPE"]
-    except KeyError :
-        psftype=""
-    print("PSF Type=",psftype)
-    if psftype=="GAUSS-HERMITE" :
-        return specter.psf.GaussHermitePSF(filename)
-    elif psftype=="SPOTGRID" :
-        return specter.psf.SpotGridPSF(filename)
-
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('--psf', type = str, default = None, required = True,
                     help = 'path of psf file')
@@ -31,7 +20,7 @@ parser.add_argument('-o','--output', type = str, default = None, required = True
 
 args        = parser.parse_args()
 
-psf=readpsf(args.psf)
+psf=read_psf(args.psf)
 xy=psf.xy(args.fiber,args.wave)
 hw=4.
 n1d=2*hw*8+1
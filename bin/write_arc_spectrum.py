@@ -5,7 +5,7 @@ import numpy as np
 import argparse
 import sys
 import os.path
-import desimodel.io
+from teststand.linelist import read_line_list
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument('-i','--infile', type = str, default = None, required=True,
@@ -15,24 +15,7 @@ parser.add_argument('-o','--outfile', type = str, default = None, required=True,
 
 args = parser.parse_args()
 
-wave=[]
-ion=[]
-intensity=[]
-ifile=open(args.infile)
-for line in ifile.readlines() :
-    if line[0]=="#" :
-        continue
-    vals=line.strip().split()
-    if len(vals)==3 :
-        wave.append(float(vals[0]))
-        ion.append((vals[1]))
-        intensity.append((float(vals[2])))
-    else :
-        print("WARNING IGNORE LINE '%s'"%line.strip())
-    ifile.close()
-wave=np.array(wave)
-ion=np.array(ion)
-intensity=np.array(intensity)
+wave,ion,intensity=read_line_list(args.infile)
 
 ok=np.where(intensity>0)[0]
 wave=wave[ok]
@@ -48,6 +31,6 @@ cols.append(fits.Column(name='ION', format='8A', array=ion))
 cols = fits.ColDefs(cols)
 hdulist=fits.HDUList([fits.PrimaryHDU()])
 hdulist.append(fits.BinTableHDU.from_columns(cols))
-hdulist.writeto(args.outfile,clobber=True)
+hdulist.writeto(args.outfile,overwrite=True)
 
 print("wrote %d lines in %s"%(wave.size,args.outfile))
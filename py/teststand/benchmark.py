@@ -0,0 +1,294 @@
+import numpy as np
+import os
+import sys
+import json
+import time
+import runpy
+import shutil
+import platform
+import datetime
+import subprocess
+import resource
+
+from desispec.log import get_logger
+from teststand.synth import SynthSpectrograph, arc_lines, write_ptc_ladder
+
+# problem sizes, from a 20 fiber teststand camera to a full DESI camera
+scales = {"small"  : {"nfibers":20,  "npix_y":1024, "nimages":5},
+          "medium" : {"nfibers":100, "npix_y":2048, "nimages":10},
+          "large"  : {"nfibers":500, "npix_y":4096, "nimages":20}}
+
+def default_history_filename() :
+    """Returns the benchmark history filename, $TESTSTAND_BENCHMARKS if set"""
+    return os.environ.get("TESTSTAND_BENCHMARKS","teststand-benchmarks.json")
+
+def script_path(name) :
+    """Path of a script of the bin directory, from the PATH or from the source tree"""
+    path = shutil.which(name)
+    if path is None :
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","..","bin",name)
+    return os.path.abspath(path)
+
+def _run_script(name, argv) :
+    path = script_path(name)
+    saved = sys.argv
+    sys.argv = [path]+argv
+    try :
+        runpy.run_path(path,run_name="__main__")
+    except SystemExit as e :
+        if e.code not in (None,0) :
+            raise RuntimeError("%s exited with status %s"%(name,str(e.code)))
+    finally :
+        sys.argv = saved
+
+###################################################################
+# benchmark cases
+# each setup function prepares the inputs (not timed) and returns
+# the function to time and a dictionary of processed quantities
+###################################################################
+
+def setup_boxcar(workdir, nfibers, npix_y, nimages) :
+    from teststand.boxcar_extraction import boxcar
+    spectro = SynthSpectrograph(nfibers=nfibers, npix_y=npix_y)
+    flux    = spectro.spectra(lines=arc_lines(spectro.wavemin,spectro.wavemax),continuum_amplitude=100.)
+    image   = spectro.preproc(spectro.image(flux),spectro.header(expnum=1))
+    psf     = spectro.bootcalib_psf()
+    def run() :
+        boxcar(psf, image, width=7)
+    return run, {"pixels":nfibers*npix_y}
+
+def setup_resample(workdir, nfibers, npix_y, nimages) :
+    from teststand.resample import resample_to_same_wavelength_grid
+    spectro = SynthSpectrograph(nfibers=nfibers, npix_y=npix_y)
+    frame   = spectro.frame(spectro.spectra(continuum_amplitude=1000.),spectro.header(expnum=1))
+    spectra, ivar, wave = frame[0].data, frame["IVAR"].data, frame["WAVELENGTH"].data
+    def run() :
+        resample_to_same_wavelength_grid(spectra, ivar, wave)
+    return run, {"pixels":nfibers*npix_y}
+
+def setup_median_image(workdir, nfibers, npix_y, nimages) :
+    spectro = SynthSpectrograph(nfibers=nfibers, npix_y=npix_y)
+    image   = spectro.image(spectro.spectra(continuum_amplitude=1000.))
+    filenames = []
+    for i in range(nimages) :
+        filename = os.path.join(workdir,"preproc-%s-%08d.fits"%(spectro.camera,i))
+        spectro.preproc(image,spectro.header(expnum=i)).writeto(filename,overwrite=True)
+        filenames.append(filename)
+    outfile = os.path.join(workdir,"median.fits")
+    def run() :
+        _run_script("desi_median_image",["-i"]+filenames+["-o",outfile])
+    return run, {"pixels":nimages*spectro.npix_x*spectro.npix_y, "frames":nimages}
+
+def setup_compute_gains(workdir, nfibers, npix_y, nimages) :
+    spectro = SynthSpectrograph(nfibers=nfibers, npix_y=npix_y)
+    psf = os.path.join(workdir,"psfboot-%s.fits"%spectro.camera)
+    spectro.bootcalib_psf().writeto(psf,overwrite=True)
+    filenames = write_ptc_ladder(spectro, workdir, levels=(10000.,), nexp=max(3,nimages),
+                                 gains={"A":1.2,"B":1.3,"C":1.4,"D":1.5})
+    def run() :
+        _run_script("desi_compute_gains",["-i"]+filenames+["-a","A","B","--psf",psf,"--nocalib","--nmc","10","--margin","10"])
+    return run, {"pixels":len(filenames)*spectro.npix_x*spectro.npix_y//2, "frames":len(filenames)}
+
+# modules used by the batch tools, and heavy packages they must not load at import time
+batch_modules = ["teststand.fibers","teststand.boxcar_extraction","teststand.resample","teststand.graph_tools",
+                 "teststand.index","teststand.ics","teststand.linearity","teststand.instrument",
+                 "teststand.prefetch","teststand.psf"]
+heavy_modules = ["matplotlib","specter","desimodel","desispec.io","desispec.preproc","desispec.interpolation"]
+
+def import_time(modules, python=None) :
+    """Time to import a list of modules in a fresh interpreter (excluding the interpreter startup)
+
+        -------
+        Returns
+        -------
+
+        time in seconds, list of the heavy_modules that were loaded
+
+        """
+    if python is None :
+        python = sys.executable
+    code = "import sys,time; t0=time.time(); import %s; print(time.time()-t0); print(' '.join(sys.modules.keys()))"%(", ".join(modules))
+    output = subprocess.check_output([python,"-c",code],env=dict(os.environ,MPLBACKEND="Agg")).decode().split("\n")
+    loaded = output[1].split()
+    heavy = [m for m in heavy_modules if m in loaded]
+    return float(output[0]), heavy
+
+def check_imports(modules=None, budget=1.) :
+    """Import time budget check : each module must load in less than budget seconds
+    and must not load any of heavy_modules
+
+        -------
+        Returns
+        -------
+
+        list of (module, time, heavy modules loaded, ok)
+
+        """
+    if modules is None :
+        modules = batch_modules
+    res = []
+    for module in modules :
+        t, heavy = import_time([module])
+        res.append((module, t, heavy, (t<budget and len(heavy)==0)))
+    return res
+
+def setup_imports(workdir, nfibers, npix_y, nimages) :
+    def run() :
+        t, heavy = import_time(batch_modules)
+    return run, {"imports":len(batch_modules)}
+
+cases = {"boxcar":setup_boxcar,
+         "resample":setup_resample,
+         "median_image":setup_median_image,
+         "compute_gains":setup_compute_gains,
+         "imports":setup_imports}
+
+###################################################################
+
+def _current_rss_kb() :
+    try :
+        with open("/proc/self/statm") as file :
+            return int(file.read().split()[1])*os.sysconf("SC_PAGE_SIZE")//1024
+    except (OSError, ValueError) :
+        return 0
+
+def _measure(func) :
+    rss0 = _current_rss_kb()
+    t0   = time.time()
+    func()
+    wall = time.time()-t0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"wall":wall, "maxrss_mb":maxrss/1024., "deltarss_mb":max(0,maxrss-rss0)/1024.}
+
+def measure_in_child(func) :
+    """Run func in a forked process so that its peak memory is not polluted by previous runs
+
+        -------
+        Returns
+        -------
+
+        dictionary with wall time (s), peak RSS (MB) and peak RSS increase during the run (MB)
+
+        """
+    if not hasattr(os,"fork") :
+        return _measure(func)
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0 :
+        os.close(rfd)
+        try :
+            res = _measure(func)
+        except BaseException as e :
+            res = {"error":"%s: %s"%(type(e).__name__,str(e))}
+        with os.fdopen(wfd,"w") as file :
+            json.dump(res,file)
+        os._exit(0)
+    os.close(wfd)
+    with os.fdopen(rfd) as file :
+        text = file.read()
+    os.waitpid(pid,0)
+    if len(text)==0 :
+        return {"error":"benchmark process died"}
+    return json.loads(text)
+
+def run_case(name, scale, workdir, repeat=3) :
+    """Setup and time a benchmark case at a given scale, the best of repeat runs is kept
+
+        -------
+        Returns
+        -------
+
+        dictionary with case, scale, parameters, wall, maxrss_mb, deltarss_mb, throughput
+        (quantities per second, like pixels/s and frames/s), or error
+
+        """
+    log = get_logger()
+    params = scales[scale]
+    casedir = os.path.join(workdir,"%s-%s"%(name,scale))
+    if not os.path.isdir(casedir) :
+        os.makedirs(casedir)
+    log.info("setup %s %s %s"%(name,scale,str(params)))
+    func, counts = cases[name](casedir, **params)
+    best = None
+    for r in range(repeat) :
+        res = measure_in_child(func)
+        if "error" in res :
+            log.error("%s %s failed : %s"%(name,scale,res["error"]))
+            best = res
+            break
+        log.info("%s %s run #%d : %.3f s, peak RSS %.1f MB"%(name,scale,r,res["wall"],res["maxrss_mb"]))
+        if best is None or res["wall"] < best["wall"] :
+            best = res
+    result = {"case":name, "scale":scale, "params":params}
+    result.update(best)
+    if "wall" in best :
+        result["throughput"] = dict([("%s/s"%k,v/max(best["wall"],1e-9)) for k,v in counts.items()])
+    return result
+
+def _git_commit() :
+    try :
+        return subprocess.check_output(["git","rev-parse","--short","HEAD"],cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError) :
+        return None
+
+def run_benchmarks(names, scale_names, workdir, repeat=3) :
+    """Run several cases at several scales, returns a run record for the history"""
+    results = []
+    for scale in scale_names :
+        for name in names :
+            results.append(run_case(name,scale,workdir,repeat))
+    return {"date":datetime.datetime.now().isoformat(),
+            "host":platform.node(),
+            "commit":_git_commit(),
+            "python":platform.python_version(),
+            "numpy":np.__version__,
+            "results":results}
+
+def load_history(filename) :
+    """List of runs stored in a benchmark history file (empty if the file does not exist)"""
+    if not os.path.isfile(filename) :
+        return []
+    with open(filename) as file :
+        return json.load(file)
+
+def append_history(filename, run) :
+    history = load_history(filename)
+    history.append(run)
+    tmp = filename+".tmp"
+    with open(tmp,"w") as file :
+        json.dump(history,file,indent=1)
+    os.replace(tmp,filename)
+    return len(history)
+
+def compare_runs(reference, current, threshold=0.1) :
+    """Compare the wall time and peak memory increase of two runs
+
+        ----------
+        Parameters
+        ----------
+
+        reference, current : run records (see run_benchmarks)
+        threshold : relative increase above which a result is flagged as a regression
+
+        -------
+        Returns
+        -------
+
+        list of dictionaries with case, scale, ref and current wall and deltarss_mb, ratios and regression flag
+
+        """
+    ref = dict([((r["case"],r["scale"]),r) for r in reference["results"] if "wall" in r])
+    res = []
+    for r in current["results"] :
+        key = (r["case"],r["scale"])
+        if not key in ref or not "wall" in r :
+            continue
+        wall_ratio = r["wall"]/max(ref[key]["wall"],1e-9)
+        # memory increases smaller than 10 MB are not significant
+        rss_ratio  = (r["deltarss_mb"]+10.)/(ref[key]["deltarss_mb"]+10.)
+        res.append({"case":key[0], "scale":key[1],
+                    "ref_wall":ref[key]["wall"], "wall":r["wall"], "wall_ratio":wall_ratio,
+                    "ref_deltarss_mb":ref[key]["deltarss_mb"], "deltarss_mb":r["deltarss_mb"], "rss_ratio":rss_ratio,
+                    "regression":(wall_ratio>1+threshold) or (rss_ratio>1+threshold)})
+    return res
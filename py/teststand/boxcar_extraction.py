@@ -2,36 +2,30 @@ import numpy as np
 from numpy.polynomial.legendre import legval, legfit
 
 from desispec.log import get_logger
+from teststand.instrument import stage, timed
 
 ################
 #   RETURNS FITS FILE INCLUDING ELECTRONS QUANTITY
 ################
 
-def boxcar(psf, image_file, fibers=None, width=7, side_bands=False) :
-    """Find and returns  wavelength  spectra and inverse variance
+@timed("read psf")
+def psf_traces(psf) :
+    """Read the trace coordinates of a bootcalib or GAUSS-HERMITE psf
 
         ----------
         Parameters
         ----------
 
-        psf     : File Descriptor
-        Where the wavelength is collected.
-
-        pix     : File Descriptor
-        Interpreted photons using the wavelength.
-
-        fibers : Optional. If left empty, will extract all fibers.
+        psf : File Descriptor
 
         -------
         Returns
         -------
 
-        spectra, ivar, wavelength
+        wavemin, wavemax, xcoef, ycoef
 
         """
     log=get_logger()
-    log.info("Starting boxcar extraction...")
-
     # it is a boot or specex psf ?
     psftype=psf[0].header["PSFTYPE"]
     log.info("psf is a '%s'"%psftype)
@@ -40,7 +34,6 @@ def boxcar(psf, image_file, fibers=None, width=7, side_bands=False) :
         wavemax = psf[0].header["WAVEMAX"]
         xcoef   = psf[0].data
         ycoef   = psf[1].data
-        xsig    = psf[2].data
     elif psftype == "GAUSS-HERMITE" :
         table=psf[1].data        
         i=np.where(table["PARAM"]=="X")[0][0]
@@ -49,85 +42,239 @@ def boxcar(psf, image_file, fibers=None, width=7, side_bands=False) :
         xcoef=table["COEFF"][i]
         i=np.where(table["PARAM"]=="Y")[0][0]
         ycoef=table["COEFF"][i]
-        i=np.where(table["PARAM"]=="GHSIGX")[0][0]
-        xsig=table["COEFF"][i]
-
-    if fibers is None :
-        fibers = np.arange(xcoef.shape[0])
-    
     log.info("wavelength range : [%f,%f]"%(wavemin,wavemax))
-    
-    
-    log.debug("xcoef.shape",xcoef.shape)
-    log.debug("ycoef.shape",ycoef.shape)
-    
+    return wavemin, wavemax, xcoef, ycoef
 
-    flux        = image_file[0].data
-    #   Inverse variance of the image's value
-    flux_ivar   = image_file["IVAR"].data
-    #   Use masked pixels 
-    flux_mask   = image_file["MASK"].data
-    flux_ivar   *= (flux_mask==0)
-    
-    #   Variance based on inverse variance's size
-    flux_var    = np.zeros(flux_ivar.shape)
+def trace_geometry(psf, npix_y, fibers=None, width=7) :
+    """Boxcar boundaries and wavelength of each CCD row for each fiber.
+    It only depends on the psf, so it can be computed once for many images.
 
-    #   Applying a mask that keeps positive value to get the Variance by inversing the inverse variance.
-    mask        = (flux_ivar > 0)
-    flux_var[mask] = 1./flux_ivar[mask]
+        ----------
+        Parameters
+        ----------
+
+        psf    : File Descriptor, or the tuple (wavemin, wavemax, xcoef, ycoef) returned by psf_traces
+        npix_y : number of CCD rows
+        fibers : Optional. If left empty, will use all fibers.
+        width  : boxcar width
+
+        -------
+        Returns
+        -------
+
+        dictionary with fibers, width, x1, x2 (first and last+1 columns of the boxcar, arrays (nfibers, npix_y)) and wave
+
+        """
+    log=get_logger()
+    if isinstance(psf,tuple) :
+        wavemin, wavemax, xcoef, ycoef = psf
+    else :
+        wavemin, wavemax, xcoef, ycoef = psf_traces(psf)
 
-    #   Number of pixels in an image 
-    #   We are going to extract one flux per fiber per Y pixel (total = nfibers x npix_y)
-    npix_y  = flux.shape[0]
-    npix_x  = flux.shape[1]
-    
     nfibers = xcoef.shape[0]
+    if fibers is None :
+        fibers = np.arange(nfibers)
+    fibers = np.asarray(fibers)
     if np.max(fibers) >= nfibers :
         log.warning("requested fiber numbers %s exceed number of fibers in file %d"%(str(fibers),nfibers))
         ii=np.where(fibers<nfibers)
         fibers=fibers[ii]
-    
-    #   Flux as a function of wavelength
-    spectra             = np.zeros((fibers.size,npix_y))
-    #   Inverse-variance of spectrum
-    spectra_ivar        = np.zeros((fibers.size,npix_y))
-    #   Wavelength
-    wave_of_y           = np.zeros((fibers.size, npix_y))
 
+    x1_of_y   = np.zeros((fibers.size,npix_y),dtype=int)
+    x2_of_y   = np.zeros((fibers.size,npix_y),dtype=int)
+    wave_of_y = np.zeros((fibers.size,npix_y))
+    for f,fiber in enumerate(fibers) :
+        x1_of_y[f], x2_of_y[f], wave_of_y[f] = invert_legendre_polynomial(wavemin, wavemax, ycoef, xcoef, fiber, npix_y, width)
+    return {"fibers":fibers, "width":width, "x1":x1_of_y, "x2":x2_of_y, "wave":wave_of_y}
+
+def column_band(geometry, npix_x, side_bands=False) :
+    """First and last+1 CCD columns used by the extraction of the fibers of a trace_geometry
+
+        The whole image width is returned if the boxcars (and side bands) extend beyond the CCD edges,
+        so that the pixel indexing near the edges is the same as for the full image.
+
+        """
+    hw   = geometry["width"]//2
+    xmin = np.min(geometry["x1"])
+    xmax = np.max(geometry["x2"])
+    if side_bands :
+        xmin -= hw
+        xmax += hw+1
+    if xmin < 0 or xmax > npix_x :
+        return 0, npix_x
+    return int(xmin), int(xmax)
+
+def read_column_band(hdu, xmin, xmax, ymin=0, ymax=None) :
+    """Copy of the columns [xmin,xmax[ (and rows [ymin,ymax[) of an image HDU, without reading the other pixels from the file
+
+        The band is sliced from the memory map of the data if the file is memory mapped (the default of astropy),
+        only the pages of the band are then read. Otherwise it is read row by row with a section.
+
+        """
+    info = hdu.fileinfo()
+    if info is None or info["file"].memmap :
+        return np.array(hdu.data[ymin:ymax,xmin:xmax])
+    return np.array(hdu.section[ymin:ymax,xmin:xmax])
+
+def extract_rows(flux, flux_ivar, flux_var, x1_of_y, x2_of_y, hw, side_bands, spectra, spectra_ivar) :
+    """Boxcar extraction of one fiber in a band of rows, results are written in spectra and spectra_ivar (arrays of the band rows)
+
+        All the rows are summed at once, the rows where the boxcar (or side bands) extends beyond the image
+        are extracted one at a time with the same slicing as the whole image extraction.
+
+        ----------
+        Parameters
+        ----------
+
+        flux, flux_ivar, flux_var : image arrays of the band (nrows, ncols)
+        x1_of_y, x2_of_y : first and last+1 columns of the boxcar in the band for each row
+        hw : width of the side bands (half the boxcar width)
+
+        """
+    nrows, ncols = flux.shape
+    lo = x1_of_y-hw*side_bands
+    hi = x2_of_y+(hw+1)*side_bands
+    boxwidth = np.max(x2_of_y-x1_of_y) if nrows > 0 else 0
+    inside = (lo>=0)&(hi<=ncols)&((x2_of_y-x1_of_y)==boxwidth)
+    rows   = np.where(inside)[0]
+    if rows.size > 0 :
+        r = rows[:,None]
+        center = x1_of_y[rows][:,None]+np.arange(boxwidth)
+        if not side_bands :
+            total = center
+        else :
+            left  = (x1_of_y[rows]-hw)[:,None]+np.arange(hw)
+            right = x2_of_y[rows][:,None]+np.arange(hw+1)
+            total = (x1_of_y[rows]-hw)[:,None]+np.arange(boxwidth+2*hw+1)
+        #   Checking if there's a dead pixel
+        valid = np.all(flux_ivar[r,total]>0,axis=1)
+        #   Sum of flux
+        sflux = np.sum(flux[r,center],axis=1)
+        if side_bands :
+            sflux = sflux - np.sum(flux[r,left],axis=1) - np.sum(flux[r,right],axis=1)
+        #   Sum of variance
+        var = np.sum(flux_var[r,total],axis=1)
+        spectra[rows] = np.where(valid,sflux,0.)
+        ivar = np.zeros(rows.size)
+        ivar[valid] = 1./var[valid]
+        spectra_ivar[rows] = ivar
+    for y in np.where(~inside)[0] :
+        x1 = x1_of_y[y]
+        x2 = x2_of_y[y]
+        spectra[y] = 0.
+        spectra_ivar[y] = 0.
+        if not side_bands :
+            if np.sum(flux_ivar[y, x1:x2] <= 0) == 0 :
+                spectra[y] = np.sum(flux[y, x1:x2])
+                spectra_ivar[y] = 1./np.sum(flux_var[y, x1:x2])
+        else :
+            if np.sum(flux_ivar[y, x1-hw:x2+hw+1] <= 0) == 0 :
+                spectra[y] = np.sum(flux[y, x1:x2]) -  np.sum(flux[y, x1-hw:x1]) - np.sum(flux[y, x2:x2+hw+1])
+                spectra_ivar[y] = 1./np.sum(flux_var[y, x1-hw:x2+hw+1])
+
+@timed("boxcar")
+def boxcar(psf, image_file, fibers=None, width=7, side_bands=False, geometry=None, band_rows=None, out=None, dtype=np.float64) :
+    """Find and returns  wavelength  spectra and inverse variance
+
+        Only the band of CCD columns covered by the requested fibers (boxcar width and side bands)
+        is read from the image, and the variance is computed on this band only.
+        With band_rows, the image is read and extracted in bands of rows, so that the memory used
+        is a band of the image plus the outputs.
+
+        ----------
+        Parameters
+        ----------
+
+        psf     : File Descriptor
+        Where the wavelength is collected.
+
+        pix     : File Descriptor
+        Interpreted photons using the wavelength.
+
+        fibers : Optional. If left empty, will extract all fibers.
+
+        geometry : Optional. Precomputed trace_geometry, in which case psf, fibers and width are ignored.
+
+        band_rows : Optional. Number of CCD rows read and extracted at once, default is all.
+
+        out : Optional. Preallocated (spectra, ivar) arrays (nfibers, npix_y), like float32 arrays or np.memmap.
+
+        dtype : type of the spectra and ivar arrays if out is not given.
+
+        -------
+        Returns
+        -------
+
+        spectra, ivar, wavelength
+
+        """
+    log=get_logger()
+    log.info("Starting boxcar extraction...")
+
+    #   Number of pixels in an image 
+    #   We are going to extract one flux per fiber per Y pixel (total = nfibers x npix_y)
+    npix_y  = image_file[0].header["NAXIS2"]
+    npix_x  = image_file[0].header["NAXIS1"]
+    
 ###
 # Using legendre's polynomial to get a spectrum per fiber
 ###
 
-    for f,fiber in enumerate(fibers) :
-        log.info("extracting fiber #%03d"%fiber)
-        x1_of_y, x2_of_y, tmp_wave = invert_legendre_polynomial(wavemin, wavemax, ycoef, xcoef, fiber, npix_y, width)
-        wave_of_y[f] = tmp_wave
-        
-        hw=width//2
-        if not side_bands :
-            for y in range(npix_y) :
-                #   Checking if there's a dead pixel
-                nb_invalidPix   = np.sum(flux_ivar[y, x1_of_y[y]:x2_of_y[y]] <= 0)
-                if nb_invalidPix == 0 :
-                    #   Sum of flux
-                    spectra[f, y]   = np.sum(flux[y, x1_of_y[y]:x2_of_y[y]])
-                    #   Sum of variance
-                    var                 = np.sum(flux_var[y, x1_of_y[y]:x2_of_y[y]])
-                    #   Spectrum of inverse variance
-                    spectra_ivar[f, y] = 1./var
-        else :
-           for y in range(npix_y) :
-               #   Checking if there's a dead pixel
-               
-               nb_invalidPix   = np.sum(flux_ivar[y, x1_of_y[y]-hw:x2_of_y[y]+hw+1] <= 0)
-               if nb_invalidPix == 0 :
-                   #   Sum of flux
-                   spectra[f, y]   = np.sum(flux[y, x1_of_y[y]:x2_of_y[y]]) -  np.sum(flux[y, x1_of_y[y]-hw:x1_of_y[y]]) - np.sum(flux[y, x2_of_y[y]:x2_of_y[y]+hw+1])
-                   #   Sum of variance
-                   var                 = np.sum(flux_var[y, x1_of_y[y]-hw:x2_of_y[y]+hw+1])
-                   #   Spectrum of inverse variance
-                   spectra_ivar[f, y] = 1./var 
+    if geometry is None :
+        with stage("trace inversion") :
+            geometry = trace_geometry(psf, npix_y, fibers, width)
+    fibers    = geometry["fibers"]
+    width     = geometry["width"]
+    wave_of_y = geometry["wave"].copy()
+    hw        = width//2
+
+    #   Columns [xmin,xmax[ of the image used by the requested fibers
+    xmin, xmax = column_band(geometry, npix_x, side_bands)
+    log.debug("reading columns [%d,%d[ of the image"%(xmin,xmax))
+
+    if out is not None :
+        #   Flux as a function of wavelength, and inverse-variance of spectrum
+        spectra, spectra_ivar = out
+        if spectra.shape != (fibers.size,npix_y) or spectra_ivar.shape != (fibers.size,npix_y) :
+            raise ValueError("output arrays must have the shape %s"%str((fibers.size,npix_y)))
+    else :
+        #   Flux as a function of wavelength
+        spectra             = np.zeros((fibers.size,npix_y),dtype=dtype)
+        #   Inverse-variance of spectrum
+        spectra_ivar        = np.zeros((fibers.size,npix_y),dtype=dtype)
+
+    if band_rows is None :
+        band_rows = npix_y
 
+    for ymin in range(0,npix_y,band_rows) :
+        ymax = min(ymin+band_rows,npix_y)
+        log.debug("extracting rows [%d,%d["%(ymin,ymax))
+
+        with stage("read image") :
+            flux        = read_column_band(image_file[0], xmin, xmax, ymin, ymax)
+            #   Inverse variance of the image's value
+            flux_ivar   = read_column_band(image_file["IVAR"], xmin, xmax, ymin, ymax)
+            #   Use masked pixels 
+            flux_mask   = read_column_band(image_file["MASK"], xmin, xmax, ymin, ymax)
+            flux_ivar   *= (flux_mask==0)
+            del flux_mask
+
+            #   Variance based on inverse variance's size
+            flux_var    = np.zeros(flux_ivar.shape)
+
+            #   Applying a mask that keeps positive value to get the Variance by inversing the inverse variance.
+            mask        = (flux_ivar > 0)
+            flux_var[mask] = 1./flux_ivar[mask]
+            del mask
+
+        with stage("extraction") :
+            for f,fiber in enumerate(fibers) :
+                if ymin == 0 :
+                    log.info("extracting fiber #%03d"%fiber)
+                #   Boxcar boundaries in the column band
+                extract_rows(flux, flux_ivar, flux_var,
+                             geometry["x1"][f][ymin:ymax] - xmin, geometry["x2"][f][ymin:ymax] - xmin,
+                             hw, side_bands, spectra[f,ymin:ymax], spectra_ivar[f,ymin:ymax])
 
     log.info("Boxcar extraction complete")
     return spectra, spectra_ivar, wave_of_y
@@ -149,3 +296,19 @@ def invert_legendre_polynomial(wavemin, wavemax, ycoef, xcoef, fiber, npix_y, wi
     x1_of_y             = (np.floor(x_of_y).astype(int) - width//2).astype(int)
     x2_of_y             = (np.floor(x_of_y).astype(int) + width//2 + 1).astype(int)
     return (x1_of_y, x2_of_y, wave_of_y)
+
+def make_frame(spectra, ivar, wave, image_header=None) :
+    """Frame HDUList (FLUX, IVAR, WAVELENGTH) with the keywords of the preprocessed image header"""
+    import astropy.io.fits as pyfits
+    frame = pyfits.HDUList([pyfits.PrimaryHDU(spectra),
+                            pyfits.ImageHDU(ivar,name="IVAR"),
+                            pyfits.ImageHDU(wave,name="WAVELENGTH")])
+    frame[0].header["EXTNAME"]="FLUX"
+
+    # add content of preproc header
+    if image_header is not None :
+        blacklist = ["EXTEND","SIMPLE","NAXIS1","NAXIS2","CHECKSUM","DATASUM","XTENSION","EXTNAME","COMMENT"]
+        for key in image_header:
+            if ( key not in blacklist ) and ( key not in frame[0].header ) :        
+                frame[0].header[key] = image_header[key] 
+    return frame
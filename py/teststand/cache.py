@@ -0,0 +1,119 @@
+import os
+import sys
+import types
+import hashlib
+import threading
+from collections import OrderedDict
+
+def nbytes(value, seen=None) :
+    """Approximate memory size of a value made of numpy arrays, tuples, lists, dictionaries
+    and objects with attributes (like specter PSFs)"""
+    if seen is None :
+        seen = set()
+    if id(value) in seen :
+        return 0
+    seen.add(id(value))
+    if hasattr(value,"nbytes") :
+        return int(value.nbytes)
+    if isinstance(value,(tuple,list)) :
+        return sum([nbytes(v,seen) for v in value])+sys.getsizeof(value)
+    if isinstance(value,dict) :
+        return sum([nbytes(v,seen) for v in value.values()])+sys.getsizeof(value)
+    if hasattr(value,"__dict__") and not isinstance(value,(type,types.ModuleType,types.FunctionType,types.MethodType)) :
+        return nbytes(vars(value),seen)+sys.getsizeof(value)
+    return sys.getsizeof(value)
+
+def file_key(filename) :
+    """Cache key of a file : absolute path, modification time and size,
+    so that a cached value is not used anymore if the file is rewritten"""
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+def file_hash(filename, blocksize=1<<20) :
+    """sha256 of the content of a file"""
+    h = hashlib.sha256()
+    with open(filename,"rb") as file :
+        while True :
+            block = file.read(blocksize)
+            if not block :
+                break
+            h.update(block)
+    return h.hexdigest()
+
+class MemoryLRUCache(object) :
+    """Thread safe least recently used cache with a memory budget
+
+        Values are evicted, least recently used first, when the sum of their sizes
+        (see nbytes) exceeds maxbytes. A value larger than maxbytes is not stored.
+
+        ----------
+        Parameters
+        ----------
+
+        maxbytes : memory budget in bytes
+
+        """
+    def __init__(self, maxbytes=1024**3) :
+        self.maxbytes = maxbytes
+        self.data  = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def __len__(self) :
+        return len(self.data)
+
+    def __contains__(self, key) :
+        with self.lock :
+            return key in self.data
+
+    def get(self, key, default=None) :
+        with self.lock :
+            if key in self.data :
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, size=None) :
+        if size is None :
+            size = nbytes(value)
+        with self.lock :
+            self.pop(key)
+            if size > self.maxbytes :
+                return
+            self.data[key] = value
+            self.sizes[key] = size
+            self.nbytes += size
+            while self.nbytes > self.maxbytes :
+                old, _ = self.data.popitem(last=False)
+                self.nbytes -= self.sizes.pop(old)
+
+    def pop(self, key) :
+        with self.lock :
+            if key in self.data :
+                self.nbytes -= self.sizes.pop(key)
+                return self.data.pop(key)
+        return None
+
+    def clear(self) :
+        with self.lock :
+            self.data.clear()
+            self.sizes.clear()
+            self.nbytes = 0
+
+    def get_or_compute(self, key, func) :
+        """Returns the cached value of key, or computes it with func() and stores it"""
+        value = self.get(key, self)
+        if value is self :
+            value = func()
+            self.put(key, value)
+        return value
+
+    def stats(self) :
+        with self.lock :
+            return {"entries":len(self.data), "nbytes":self.nbytes, "maxbytes":self.maxbytes,
+                    "hits":self.hits, "misses":self.misses}
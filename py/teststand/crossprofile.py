@@ -0,0 +1,180 @@
+import numpy as np
+from numpy.polynomial.legendre import legval, legfit
+
+from desispec.log import get_logger
+
+def u(wave, wavemin, wavemax) :
+    return 2. * (wave - wavemin)/(wavemax - wavemin) - 1.
+
+def read_traces(psf) :
+    """Returns wavemin, wavemax and the legendre coefficients of the x, y traces and of the cross-dispersion sigma
+
+        ----------
+        Parameters
+        ----------
+
+        psf : File Descriptor
+        bootcalib or GAUSS-HERMITE psf
+
+        """
+    psftype=psf[0].header["PSFTYPE"]
+    if psftype == "bootcalib" :
+        wavemin   = psf[0].header["WAVEMIN"]
+        wavemax   = psf[0].header["WAVEMAX"]
+        xcoef     = psf[0].data
+        ycoef     = psf[1].data
+        sigmacoef = psf[2].data
+    elif psftype == "GAUSS-HERMITE" :
+        table=psf[1].data
+        i=np.where(table["PARAM"]=="X")[0][0]
+        wavemin=table["WAVEMIN"][i]
+        wavemax=table["WAVEMAX"][i]
+        xcoef=table["COEFF"][i]
+        i=np.where(table["PARAM"]=="Y")[0][0]
+        ycoef=table["COEFF"][i]
+        i=np.where(table["PARAM"]=="GHSIGX")[0][0]
+        sigmacoef=table["COEFF"][i]
+    else :
+        raise ValueError("unknown psf type '%s'"%psftype)
+    return wavemin, wavemax, xcoef, ycoef, sigmacoef
+
+def trace_of_y(wavemin, wavemax, ycoef, xcoef, sigmacoef, fiber, npix_y) :
+    """Returns the wavelength, x center and cross-dispersion sigma of a fiber trace for each CCD row
+    """
+    wave        = np.linspace(wavemin, wavemax, 100)
+    y_of_wave   = legval(u(wave, wavemin, wavemax), ycoef[fiber])
+    coef        = legfit(u(y_of_wave, 0, npix_y), wave, deg=ycoef[fiber].size)
+    wave_of_y   = legval(u(np.arange(npix_y).astype(float), 0, npix_y), coef)
+    x_of_y      = legval(u(wave_of_y, wavemin, wavemax), xcoef[fiber])
+    sigma_of_y  = legval(u(wave_of_y, wavemin, wavemax), sigmacoef[fiber])
+    return wave_of_y, x_of_y, sigma_of_y
+
+def stack_profiles(flux, ivar, xc_of_y, sigma_of_y, row_bin, nbins, width=5, oversampling=4, minflux=10.) :
+    """Stacks oversampled cross-dispersion profiles of one fiber trace in bins of CCD rows
+
+        All rows are processed at once : the pixels of each row are linearly interpolated
+        on the oversampled grid (same as np.interp, including its constant extrapolation),
+        and the rows are accumulated in their bin with np.add.at .
+
+        ----------
+        Parameters
+        ----------
+
+        flux, ivar : 2D images (npix_y, npix_x)
+        xc_of_y, sigma_of_y : trace center and cross-dispersion sigma for each row
+        row_bin : bin index of each row (negative or >= nbins to ignore the row)
+        nbins : number of bins
+        width : half width of the oversampled grid in pixels
+        oversampling : number of grid points per pixel
+        minflux : rows with a mean flux below this value are ignored
+
+        -------
+        Returns
+        -------
+
+        x, prof, mprof : oversampled grid, data and gaussian model profiles (nbins, x.size)
+        both normalized to the sum of the data profile (set to zero if this sum is not positive)
+
+        """
+    npix_y, npix_x = flux.shape
+    x     = np.linspace(-width, width, 2*width*oversampling+1)
+    npix  = 2*(width//2)+2
+
+    x1_of_y = np.floor(xc_of_y).astype(int) - width//2
+    y       = np.arange(npix_y)
+    ok      = (row_bin>=0)&(row_bin<nbins)&(x1_of_y>=0)&(x1_of_y+npix<=npix_x)&(sigma_of_y>0)
+    y       = y[ok]
+    x1      = x1_of_y[ok]
+    xc      = xc_of_y[ok]
+    sigma   = sigma_of_y[ok]
+    rbin    = row_bin[ok]
+
+    # pixels of each row (nrows, npix)
+    cols    = x1[:,None] + np.arange(npix)[None,:]
+    prof    = flux[y[:,None],cols]
+    pivar   = ivar[y[:,None],cols]
+    dx      = cols - xc[:,None]
+    model   = np.exp(-dx**2/2./sigma[:,None]**2)
+    model  *= (np.sum(prof,axis=1)/np.sum(model,axis=1))[:,None]
+
+    # linear interpolation weights of the oversampled grid (nrows, x.size),
+    # dx is uniformly spaced so the lower pixel index is given by the offset of the first pixel
+    t       = np.clip(x[None,:] - dx[:,:1], 0, npix-1)
+    klo     = np.minimum(np.floor(t).astype(int), npix-2)
+    whi     = t - klo
+    wlo     = 1. - whi
+
+    def interp(values) :
+        return wlo*np.take_along_axis(values,klo,axis=1) + whi*np.take_along_axis(values,klo+1,axis=1)
+
+    tmp_w   = interp(pivar)
+    tmp_wf  = interp(pivar*prof)
+    tmp_wm  = interp(pivar*model)
+
+    sum_tmp_w = np.sum(tmp_w,axis=1)
+    selection = np.where(sum_tmp_w>0)[0]
+    mflux     = np.sum(tmp_wf[selection],axis=1)/sum_tmp_w[selection]
+    selection = selection[mflux>minflux]
+
+    sw  = np.zeros((nbins,x.size))
+    swf = np.zeros((nbins,x.size))
+    swm = np.zeros((nbins,x.size))
+    np.add.at(sw,rbin[selection],tmp_w[selection])
+    np.add.at(swf,rbin[selection],tmp_wf[selection])
+    np.add.at(swm,rbin[selection],tmp_wm[selection])
+
+    prof  = swf/(sw+(sw==0))
+    mprof = swm/(sw+(sw==0))
+    sprof = np.sum(prof,axis=1)
+    norm  = (sprof>0)/(sprof+(sprof<=0))
+    return x, prof*norm[:,None], mprof*norm[:,None]
+
+def cross_profiles(psf, image_file, fibers=None, nbins=4, width=5, oversampling=4, minflux=10.) :
+    """Computes oversampled cross-dispersion profiles and their gaussian model in wavelength bins for each fiber
+
+        ----------
+        Parameters
+        ----------
+
+        psf        : File Descriptor of the psf (bootcalib or GAUSS-HERMITE)
+        image_file : File Descriptor of the preprocessed image
+        fibers     : Optional. If left empty, will use all fibers.
+        nbins      : number of wavelength bins
+
+        -------
+        Returns
+        -------
+
+        x, prof, mprof, wavebins
+        with prof and mprof of shape (nfibers, nbins, x.size) , see stack_profiles
+
+        """
+    log=get_logger()
+
+    wavemin, wavemax, xcoef, ycoef, sigmacoef = read_traces(psf)
+    if fibers is None :
+        fibers = np.arange(xcoef.shape[0])
+
+    flux    = image_file[0].data
+    ivar    = image_file[1].data
+    npix_y  = flux.shape[0]
+
+    wavebins = np.linspace(wavemin,wavemax,nbins+1)
+    y        = np.arange(npix_y)
+    prof     = None
+    mprof    = None
+    for f,fiber in enumerate(fibers) :
+        log.debug("stacking profiles of fiber #%03d"%fiber)
+        wave_of_y, xc_of_y, sigma_of_y = trace_of_y(wavemin, wavemax, ycoef, xcoef, sigmacoef, fiber, npix_y)
+        # CCD rows of the wavelength bin boundaries
+        ybins   = legval(u(wavebins,wavemin,wavemax), ycoef[fiber]).astype(int)
+        ybins   = np.clip(ybins,0,npix_y)
+        row_bin = np.searchsorted(ybins,y,side="right")-1
+        x, fprof, fmprof = stack_profiles(flux, ivar, xc_of_y, sigma_of_y, row_bin, nbins, width=width, oversampling=oversampling, minflux=minflux)
+        if prof is None :
+            prof  = np.zeros((len(fibers),nbins,x.size))
+            mprof = np.zeros((len(fibers),nbins,x.size))
+        prof[f]  = fprof
+        mprof[f] = fmprof
+
+    return x, prof, mprof, wavebins
@@ -0,0 +1,244 @@
+import os
+import io
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import contextlib
+import socketserver
+
+# This module is imported by the client, so numpy, astropy and desispec are only imported by the daemon functions
+
+def default_socket_path() :
+    """Returns the daemon socket path, $TESTSTAND_SOCKET if set"""
+    return os.environ.get("TESTSTAND_SOCKET","/tmp/teststand-%d.sock"%os.getuid())
+
+# jobs run with the scripts of the bin directory
+script_jobs = {"ptc":"desi_compute_gains", "index":"desi_index"}
+
+def send_request(job, args=None, socket_path=None, timeout=None) :
+    """Send a job to the daemon and wait for the reply
+
+        ----------
+        Parameters
+        ----------
+
+        job : one of extract, ptc, index, stats, ping, shutdown
+        args : list of command line arguments of the job, as for desi_extract_boxcar, desi_compute_gains or desi_index
+        socket_path : default is default_socket_path()
+
+        -------
+        Returns
+        -------
+
+        reply dictionary with at least 'status' ('ok' or 'error'), and 'output', 'result' or 'message'
+
+        """
+    if socket_path is None :
+        socket_path = default_socket_path()
+    request = {"job":job, "args":(args if args is not None else []), "cwd":os.getcwd()}
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try :
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request)+"\n").encode())
+        reply = b""
+        while not reply.endswith(b"\n") :
+            chunk = sock.recv(65536)
+            if not chunk :
+                break
+            reply += chunk
+    finally :
+        sock.close()
+    return json.loads(reply.decode())
+
+def extract_parser() :
+    """Same arguments as desi_extract_boxcar, the output frame is required"""
+    parser = argparse.ArgumentParser(prog="extract", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p','--psf', type = str, default = None, required = True,
+                        help = 'path of psf fits file to get wavelength from')
+    parser.add_argument('-i','--image', type = str, default = None, required = True,
+                        help = 'path of image fits file')
+    parser.add_argument('-o','--outframe', type = str, default = None, required = True,
+                        help = 'path of output frame file')
+    parser.add_argument('--fibers', type=str, default = None, required = False,
+                        help = 'defines from_to which fiber to work on. (ex: --fibers=50:60,4 means that only fibers 4, and fibers from 50 to 60 (excluded) will be extracted)')
+    parser.add_argument('-r','--resample', action='store_true',
+                        help = 'resample to save wavelength grid')
+    parser.add_argument('--width', type=int, default=9, required=False,
+                        help = 'extraction line width')
+    parser.add_argument('--sb', action='store_true',
+                        help = 'remove side bands of same width (only applicable for sparse fiber data for fine linearity studies')
+    return parser
+
+def _parse(parser, argv) :
+    # argparse exits on errors, return the message instead
+    err = io.StringIO()
+    try :
+        with contextlib.redirect_stderr(err) :
+            return parser.parse_args(argv), None
+    except SystemExit :
+        return None, err.getvalue()
+
+class TeststandDaemon(object) :
+    """Keeps the psf traces and trace geometry in memory between jobs
+
+        ----------
+        Parameters
+        ----------
+
+        maxbytes : memory budget of the cache in bytes
+
+        """
+    def __init__(self, maxbytes=1024**3) :
+        from teststand.cache import MemoryLRUCache
+        self.cache = MemoryLRUCache(maxbytes)
+        # scripts run in the daemon process change sys.argv, stdout and the current directory
+        self.script_lock = threading.Lock()
+        self.t0 = time.time()
+        self.njobs = 0
+
+    def psf_traces(self, filename) :
+        """Cached teststand.boxcar_extraction.psf_traces of a psf file"""
+        import numpy as np
+        import astropy.io.fits as pyfits
+        from teststand.cache import file_key
+        from teststand.boxcar_extraction import psf_traces
+        def read() :
+            # copy the arrays, they are memory mapped to the file
+            with pyfits.open(filename) as psf :
+                return tuple([np.array(v) if hasattr(v,"shape") else v for v in psf_traces(psf)])
+        return self.cache.get_or_compute(("traces",)+file_key(filename), read)
+
+    def geometry(self, psf_filename, npix_y, fibers, width) :
+        """Cached teststand.boxcar_extraction.trace_geometry"""
+        from teststand.cache import file_key
+        from teststand.boxcar_extraction import trace_geometry
+        fibers_key = None if fibers is None else tuple([int(f) for f in fibers])
+        key = ("geometry",)+file_key(psf_filename)+(npix_y,fibers_key,width)
+        return self.cache.get_or_compute(key, lambda : trace_geometry(self.psf_traces(psf_filename), npix_y, fibers, width))
+
+    def extract(self, argv, cwd) :
+        """Same as desi_extract_boxcar, with cached psf and trace geometry"""
+        import astropy.io.fits as pyfits
+        from desispec.log import get_logger
+        from teststand.fibers import parse_fibers
+        from teststand.boxcar_extraction import boxcar, make_frame
+        log = get_logger()
+        args, error = _parse(extract_parser(), argv)
+        if args is None :
+            return {"status":"error", "message":error}
+        psf_filename = os.path.join(cwd,args.psf)
+        image_filename = os.path.join(cwd,args.image)
+        outframe = os.path.join(cwd,args.outframe)
+        t0 = time.time()
+        # parse_fibers exits on errors
+        try :
+            fibers = parse_fibers(args.fibers)
+        except SystemExit :
+            return {"status":"error", "message":"cannot parse --fibers '%s', use a format like 2,5,6:8,3,10"%args.fibers}
+        with pyfits.open(image_filename) as image_file :
+            npix_y = image_file[0].header["NAXIS2"]
+            geometry = self.geometry(psf_filename, npix_y, fibers, args.width)
+            spectra, ivar, wave = boxcar(None, image_file, side_bands=args.sb, geometry=geometry)
+            header = image_file[0].header.copy()
+        if args.resample :
+            from teststand.resample import resample_to_same_wavelength_grid
+            spectra, ivar, wave = resample_to_same_wavelength_grid(spectra, ivar, wave)
+        make_frame(spectra, ivar, wave, header).writeto(outframe, overwrite=True)
+        log.info("wrote %s in %.2f s"%(outframe,time.time()-t0))
+        return {"status":"ok", "result":{"outframe":outframe, "nfibers":int(spectra.shape[0]), "seconds":time.time()-t0}}
+
+    def run_script(self, name, argv, cwd) :
+        """Run a script of the bin directory in the daemon process with the given arguments"""
+        import runpy
+        from teststand.benchmark import script_path
+        path = script_path(name)
+        out = io.StringIO()
+        status = 0
+        with self.script_lock :
+            saved = (sys.argv, os.getcwd())
+            sys.argv = [path]+list(argv)
+            os.chdir(cwd)
+            try :
+                with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out) :
+                    runpy.run_path(path, run_name="__main__")
+            except SystemExit as e :
+                status = e.code if isinstance(e.code,int) else (0 if e.code is None else 1)
+            finally :
+                sys.argv = saved[0]
+                os.chdir(saved[1])
+        if status != 0 :
+            return {"status":"error", "message":"%s exited with status %d"%(name,status), "output":out.getvalue()}
+        return {"status":"ok", "output":out.getvalue()}
+
+    def stats(self) :
+        return {"status":"ok", "result":{"uptime":time.time()-self.t0, "jobs":self.njobs, "cache":self.cache.stats()}}
+
+    def handle(self, request) :
+        """Process a request dictionary with job, args and cwd, returns the reply dictionary"""
+        from desispec.log import get_logger
+        job  = request.get("job")
+        args = request.get("args",[])
+        cwd  = request.get("cwd",os.getcwd())
+        self.njobs += 1
+        try :
+            if job == "extract" :
+                return self.extract(args, cwd)
+            if job in script_jobs :
+                return self.run_script(script_jobs[job], args, cwd)
+            if job == "stats" :
+                return self.stats()
+            if job == "ping" :
+                return {"status":"ok"}
+            return {"status":"error", "message":"unknown job '%s'"%job}
+        except Exception as e :
+            get_logger().error("job %s %s failed : %s"%(job,str(args),str(e)))
+            return {"status":"error", "message":"%s: %s"%(type(e).__name__,str(e))}
+
+class _Handler(socketserver.StreamRequestHandler) :
+    def handle(self) :
+        line = self.rfile.readline()
+        if not line :
+            return
+        try :
+            request = json.loads(line.decode())
+        except ValueError :
+            reply = {"status":"error", "message":"invalid request"}
+        else :
+            if request.get("job") == "shutdown" :
+                reply = {"status":"ok"}
+                threading.Thread(target=self.server.shutdown).start()
+            else :
+                reply = self.server.daemon.handle(request)
+        self.wfile.write((json.dumps(reply)+"\n").encode())
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer) :
+    daemon_threads = True
+
+def serve(socket_path=None, maxbytes=1024**3) :
+    """Run the daemon until a shutdown job is received"""
+    from desispec.log import get_logger
+    log = get_logger()
+    if socket_path is None :
+        socket_path = default_socket_path()
+    if os.path.exists(socket_path) :
+        try :
+            send_request("ping", socket_path=socket_path, timeout=1)
+            raise RuntimeError("a daemon is already listening on %s"%socket_path)
+        except (socket.error, ValueError) :
+            # stale socket file
+            os.unlink(socket_path)
+    server = _Server(socket_path, _Handler)
+    os.chmod(socket_path, 0o600)
+    server.daemon = TeststandDaemon(maxbytes)
+    log.info("listening on %s"%socket_path)
+    try :
+        server.serve_forever()
+    finally :
+        server.server_close()
+        if os.path.exists(socket_path) :
+            os.unlink(socket_path)
+        log.info("stopped")
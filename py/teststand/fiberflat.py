@@ -0,0 +1,169 @@
+import numpy as np
+import astropy.io.fits as pyfits
+
+from desispec.log import get_logger
+from teststand.resample import interpolation_weights, rebin
+
+def coadd_frames(filenames) :
+    """Inverse variance weighted mean of the spectra of a list of boxcar frames with the same trace geometry,
+    one frame in memory at a time
+
+        -------
+        Returns
+        -------
+
+        flux, ivar, wave (wave as in the first frame, 1D or 2D), header of the first frame
+
+        """
+    log=get_logger()
+    swf=None
+    for filename in filenames :
+        log.debug("reading %s"%filename)
+        h=pyfits.open(filename)
+        flux=h[0].data
+        ivar=h["IVAR"].data
+        if swf is None :
+            swf=np.zeros(flux.shape)
+            sw=np.zeros(flux.shape)
+            wave=h["WAVELENGTH"].data.copy()
+            header=h[0].header.copy()
+        swf += ivar*flux
+        sw  += ivar
+        h.close()
+    return swf/(sw+(sw==0)), sw, wave, header
+
+def resample_frame(flux, ivar, wave) :
+    """Resample all fibers on the mean wavelength grid with a single set of interpolation weights,
+    propagating the variance (a pixel with a masked neighbour is masked)
+
+        -------
+        Returns
+        -------
+
+        flux, ivar, wave on the common grid
+
+        """
+    if wave.ndim == 1 :
+        return flux, ivar, wave
+    rwave = np.mean(wave,axis=0)
+    index, weight = interpolation_weights(rwave, wave)
+    f0 = np.take_along_axis(flux,index,axis=1)
+    f1 = np.take_along_axis(flux,index+1,axis=1)
+    i0 = np.take_along_axis(ivar,index,axis=1)
+    i1 = np.take_along_axis(ivar,index+1,axis=1)
+    rflux = f0*(1.-weight) + f1*weight
+    var   = (1.-weight)**2/(i0+(i0==0)) + weight**2/(i1+(i1==0))
+    valid = ((i0>0)|(weight==1.))&((i1>0)|(weight==0.))
+    rivar = valid/var
+    return rflux, rivar, rwave
+
+def smooth(array, nrebin) :
+    """Smooth the last axis of an array by averaging in bins of nrebin pixels and interpolating back"""
+    n = array.shape[-1]
+    x = np.arange(n)
+    rx = rebin(x.astype(float),nrebin,np.mean)
+    ra = rebin(array,nrebin,np.mean)
+    if rx.size < 2 :
+        return np.repeat(np.mean(array,axis=-1)[...,None],n,axis=-1)
+    index = np.clip(np.searchsorted(rx,x,side="right")-1,0,rx.size-2)
+    weight = np.clip((x-rx[index])/(rx[index+1]-rx[index]),0.,1.)
+    return ra[...,index]*(1.-weight)+ra[...,index+1]*weight
+
+def compute_fiberflat(flux, ivar, nloop=20, nsig=5., nrebin=20) :
+    """Iterative solve of the mean spectrum and of the fiber flat (ratio of each fiber to the mean spectrum)
+
+        All fibers are processed at once. At each iteration the mean spectrum is the weighted mean over fibers
+        of flux/fiberflat, and pixels deviating by more than nsig from a smoothed fiberflat are masked.
+
+        ----------
+        Parameters
+        ----------
+
+        flux, ivar : arrays (nfibers, nwave) on a common wavelength grid
+        nloop : max number of iterations
+        nsig : outlier rejection threshold
+        nrebin : number of pixels of the smoothing bins used for outlier rejection
+
+        -------
+        Returns
+        -------
+
+        fiberflat, fiberflat_ivar, mask (non zero for masked pixels), meanspec
+
+        """
+    log = get_logger()
+    mask = (ivar<=0)
+    fiberflat = np.ones(flux.shape)
+    for loop in range(nloop) :
+        w         = ivar*(~mask)
+        sw        = np.sum(w*fiberflat**2,axis=0)
+        meanspec  = np.sum(w*fiberflat*flux,axis=0)/(sw+(sw==0))
+        fiberflat = flux/(meanspec+(meanspec==0))*(meanspec!=0)
+        flativar  = ivar*meanspec**2
+        # normalize so that the weighted mean of the fiber flats is one
+        sw        = np.sum(w*meanspec**2,axis=0)
+        norm      = np.sum(w*meanspec**2*fiberflat,axis=0)/(sw+(sw==0))
+        norm[norm==0] = 1.
+        fiberflat /= norm
+        meanspec  *= norm
+        flativar  *= norm**2
+        # outlier rejection with respect to a smooth fiber flat
+        ok        = (~mask).astype(float)
+        sok       = smooth(ok,nrebin)
+        smoothff  = smooth(fiberflat*ok,nrebin)/(sok+(sok==0))+(sok==0)
+        chi       = (fiberflat-smoothff)*np.sqrt(flativar)
+        newmask   = mask|(np.abs(chi)>nsig)
+        nnew      = np.sum(newmask)-np.sum(mask)
+        log.debug("fiberflat iter #%d, %d new masked pixels"%(loop,nnew))
+        mask      = newmask
+        if nnew == 0 :
+            break
+    flativar *= (~mask)
+    return fiberflat, flativar, mask.astype(np.int32), meanspec
+
+def rebinned_fiberflat_error(fiberflat, ivar, nrebin) :
+    """Mean fiberflat and its uncertainty in bins of nrebin wavelength pixels
+
+        The fiberflat is averaged without weights and the ivar summed in each bin,
+        the uncertainty is 1/sqrt(summed ivar) (inf for a bin without valid pixel).
+
+        -------
+        Returns
+        -------
+
+        rebinned fiberflat, uncertainty (arrays of shape (..., nwave//nrebin))
+
+        """
+    rivar = rebin(ivar,nrebin)
+    with np.errstate(divide="ignore") :
+        err = 1./np.sqrt(rivar)
+    return rebin(fiberflat,nrebin,np.mean), err
+
+def fiberflat_from_frames(filenames, nloop=20, nsig=5., nrebin=20) :
+    """Compute a fiberflat from a list of boxcar frames
+
+        -------
+        Returns
+        -------
+
+        HDUList with the same layout as the desispec fiberflat files
+        (FIBERFLAT, IVAR, MASK, MEANSPEC, WAVELENGTH), readable by plot_fiberflat.py
+
+        """
+    log = get_logger()
+    flux, ivar, wave, header = coadd_frames(filenames)
+    flux, ivar, wave = resample_frame(flux, ivar, wave)
+    log.info("computing fiberflat of %d fibers x %d wavelength"%flux.shape)
+    fiberflat, flativar, mask, meanspec = compute_fiberflat(flux, ivar, nloop=nloop, nsig=nsig, nrebin=nrebin)
+    hdulist = pyfits.HDUList([pyfits.PrimaryHDU(fiberflat),
+                              pyfits.ImageHDU(flativar,name="IVAR"),
+                              pyfits.ImageHDU(mask,name="MASK"),
+                              pyfits.ImageHDU(meanspec,name="MEANSPEC"),
+                              pyfits.ImageHDU(wave,name="WAVELENGTH")])
+    hdulist[0].header["EXTNAME"]="FIBERFLAT"
+    for key in ["CAMERA","EXPNUM","NIGHT"] :
+        if key in header :
+            hdulist[0].header[key]=header[key]
+    for i,filename in enumerate(filenames) :
+        hdulist[0].header["INPUT%03d"%i]=filename
+    return hdulist
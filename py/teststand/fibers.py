@@ -0,0 +1,33 @@
+import sys
+import numpy as np
+
+from desispec.log import get_logger
+
+def parse_fibers(fiber_string) :
+    """Parse a fiber selection string like '2,5,6:8,3,10' (ranges exclude their end)
+
+        -------
+        Returns
+        -------
+
+        array of fibers, or None if fiber_string is None
+
+        """
+    if fiber_string is None :
+        return None
+    
+    fibers=[]
+    for sub in fiber_string.split(',') :
+        if sub.isdigit() :
+            fibers.append(int(sub))
+            continue
+        
+        tmp = sub.split(':')
+        if ((len(tmp) == 2) and tmp[0].isdigit() == True and tmp[1].isdigit() == True) :
+            for f in range(int(tmp[0]),int(tmp[1])) :
+                fibers.append(f)
+        else :
+            log = get_logger()
+            log.error("--fibers parsing error.\nCorrect format is either  : --fibers=begin,end (excluded)\nand/or  : --fibers=begin:end (excluded)\nYou can use : --fibers=2,5,6:8,3,10")
+            sys.exit(1)
+    return np.array(fibers)
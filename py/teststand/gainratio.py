@@ -0,0 +1,109 @@
+import numpy as np
+
+from desispec.log import get_logger
+from teststand.resample import interpolation_weights, apply_interpolation_weights
+
+def resample_spectra(spectra, wave) :
+    """Resample all fibers on the mean wavelength grid with a single set of interpolation weights
+
+        -------
+        Returns
+        -------
+
+        rspectra, rwave
+
+        """
+    rwave = np.mean(wave,axis=0)
+    index, weight = interpolation_weights(rwave, wave)
+    return apply_interpolation_weights(spectra, index, weight), rwave
+
+def fiber_transmission(rspectra, yrange, selected_fibers, nloop=10, tolerance=1e-4) :
+    """Iterative solve of the relative fiber transmission and of the mean spectrum
+
+        ----------
+        Parameters
+        ----------
+
+        rspectra : spectra on a common wavelength grid (nfibers, nwave), not modified
+        yrange : indices of the wavelength grid used to compare the fibers
+        selected_fibers : fibers used for the mean spectrum and the convergence test
+
+        -------
+        Returns
+        -------
+
+        fibertrans, rspectra (corrected for transmission), mean spectrum
+
+        """
+    log = get_logger()
+    rspectra   = rspectra.copy()
+    fibertrans = np.ones(rspectra.shape[0])
+    mrspec     = np.ones(rspectra.shape[1])
+    for loop in range(nloop) :
+        meanf = np.median(rspectra[:,yrange]/mrspec[yrange],axis=1)
+        fibertrans *= meanf
+        rspectra   /= meanf[:,None]
+        x    = meanf/np.mean(meanf[selected_fibers])
+        rms  = np.std(x[selected_fibers])
+        log.debug("fiber transmission iter #%d rms=%g"%(loop,rms))
+        mrspec = np.median(rspectra[selected_fibers],axis=0)
+        if rms<tolerance :
+            break
+    return fibertrans, rspectra, mrspec
+
+def amp_ratio(mspec, width=100, deg=2) :
+    """Ratio of polynomial extrapolations at the center of the CCD of the spectrum on each side of the amplifier boundary
+
+        -------
+        Returns
+        -------
+
+        ratio, pol1, pol2 (np.poly1d polynomials below and above the boundary)
+
+        """
+    ny  = mspec.size
+    y   = np.arange(ny)
+    yb1 = ny//2-1-width
+    ye1 = ny//2-1
+    yb2 = ny//2+1
+    ye2 = ny//2+1+width
+    pol1 = np.poly1d(np.polyfit(y[yb1:ye1],mspec[yb1:ye1],deg=deg))
+    pol2 = np.poly1d(np.polyfit(y[yb2:ye2],mspec[yb2:ye2],deg=deg))
+    return pol1(ny/2.)/pol2(ny/2.), pol1, pol2
+
+def gain_ratios(spectra, fibertrans, amp_fibers, nboot=100, width=100, deg=2, seed=0) :
+    """Gain ratios between the amplifiers of each side of the CCD, with bootstrap uncertainties
+
+        ----------
+        Parameters
+        ----------
+
+        spectra : spectra on the CCD row grid (nfibers, ny)
+        fibertrans : fiber transmission (see fiber_transmission)
+        amp_fibers : dictionary name -> fibers, for instance {"A/C":np.arange(0,10),"B/D":np.arange(10,20)}
+        nboot : number of bootstrap resamplings of the fibers
+
+        -------
+        Returns
+        -------
+
+        dictionary name -> (ratio, error) , the ratio is the ADU flux ratio A/C = gain_C/gain_A
+
+        """
+    log = get_logger()
+    spectra = spectra/fibertrans[:,None]
+    rng = np.random.RandomState(seed)
+    res = {}
+    for name in amp_fibers :
+        fibers = np.asarray(amp_fibers[name])
+        ratio, pol1, pol2 = amp_ratio(np.median(spectra[fibers],axis=0),width=width,deg=deg)
+        err = 0.
+        if nboot > 1 :
+            # all bootstrap median spectra at once (nboot, ny)
+            samples = fibers[rng.randint(0,fibers.size,size=(nboot,fibers.size))]
+            mspecs  = np.median(spectra[samples],axis=1)
+            ratios  = np.array([amp_ratio(mspec,width=width,deg=deg)[0] for mspec in mspecs])
+            err     = np.std(ratios)
+        log.debug("%s ratio=%f +- %f"%(name,ratio,err))
+        res[name] = (ratio, err)
+    return res
@@ -0,0 +1,266 @@
+import numpy as np
+import astropy.io.fits as pyfits
+from numpy.polynomial.legendre import legvander
+from scipy.special import erf
+
+from teststand.boxcar_extraction import u
+from teststand.psfparams import legendre_grid
+
+def pixel_integrated_gauss_hermite(u, degree) :
+    """Pixel integrated Gauss-Hermite functions of order 0 to degree (same as specter GaussHermitePSF._pgh)
+
+        ----------
+        Parameters
+        ----------
+
+        u : array (..., npix+1) of the pixel edges in units of sigma, relative to the center
+        degree : maximum order
+
+        -------
+        Returns
+        -------
+
+        array (..., degree+1, npix)
+
+        """
+    shape = u.shape[:-1]+(degree+1,u.shape[-1]-1)
+    res = np.zeros(shape)
+    y = erf(u/np.sqrt(2.))
+    res[...,0,:] = 0.5*(y[...,1:]-y[...,:-1])
+    if degree == 0 :
+        return res
+    gauss = np.exp(-0.5*u**2)/np.sqrt(2.*np.pi)
+    # probabilists' Hermite polynomials He_n(u), He_{n+1} = u He_n - n He_{n-1}
+    hm1 = np.zeros(u.shape)
+    h = np.ones(u.shape)
+    for m in range(1,degree+1) :
+        # integral of He_m(u) exp(-u^2/2) / sqrt(2 pi) is -He_{m-1}(u) exp(-u^2/2) / sqrt(2 pi)
+        y = -h*gauss
+        res[...,m,:] = y[...,1:]-y[...,:-1]
+        h, hm1 = u*h-(m-1)*hm1, h
+    return res
+
+class GaussHermitePSF(object) :
+    """Vectorized evaluation of a GAUSS-HERMITE psf (PSFVER 3 table written by specex)
+
+        The parameters are Legendre polynomials of the wavelength for each fiber. They are evaluated
+        for many (fiber, wavelength) at once with a Legendre Vandermonde matrix, and the stamps are computed
+        in batches from arrays of the pixel integrated Gauss-Hermite functions, with the same
+        pixel ranges, tails, clipping and normalization as specter.psf.GaussHermitePSF.
+        The methods x, y, xy and xypix can be used in place of those of specter.
+
+        ----------
+        Parameters
+        ----------
+
+        filename : path of the psf file
+
+        """
+    def __init__(self, filename) :
+        psf = pyfits.open(filename)
+        if psf[0].header.get("PSFTYPE","") != "GAUSS-HERMITE" and psf[1].header.get("PSFTYPE","") != "GAUSS-HERMITE" :
+            psf.close()
+            raise ValueError("%s is not a GAUSS-HERMITE psf"%filename)
+        header = psf[1].header
+        table  = psf[1].data
+        names  = [str(p).strip() for p in table["PARAM"]]
+        coeff  = np.array(table["COEFF"]).astype(float)
+        self.coeff  = dict([(n,coeff[i]) for i,n in enumerate(names)])
+        self.wavemin = dict([(n,float(table["WAVEMIN"][i])) for i,n in enumerate(names)])
+        self.wavemax = dict([(n,float(table["WAVEMAX"][i])) for i,n in enumerate(names)])
+        self.legdeg = header["LEGDEG"]
+        self.hsizex = header["HSIZEX"]
+        self.hsizey = header["HSIZEY"]
+        self.ghdegx = header["GHDEGX"]
+        self.ghdegy = header["GHDEGY"]
+        self.ghdegx2 = header.get("GHDEGX2",0)
+        self.ghdegy2 = header.get("GHDEGY2",0)
+        self.npix_x = header["NPIX_X"]
+        self.npix_y = header["NPIX_Y"]
+        self.camera = header.get("CAMERA","")
+        psf.close()
+        self.nspec  = self.coeff["X"].shape[0]
+        self.wmin   = self.wavemin["X"]
+        self.wmax   = self.wavemax["X"]
+        self._wmin_all = self.wmin
+        self._wmax_all = self.wmax
+        self.second_core = "GH2-0-0" in self.coeff
+
+    def _fibers(self, ispec) :
+        if ispec is None :
+            return np.arange(self.nspec)
+        return np.atleast_1d(ispec).astype(int)
+
+    def param_grid(self, name, ispec=None, wavelength=None) :
+        """Values of a parameter for all the fibers and wavelengths at once
+
+            ----------
+            Parameters
+            ----------
+
+            name : parameter name (like X, Y, GHSIGX)
+            ispec : fiber index or list of fibers, default is all
+            wavelength : wavelength or array of wavelengths, default is 100 values between wmin and wmax
+
+            -------
+            Returns
+            -------
+
+            array (nfibers, nwave)
+
+            """
+        if wavelength is None :
+            wavelength = np.linspace(self.wmin,self.wmax,100)
+        return legendre_grid(self.coeff[name][self._fibers(ispec)],wavelength,self.wavemin[name],self.wavemax[name])
+
+    def params(self, names, ispec, wavelength) :
+        """Values of parameters for a list of (fiber, wavelength)
+
+            ----------
+            Parameters
+            ----------
+
+            names : list of parameter names
+            ispec : array of fiber indices
+            wavelength : array of wavelengths, same size as ispec (or scalar)
+
+            -------
+            Returns
+            -------
+
+            dictionary name -> array of the size of ispec
+
+            """
+        ispec = np.atleast_1d(ispec).astype(int)
+        wavelength = np.broadcast_to(np.atleast_1d(wavelength).astype(float),ispec.shape)
+        vanders = {}
+        res = {}
+        for name in names :
+            key = (self.wavemin[name],self.wavemax[name],self.coeff[name].shape[1])
+            if not key in vanders :
+                vanders[key] = legvander(u(wavelength,key[0],key[1]),key[2]-1)
+            res[name] = np.sum(self.coeff[name][ispec]*vanders[key],axis=-1)
+        return res
+
+    def _scalar_or_grid(self, name, ispec, wavelength) :
+        res = self.param_grid(name,ispec,wavelength)
+        if ispec is not None and np.isscalar(ispec) :
+            res = res[0]
+            if np.isscalar(wavelength) :
+                res = res[0]
+        return res
+
+    def x(self, ispec=None, wavelength=None) :
+        return self._scalar_or_grid("X",ispec,wavelength)
+
+    def y(self, ispec=None, wavelength=None) :
+        return self._scalar_or_grid("Y",ispec,wavelength)
+
+    def xy(self, ispec=None, wavelength=None) :
+        return self.x(ispec,wavelength), self.y(ispec,wavelength)
+
+    def _core(self, ccd, center, sigma, degree) :
+        """Pixel integrated Gauss-Hermite functions (nstamps, degree+1, npix) of each stamp along one axis"""
+        edges = np.concatenate([ccd-0.5, ccd[:,-1:]+0.5],axis=1)
+        return pixel_integrated_gauss_hermite((edges-center[:,None])/sigma[:,None],degree)
+
+    def _gh_coefficients(self, params, degx, degy, prefix) :
+        nstamps = params["X"].size
+        coef = np.zeros((nstamps,degx+1,degy+1))
+        for i in range(degx+1) :
+            for j in range(degy+1) :
+                name = "%s-%d-%d"%(prefix,i,j)
+                if name in params :
+                    coef[:,i,j] = params[name]
+        return coef
+
+    def stamps(self, ispec, wavelength) :
+        """Evaluate a batch of psf stamps
+
+            All stamps have the same shape (ny, nx), the largest pixel range of the batch.
+            The pixels beyond the range of a stamp (as defined by specter) are zero.
+            Memory scales as the number of stamps times nx*ny, large batches should be split by the caller.
+
+            ----------
+            Parameters
+            ----------
+
+            ispec : array of fiber indices
+            wavelength : array of wavelengths, same size as ispec (or scalar)
+
+            -------
+            Returns
+            -------
+
+            xmin, xmax, ymin, ymax : arrays of the pixel ranges of the stamps
+            pix : array (nstamps, ny, nx), normalized to unit sum
+
+            """
+        ispec = np.atleast_1d(ispec).astype(int)
+        names = [n for n in self.coeff.keys() if n == "X" or n == "Y" or n.startswith("GH") or n.startswith("TAIL")]
+        params = self.params(names,ispec,wavelength)
+        x = params["X"]
+        y = params["Y"]
+
+        # CCD pixel ranges, same as specter (int truncates toward zero)
+        xmin = np.trunc(x-self.hsizex+0.5).astype(int)
+        xmax = np.trunc(x+self.hsizex+1.5).astype(int)
+        ymin = np.trunc(y-self.hsizey+0.5).astype(int)
+        ymax = np.trunc(y+self.hsizey+1.5).astype(int)
+        nx = np.max(xmax-xmin)
+        ny = np.max(ymax-ymin)
+        xccd = xmin[:,None]+np.arange(nx)[None,:]
+        yccd = ymin[:,None]+np.arange(ny)[None,:]
+
+        xfunc = self._core(xccd,x,params["GHSIGX"],self.ghdegx)
+        yfunc = self._core(yccd,y,params["GHSIGY"],self.ghdegy)
+        coef  = self._gh_coefficients(params,self.ghdegx,self.ghdegy,"GH")
+        pix = np.einsum("nij,njy,nix->nyx",coef,yfunc,xfunc,optimize=True)
+
+        if self.second_core :
+            xfunc = self._core(xccd,x,params["GHSIGX2"],self.ghdegx2)
+            yfunc = self._core(yccd,y,params["GHSIGY2"],self.ghdegy2)
+            coef  = self._gh_coefficients(params,self.ghdegx2,self.ghdegy2,"GH2")
+            pix += np.einsum("nij,njy,nix->nyx",coef,yfunc,xfunc,optimize=True)
+
+        if "TAILAMP" in params :
+            dx = (xccd-x[:,None])*params["TAILXSCA"][:,None]
+            dy = (yccd-y[:,None])*params["TAILYSCA"][:,None]
+            r2 = dy[:,:,None]**2+dx[:,None,:]**2
+            pix += (params["TAILAMP"][:,None,None]*r2/(params["TAILCORE"][:,None,None]**2+r2)**(1+params["TAILINDE"][:,None,None]/2.))
+
+        # mask the pixels beyond the range of each stamp, clip and normalize
+        valid = ((np.arange(ny)[None,:,None]<(ymax-ymin)[:,None,None])&(np.arange(nx)[None,None,:]<(xmax-xmin)[:,None,None]))
+        pix = np.clip(pix,0.,None)*valid
+        pix /= np.sum(pix,axis=(1,2))[:,None,None]
+        return xmin, xmax, ymin, ymax, pix
+
+    def xypix(self, ispec, wavelength, xmin=0, xmax=None, ymin=0, ymax=None) :
+        """Same as specter psf xypix : returns xslice, yslice, pixels of the stamp of one fiber and wavelength,
+        clipped to the pixel range [xmin,xmax[, [ymin,ymax[ (slices are relative to xmin,ymin)
+        """
+        if xmax is None :
+            xmax = self.npix_x
+        if ymax is None :
+            ymax = self.npix_y
+        empty = (slice(0,0), slice(0,0), np.zeros((0,0)))
+        if wavelength < self._wmin_all or wavelength > self._wmax_all :
+            return empty
+        x0, x1, y0, y1, pix = self.stamps([ispec],[wavelength])
+        xlo, xhi, ylo, yhi = int(x0[0]), int(x1[0]), int(y0[0]), int(y1[0])
+        pix = pix[0,:yhi-ylo,:xhi-xlo]
+        if xlo >= xmax or xhi <= xmin or ylo >= ymax or yhi <= ymin :
+            return empty
+        if xlo < xmin :
+            pix = pix[:,xmin-xlo:]
+            xlo = xmin
+        if xhi > xmax :
+            pix = pix[:,:xmax-xlo]
+            xhi = xmax
+        if ylo < ymin :
+            pix = pix[ymin-ylo:,:]
+            ylo = ymin
+        if yhi > ymax :
+            pix = pix[:ymax-ylo,:]
+            yhi = ymax
+        return slice(xlo-xmin,xhi-xmin), slice(ylo-ymin,yhi-ymin), pix
@@ -1,32 +1,86 @@
-import matplotlib.pyplot as plt
-import sys
 import numpy as np
 
 from desispec.log import get_logger
+# parse_fibers used to be defined here, it does not need matplotlib
+from teststand.fibers import parse_fibers
 
-def parse_fibers(fiber_string) :
-    
-    if fiber_string is None :
-        return None
-    
-    fibers=[]
-    for sub in fiber_string.split(',') :
-        if sub.isdigit() :
-            fibers.append(int(sub))
-            continue
-        
-        tmp = sub.split(':')
-        if ((len(tmp) is 2) and tmp[0].isdigit() == True and tmp[1].isdigit() == True) :
-            for f in range(int(tmp[0]),int(tmp[1])) :
-                fibers.append(f)
-        else :
-            log.error("--fibers parsing error.\nCorrect format is either  : --fibers=begin,end (excluded)\nand/or  : --fibers=begin:end (excluded)\nYou can use : --fibers=2,5,6:8,3,10")
-            sys.exit(1)
-    return np.array(fibers)
+def plot_lines(ax, x, y, **kwargs) :
+    """Draw one line per row of x and y (arrays (nlines, npoints), a 1D array is used for all lines)
+    as a single matplotlib LineCollection, with the colors of the axes color cycle, returns the collection
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
+    x, y = np.broadcast_arrays(np.atleast_2d(x), np.atleast_2d(y))
+    if not "colors" in kwargs and not "color" in kwargs :
+        kwargs["colors"] = plt.rcParams["axes.prop_cycle"].by_key().get("color",["b"])
+    lines = LineCollection(np.stack([x,y],axis=-1), **kwargs)
+    ax.add_collection(lines)
+    ax.autoscale_view()
+    return lines
+
+def _bins(a, nbins, size) :
+    """reshape (nspec, n) to (nspec, nbins, size), padding with the last value"""
+    pad = nbins*size-a.shape[1]
+    if pad > 0 :
+        a = np.concatenate([a,np.repeat(a[:,-1:],pad,axis=1)],axis=1)
+    return a.reshape(a.shape[0],nbins,size)
+
+def minmax_decimate(x, y, npix) :
+    """Min/max envelope decimation of spectra for display
+
+        The pixels are grouped in about npix bins, and only the minimum and maximum of each bin are kept
+        (in their original order), so that the drawn line covers the same pixels of the figure as the full resolution one.
+
+        ----------
+        Parameters
+        ----------
+
+        x : array (n) or (nspec, n)
+        y : array (nspec, n)
+        npix : number of bins, like the width of the axes in pixels
+
+        -------
+        Returns
+        -------
+
+        x, y : arrays (nspec, 2*nbins), or the input arrays if there are less than 3 values per bin
+
+        """
+    y = np.atleast_2d(y)
+    x = np.broadcast_to(x,y.shape)
+    size = int(np.ceil(y.shape[1]/float(max(1,npix))))
+    if size < 3 :
+        return x, y
+    nbins = int(np.ceil(y.shape[1]/float(size)))
+    xb = _bins(x,nbins,size)
+    yb = _bins(y,nbins,size)
+    imin = np.argmin(yb,axis=2)
+    imax = np.argmax(yb,axis=2)
+    index = np.stack([np.minimum(imin,imax),np.maximum(imin,imax)],axis=2)[:,:,:,None]
+    xd = np.take_along_axis(xb[:,:,:,None],index,axis=2).reshape(y.shape[0],2*nbins)
+    yd = np.take_along_axis(yb[:,:,:,None],index,axis=2).reshape(y.shape[0],2*nbins)
+    return xd, yd
 
+def minmax_band(x, low, high, npix) :
+    """Decimation of an error band for display : mean x, minimum of low and maximum of high in about npix bins
 
+        -------
+        Returns
+        -------
 
-def plot_graph(frame, fibers, opt_err=False, opt_2d=False, label = None, subplot=None) :
+        x, low, high : arrays (nspec, nbins), or the input arrays if there are less than 3 values per bin
+
+        """
+    low  = np.atleast_2d(low)
+    high = np.atleast_2d(high)
+    x = np.broadcast_to(x,low.shape)
+    size = int(np.ceil(low.shape[1]/float(max(1,npix))))
+    if size < 3 :
+        return x, low, high
+    nbins = int(np.ceil(low.shape[1]/float(size)))
+    return np.mean(_bins(x,nbins,size),axis=2), np.min(_bins(low,nbins,size),axis=2), np.max(_bins(high,nbins,size),axis=2)
+
+def plot_graph(frame, fibers, opt_err=False, opt_2d=False, label = None, subplot=None, quicklook=False) :
     """Plot graph from a given spectra from a fits file and returns figure
     
     ----------
@@ -37,8 +91,14 @@ def plot_graph(frame, fibers, opt_err=False, opt_2d=False, label = None, subplot
     Where the spectra is collected to be plot.
 
     fibers : fibers to show
+
+    quicklook : draw all the fibers as a single LineCollection of spectra decimated
+    to the width of the axes in pixels (min/max envelope), errors as a band,
+    and a rasterized 2d image decimated to the figure resolution
     """
 
+    import matplotlib.pyplot as plt
+
     log         = get_logger()
     spectra     = frame["FLUX"].data
     ivar        = frame["IVAR"].data
@@ -51,26 +111,43 @@ def plot_graph(frame, fibers, opt_err=False, opt_2d=False, label = None, subplot
     
     if subplot is None :
         subplot  = plt.subplot(1,1,1)
-    
-    for fiber in fibers :
-        
+
+    if opt_err :
+        err = np.sqrt(1./ (ivar + (ivar == 0))) * (ivar > 0)
+
+    if quicklook :
+        npix  = int(subplot.get_window_extent().width)
+        fwave = wave[fibers] if len(wave.shape) > 1 else wave
+        x, y  = minmax_decimate(fwave, spectra[fibers], npix)
         if label :
-            fiber_label = "%s Fiber #%d"%(label,fiber)
+            lines_label = label
         else :
-            fiber_label="Fiber #%d"%fiber
-            
-        log.debug("Plotting fiber %03d" % fiber)
+            lines_label = "Fiber #%d"%fibers[0] if len(fibers)==1 else "Fibers #%d-%d"%(fibers[0],fibers[-1])
+        lines = plot_lines(subplot, x, y, label=lines_label, rasterized=True)
         if opt_err :
-            err = np.sqrt(1./ (ivar + (ivar == 0))) * (ivar > 0)
-            if len(wave.shape) > 1 :
-                subplot.errorbar(wave[fiber], spectra[fiber], err[fiber], fmt="o-", label=fiber_label)
+            from matplotlib.collections import PolyCollection
+            xb, low, high = minmax_band(fwave, spectra[fibers]-err[fibers], spectra[fibers]+err[fibers], npix)
+            polygons = np.stack([np.concatenate([xb,xb[:,::-1]],axis=1),np.concatenate([low,high[:,::-1]],axis=1)],axis=-1)
+            subplot.add_collection(PolyCollection(polygons, facecolors=lines.get_colors(), alpha=0.3, linewidths=0, rasterized=True))
+    else :
+        for fiber in fibers :
+        
+            if label :
+                fiber_label = "%s Fiber #%d"%(label,fiber)
             else :
-                subplot.errorbar(wave, spectra[fiber], err[fiber], fmt="o-",label=fiber_label)
-        else :
-            if len(wave.shape) > 1 :
-                subplot.plot(wave[fiber], spectra[fiber], "-",label=fiber_label)
+                fiber_label="Fiber #%d"%fiber
+            
+            log.debug("Plotting fiber %03d" % fiber)
+            if opt_err :
+                if len(wave.shape) > 1 :
+                    subplot.errorbar(wave[fiber], spectra[fiber], err[fiber], fmt="o-", label=fiber_label)
+                else :
+                    subplot.errorbar(wave, spectra[fiber], err[fiber], fmt="o-",label=fiber_label)
             else :
-                subplot.plot(wave, spectra[fiber], "-",label=fiber_label)
+                if len(wave.shape) > 1 :
+                    subplot.plot(wave[fiber], spectra[fiber], "-",label=fiber_label)
+                else :
+                    subplot.plot(wave, spectra[fiber], "-",label=fiber_label)
     
     subplot.set_xlabel("Wavelength [A]")
     
@@ -78,23 +155,31 @@ def plot_graph(frame, fibers, opt_err=False, opt_2d=False, label = None, subplot
         title="spectra"
         if label is not None:
             title = label
-        plt.figure(title)
+        fig = plt.figure(title)
+        image = spectra[fibers].T
+        if quicklook :
+            # mean of blocks of rows to the figure height in pixels
+            size = int(np.ceil(image.shape[0]/float(fig.get_size_inches()[1]*fig.dpi)))
+            if size > 1 :
+                nrows = image.shape[0]//size
+                image = image[:nrows*size].reshape(nrows,size,image.shape[1]).mean(axis=1)
         if len(wave.shape) == 1 :
-            plt.imshow(spectra[fibers].T,
+            plt.imshow(image,
                        aspect = 'auto',
                        extent = (fibers[0] - 0.5, fibers[-1] + 0.5, wave[0], wave[-1]),
-                       origin = 0.,
-                       interpolation = "nearest")
+                       origin = "lower",
+                       interpolation = "nearest",
+                       rasterized = quicklook)
             plt.ylabel("Wavelength [A]")
             plt.xlabel("Fiber #")
         else :
-            plt.imshow(spectra[fibers].T,
+            plt.imshow(image,
                        aspect = 'auto',
                        extent = (fibers[0]-0.5, fibers[-1]+0.5, 0,spectra.shape[1]),
-                       origin = 0.,
-                       interpolation = "nearest")
+                       origin = "lower",
+                       interpolation = "nearest",
+                       rasterized = quicklook)
             plt.ylabel("Y CCD")
             plt.xlabel("Fiber #")
         plt.colorbar()
     
-
@@ -0,0 +1,252 @@
+import astropy.io.fits as pyfits
+import numpy as np
+import re
+import os
+import glob
+import multiprocessing
+
+from desispec.log import get_logger
+
+def parse_sec_keyword(value):
+    m = re.search(r'\[(\d+):(\d+)\,(\d+):(\d+)\]', value)
+    if m is None:
+        raise ValueError('unable to parse {} as [a:b, c:d]'.format(value))
+    return list(map(int, m.groups()))
+
+def parse_sec_slices(value):
+    """python slices (y,x) of a FITS section keyword like '[1:2048,1:2064]', same as desispec.preproc._parse_sec_keyword"""
+    xmin, xmax, ymin, ymax = parse_sec_keyword(value)
+    return np.s_[ymin-1:ymax, xmin-1:xmax]
+
+def parse_date_obs(value):
+    m = re.search(r'(\d+)-(\d+)-(\d+)T', value)
+    if m is None:
+        raise ValueError('unable to parse {}'.format(value))
+    yy,mm,dd = map(int, m.groups())
+    return yy*10000+mm*100+dd
+
+def ics_version(header) :
+    """Guess the ICS version from DATE-OBS of the primary header
+    """
+    date=parse_date_obs(header["DATE-OBS"])
+    if date <= 20161027    : return 0
+    elif  date <= 20161107 : return 1
+    elif  date <= 20161110 : return 2
+    elif  date <= 20161123 : return 3
+    return 4
+
+def rearrange_b1_amplifiers(pixels, out=None) :
+    """Rearrange the amplifiers of the b1 camera for ICS_VERSION=4
+
+        input is
+        A B
+        C D
+        output is
+        A C
+        B D
+        with B and C flipped along both axes (the first array row is at the bottom).
+        Everything is copied once into a single preallocated output buffer.
+        """
+    ny,nx=pixels.shape
+    if ny%2 or nx%2 :
+        raise ValueError("cannot rearrange amplifiers of an image with odd dimensions %s"%str(pixels.shape))
+    hy=ny//2
+    hx=nx//2
+    if out is None :
+        out=np.empty(pixels.shape,dtype=pixels.dtype)
+    out[:hy,:hx]=pixels[hy:,hx:][::-1,::-1] # B
+    out[:hy,hx:]=pixels[:hy,hx:]            # D
+    out[hy:,:hx]=pixels[hy:,:hx]            # A
+    out[hy:,hx:]=pixels[:hy,:hx][::-1,::-1] # C
+    return out
+
+def _fix_r1_sections(header) :
+    header["DATASEC1"]='[10:2064,4:2065]'
+    d1xmin,d1xmax,d1ymin,d1ymax = parse_sec_keyword(header["DATASEC1"])
+    header["PRESEC1"]='[1:%d,%d:%d]'%(d1xmin-1,d1ymin,d1ymax)
+    header["CCDSEC1"]='[1:%d,1:%d]'%(d1xmax-d1xmin+1,d1ymax-d1ymin+1)
+    header["BIASSEC1"]='[%d:2121,%d:%d]'%(d1xmax+1,d1ymin,d1ymax)
+    c1xmin,c1xmax,c1ymin,c1ymax = parse_sec_keyword(header["CCDSEC1"])
+    p1xmin,p1xmax,p1ymin,p1ymax = parse_sec_keyword(header["PRESEC1"])
+    b1xmin,b1xmax,b1ymin,b1ymax = parse_sec_keyword(header["BIASSEC1"])
+
+    header["DATASEC2"]='[2179:4230,%d:%d]'%(d1ymin,d1ymax)
+    d2xmin,d2xmax,d2ymin,d2ymax = parse_sec_keyword(header["DATASEC2"])
+    header["PRESEC2"]='[%d:%d,%d:%d]'%(d2xmax,header["NAXIS1"],d2ymin,d2ymax)
+    header["BIASSEC2"]='[%d:%d,%d:%d]'%(b1xmax+1,d2xmin-1,d2ymin,d2ymax)
+    header["CCDSEC2"]='[%d:%d,%d:%d]'%(c1xmax+1,c1xmax+1+d2xmax-d2xmin,1,d2ymax-d2ymin+1)
+    c2xmin,c2xmax,c2ymin,c2ymax = parse_sec_keyword(header["CCDSEC2"])
+    p2xmin,p2xmax,p2ymin,p2ymax = parse_sec_keyword(header["PRESEC2"])
+    b2xmin,b2xmax,b2ymin,b2ymax = parse_sec_keyword(header["BIASSEC2"])
+
+    header["DATASEC3"]='[%d:%d,2090:4152]'%(d1xmin,d1xmax)
+    d3xmin,d3xmax,d3ymin,d3ymax = parse_sec_keyword(header["DATASEC3"])
+    header["PRESEC3"]='[%d:%d,%d:%d]'%(p1xmin,p1xmax,d3ymin,d3ymax)
+    header["BIASSEC3"]='[%d:%d,%d:%d]'%(b1xmin,b1xmax,d3ymin,d3ymax)
+    header["CCDSEC3"]='[%d:%d,%d:%d]'%(c1xmin,c1xmax,c1ymax+1,c1ymax+1+d3ymax-d3ymin)
+    c3xmin,c3xmax,c3ymin,c3ymax = parse_sec_keyword(header["CCDSEC3"])
+
+    header["DATASEC4"]='[%d:%d,%d:%d]'%(d2xmin,d2xmax,d3ymin,d3ymax)
+    header["PRESEC4"]='[%d:%d,%d:%d]'%(p2xmin,p2xmax,d3ymin,d3ymax)
+    header["BIASSEC4"]='[%d:%d,%d:%d]'%(b2xmin,b2xmax,d3ymin,d3ymax)
+    header["CCDSEC4"]='[%d:%d,%d:%d]'%(c2xmin,c2xmax,c3ymin,c3ymax)
+
+def _flip_sections_along_y(header) :
+    xmin,xmax,ymin,ymax = parse_sec_keyword(header["CCDSEC4"])
+    ny_ccd=ymax
+    ny_input=header["NAXIS2"]
+    header_copy=header.copy()
+    for amp in range(1,5) :
+        for sec in ["PRESEC","DATASEC","BIASSEC","CCDSEC"] :
+            key="%s%d"%(sec,amp) # DO NOT CHANGE AMP NAMES, CONFUSING
+            xmin,xmax,ymin,ymax = parse_sec_keyword(header_copy[key])
+            if sec == "CCDSEC" :
+                flipped_ymax=ny_ccd-ymin+1
+                flipped_ymin=ny_ccd-ymax+1
+            else :
+                flipped_ymax=ny_input-ymin+1
+                flipped_ymin=ny_input-ymax+1
+            header[key]='[%d:%d,%d:%d]'%(xmin,xmax,flipped_ymin,flipped_ymax)
+
+def writeto_atomic(hdulist, filename) :
+    """Write a HDUList to a temporary file in the same directory and rename it,
+    so that a partially written file never appears under the final name
+    """
+    dirname=os.path.dirname(os.path.abspath(filename))
+    tmpfilename=os.path.join(dirname,".tmp%d.%s"%(os.getpid(),os.path.basename(filename)))
+    try :
+        hdulist.writeto(tmpfilename)
+        os.replace(tmpfilename,filename)
+    finally :
+        if os.path.exists(tmpfilename) :
+            os.remove(tmpfilename)
+
+def format_ics_file(infile, outfile) :
+    """Minimal reformatting of a ICS raw data file to adapt to DESI soft
+
+        The input is memory mapped, only the modified image extensions are read.
+
+        -------
+        Returns
+        -------
+
+        True if the file was written, False if there is nothing to do for this ICS version.
+        Raises ValueError if the file cannot be converted.
+
+        """
+    log=get_logger()
+    ffile=pyfits.open(infile,memmap=True)
+    try :
+        if not "DATE-OBS" in ffile[0].header :
+            raise ValueError("no DATE-OBS in %s, cannot guess ICS version"%infile)
+        version=ics_version(ffile[0].header)
+        log.debug("%s : guessed ICS_VERSION : %d"%(infile,version))
+
+        if version==3 :
+            log.info("%s : do not do anything for ICS_VERSION>=3"%infile)
+            return False
+        if version==1 :
+            raise ValueError("formatting for ICS_VERSION=1 is not implemented (%s)"%infile)
+
+        if version<=2 :
+            extnames=["CCDS1R"]
+            cameras=["R1"]
+        else :
+            extnames=["B1","R1","Z1"]
+            cameras=["b1","r1","z1"]
+
+        for extname,camera in zip(extnames,cameras) :
+            hdu=ffile[extname]
+            header=hdu.header
+            if version<=2 :
+                header["CAMERA"]=camera
+                header["EXTNAME"]=camera
+
+            if version==0 and camera=="R1" :
+                log.warning("%s : changing DATASEC,CCDSEC,BIASEC for %s"%(infile,extname))
+                _fix_r1_sections(header)
+
+            log.debug("%s : changing gains of %s"%(infile,extname))
+            reference_gain=1.
+            for amp in range(1,5) :
+                header["GAIN%d"%amp]=reference_gain
+
+            if version<=1 and camera=="R1" :
+                log.warning("%s : flip image along Y for camera %s and ICS VERSION=%d"%(infile,camera,version))
+                hdu.data = hdu.data[::-1,:]
+                _flip_sections_along_y(header)
+
+            if version==4 and camera.lower() == "b1" :
+                log.warning("%s : rearrange amplifiers for camera=%s and ICS VERSION=%d (amplifier names not changed)"%(infile,camera,version))
+                hdu.data=rearrange_b1_amplifiers(hdu.data)
+
+            if version==4 and camera.lower() == "z1" :
+                log.warning("%s : flip along X (fibers) for camera=%s and ICS VERSION=%d (amplifier names not changed)"%(infile,camera,version))
+                hdu.data=hdu.data[:,::-1]
+
+        writeto_atomic(ffile,outfile)
+    finally :
+        ffile.close()
+    return True
+
+def list_ics_files(inputs, pattern="*.fits*") :
+    """Expand a list of files, directories (using pattern) and glob expressions into a sorted list of files
+    """
+    filenames=[]
+    for path in inputs :
+        if os.path.isdir(path) :
+            filenames += glob.glob(os.path.join(path,pattern))
+        elif glob.has_magic(path) :
+            filenames += glob.glob(path)
+        else :
+            filenames.append(path)
+    return sorted(set(filenames))
+
+def _format_ics_file_job(args) :
+    infile,outfile = args
+    log=get_logger()
+    try :
+        done=format_ics_file(infile,outfile)
+    except Exception as e :
+        log.error("failed to convert %s : %s"%(infile,str(e)))
+        return infile,None
+    if done :
+        log.info("wrote %s"%outfile)
+        return infile,outfile
+    return infile,None
+
+def format_ics_files(infiles, outdir, nproc=None, overwrite=True) :
+    """Convert a list of ICS raw data files into outdir (same file names) with a pool of processes
+
+        -------
+        Returns
+        -------
+
+        dictionary of input filename -> output filename (None if not converted)
+
+        """
+    log=get_logger()
+    if not os.path.isdir(outdir) :
+        os.makedirs(outdir)
+    jobs=[]
+    for infile in infiles :
+        outfile=os.path.join(outdir,os.path.basename(infile))
+        if os.path.abspath(outfile)==os.path.abspath(infile) :
+            raise ValueError("output directory must differ from the input directory of %s"%infile)
+        if not overwrite and os.path.isfile(outfile) :
+            log.info("skip %s, %s exists"%(infile,outfile))
+            continue
+        jobs.append((infile,outfile))
+    if nproc is None :
+        nproc=multiprocessing.cpu_count()
+    nproc=max(1,min(nproc,len(jobs)))
+    log.info("converting %d files with %d processes"%(len(jobs),nproc))
+    if nproc==1 :
+        return dict(map(_format_ics_file_job,jobs))
+    pool=multiprocessing.Pool(nproc)
+    try :
+        results=dict(pool.imap_unordered(_format_ics_file_job,jobs))
+    finally :
+        pool.close()
+        pool.join()
+    return results
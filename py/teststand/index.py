@@ -0,0 +1,203 @@
+import astropy.io.fits as pyfits
+import sqlite3
+import glob
+import os
+
+from desispec.log import get_logger
+
+default_keys = ["CAMERA","EXPNUM","EXPTIME","EXPREQ","NDNUM","FLAVOR","DATE-OBS"]
+
+# prefix of a file list argument to be replaced by the result of a query to the index
+query_prefix = "query:"
+
+def default_index_filename() :
+    """Returns the index database filename, $TESTSTAND_INDEX if set"""
+    return os.environ.get("TESTSTAND_INDEX","teststand-index.db")
+
+def _quote(key) :
+    return '"%s"'%key.replace('"','""')
+
+def _value(val) :
+    if isinstance(val,bool) :
+        return int(val)
+    if isinstance(val,(int,float)) :
+        return val
+    if isinstance(val,str) :
+        return val.strip()
+    return str(val)
+
+def list_fits_files(paths, pattern="*.fits*") :
+    """Expand a list of files, directories (recursively, using pattern) and glob expressions into a list of files
+    """
+    filenames=[]
+    for path in paths :
+        if os.path.isdir(path) :
+            filenames += glob.glob(os.path.join(path,"**",pattern),recursive=True)
+        elif glob.has_magic(path) :
+            filenames += glob.glob(path)
+        else :
+            filenames.append(path)
+    return sorted(set([os.path.abspath(f) for f in filenames]))
+
+class ExposureIndex(object) :
+    """SQLite index of header keywords of FITS files
+
+        Only the header blocks are read. Each row contains the file path, size, mtime
+        and one column per keyword. A file is read again only if its size or mtime change,
+        or if some requested keywords are not indexed yet for it. The keywords already
+        indexed for a file are kept when other keywords are requested.
+
+        ----------
+        Parameters
+        ----------
+
+        filename : path to the sqlite database (created if needed)
+
+        """
+    def __init__(self, filename=None) :
+        if filename is None :
+            filename = default_index_filename()
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hdu TEXT, keys TEXT)")
+        self.db.commit()
+
+    def close(self) :
+        self.db.close()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        self.close()
+
+    def columns(self) :
+        return [row[1] for row in self.db.execute("PRAGMA table_info(files)")]
+
+    def _add_columns(self, keys) :
+        existing = self.columns()
+        for key in keys :
+            if not key in existing :
+                self.db.execute("ALTER TABLE files ADD COLUMN %s"%_quote(key))
+
+    def update(self, filenames, keys=None, hdu=0) :
+        """Add or refresh the given files in the index
+
+            ----------
+            Parameters
+            ----------
+
+            filenames : list of files
+            keys : header keywords to store (default is teststand.index.default_keys)
+            hdu  : HDU index or EXTNAME to read the header from
+
+            -------
+            Returns
+            -------
+
+            number of files (re)read
+
+            """
+        log  = get_logger()
+        if keys is None :
+            keys = default_keys
+        self._add_columns(keys)
+        known = {}
+        for path,size,mtime,khdu,kkeys in self.db.execute("SELECT path,size,mtime,hdu,keys FROM files") :
+            known[path]=(size,mtime,khdu,kkeys.split(",") if kkeys else [])
+
+        statements = {}
+        nread = 0
+        for filename in filenames :
+            path = os.path.abspath(filename)
+            try :
+                stat = os.stat(path)
+            except OSError :
+                log.warning("cannot stat %s"%path)
+                continue
+            file_keys = list(keys)
+            if path in known :
+                size,mtime,khdu,kkeys = known[path]
+                if (size,mtime,khdu) == (stat.st_size,stat.st_mtime,str(hdu)) and set(keys) <= set(kkeys) :
+                    continue
+                # the row is replaced, keep the keywords indexed with a previous list
+                file_keys = kkeys + [k for k in keys if not k in kkeys]
+            try :
+                header = pyfits.getheader(path,hdu)
+            except Exception as e :
+                log.warning("cannot read header of %s : %s"%(path,str(e)))
+                continue
+            signature = ",".join(file_keys)
+            if not signature in statements :
+                columns = ["path","size","mtime","hdu","keys"] + file_keys
+                statements[signature] = "INSERT OR REPLACE INTO files (%s) VALUES (%s)"%(",".join([_quote(c) for c in columns]),",".join(["?"]*len(columns)))
+            values = [path,stat.st_size,stat.st_mtime,str(hdu),signature]
+            for key in file_keys :
+                values.append(_value(header[key]) if key in header else None)
+            self.db.execute(statements[signature],values)
+            nread += 1
+        self.db.commit()
+        log.debug("read %d headers out of %d files"%(nread,len(filenames)))
+        return nread
+
+    def prune(self) :
+        """Remove files that do not exist anymore, returns the number of removed entries
+        """
+        missing = [(path,) for (path,) in self.db.execute("SELECT path FROM files") if not os.path.isfile(path)]
+        self.db.executemany("DELETE FROM files WHERE path=?",missing)
+        self.db.commit()
+        return len(missing)
+
+    def select(self, where=None, keys=None, params=()) :
+        """Returns the list of rows matching a SQL WHERE clause, sorted by path
+
+            ----------
+            Parameters
+            ----------
+
+            where : SQL condition, for instance "CAMERA='b1' AND NDNUM=2 AND EXPREQ<10",
+            keywords with special characters must be quoted like "DATE-OBS"
+            keys : keywords to return in addition to the path (default is none)
+            params : parameters for the ? placeholders in where
+
+            -------
+            Returns
+            -------
+
+            list of tuples (path, values of keys ...)
+
+            """
+        if keys is None :
+            keys = []
+        statement = "SELECT %s FROM files"%(",".join(["path"]+[_quote(k) for k in keys]))
+        if where is not None and len(where.strip())>0 :
+            statement += " WHERE %s"%where
+        statement += " ORDER BY path"
+        return [tuple(row) for row in self.db.execute(statement,params)]
+
+    def query(self, where=None, params=()) :
+        """Returns the list of paths matching a SQL WHERE clause, see select"""
+        return [row[0] for row in self.select(where,params=params)]
+
+def expand_filenames(filenames, index_filename=None) :
+    """Replace the arguments of the form 'query:<SQL condition>' by the matching files of the index
+
+        This allows scripts to take a query in place of a file list, for instance
+        desi_median_image -i "query:CAMERA='b1' AND FLAVOR='zero'" -o bias.fits
+        The index is $TESTSTAND_INDEX (or teststand-index.db) unless index_filename is given.
+        """
+    if filenames is None :
+        return filenames
+    if not any([f.startswith(query_prefix) for f in filenames]) :
+        return filenames
+    log=get_logger()
+    result=[]
+    with ExposureIndex(index_filename) as index :
+        for f in filenames :
+            if f.startswith(query_prefix) :
+                paths=index.query(f[len(query_prefix):])
+                log.info("%d files match '%s' in %s"%(len(paths),f[len(query_prefix):],index.filename))
+                result += paths
+            else :
+                result.append(f)
+    return result
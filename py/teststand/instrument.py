@@ -0,0 +1,209 @@
+import os
+import sys
+import time
+import json
+import atexit
+import datetime
+import functools
+import threading
+import contextlib
+
+from desispec.log import get_logger
+
+# path of the JSON timing report, enables the instrumentation of all tools when set
+env_var = "TESTSTAND_PROFILE"
+# set to 1 to track the peak memory of each stage with tracemalloc (slow)
+env_var_memory = "TESTSTAND_PROFILE_MEMORY"
+# path of a cProfile output file
+env_var_cprofile = "TESTSTAND_CPROFILE"
+
+class StageTimer(object) :
+    """Accumulates wall time, CPU time and number of calls of named stages
+
+        Stages can be nested, a nested stage is recorded as 'parent/child'.
+        A stage called several times (for instance once per fiber) is accumulated.
+        Each thread has its own stack of stages, the records are shared.
+
+        ----------
+        Parameters
+        ----------
+
+        trace_memory : if True, also record the peak memory allocated by python code during each stage
+                       (uses tracemalloc, which slows down the execution)
+
+        """
+    def __init__(self, trace_memory=False) :
+        self.trace_memory = trace_memory
+        self.records = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.t0 = time.time()
+        if trace_memory :
+            import tracemalloc
+            if not tracemalloc.is_tracing() :
+                tracemalloc.start()
+
+    @property
+    def stack(self) :
+        if not hasattr(self.local,"stack") :
+            self.local.stack = []
+        return self.local.stack
+
+    def _peak(self) :
+        import tracemalloc
+        peak = tracemalloc.get_traced_memory()[1]
+        if hasattr(tracemalloc,"reset_peak") :
+            tracemalloc.reset_peak()
+        return peak
+
+    def start(self, name) :
+        if self.trace_memory and len(self.stack)>0 :
+            # save the peak of the parent before it is reset for the child
+            self.stack[-1]["peak"] = max(self.stack[-1]["peak"],self._peak())
+        elif self.trace_memory :
+            self._peak()
+        path = "/".join([s["name"] for s in self.stack]+[name])
+        self.stack.append({"name":name, "path":path, "wall":time.time(), "cpu":time.process_time(), "peak":0})
+
+    def stop(self) :
+        current = self.stack.pop()
+        with self.lock :
+            record = self.records.get(current["path"])
+            if record is None :
+                record = {"stage":current["path"], "calls":0, "wall":0., "cpu":0.}
+                self.records[current["path"]] = record
+            record["calls"] += 1
+            record["wall"]  += time.time()-current["wall"]
+            record["cpu"]   += time.process_time()-current["cpu"]
+            if self.trace_memory :
+                peak = max(current["peak"],self._peak())
+                record["peak_mb"] = max(record.get("peak_mb",0.),peak/1024.**2)
+                if len(self.stack)>0 :
+                    self.stack[-1]["peak"] = max(self.stack[-1]["peak"],peak)
+
+    @contextlib.contextmanager
+    def stage(self, name) :
+        self.start(name)
+        try :
+            yield self
+        finally :
+            self.stop()
+
+    def report(self) :
+        """Returns the timing report as a dictionary"""
+        return {"tool":os.path.basename(sys.argv[0]),
+                "argv":sys.argv[1:],
+                "date":datetime.datetime.now().isoformat(),
+                "total_wall":time.time()-self.t0,
+                "stages":list(self.records.values())}
+
+_timer    = None
+_profiler = None
+_report_filename = None
+
+def enabled() :
+    return _timer is not None
+
+def enable(report=None, trace_memory=False, cprofile=None) :
+    """Enable the stage timers, the report is written at exit
+
+        ----------
+        Parameters
+        ----------
+
+        report : path of the JSON report, default is <tool>-timing.json
+        trace_memory : track peak memory per stage with tracemalloc
+        cprofile : optional path of a cProfile output file (readable with pstats or snakeviz)
+
+        """
+    global _timer, _profiler, _report_filename
+    if _timer is not None :
+        return _timer
+    _timer = StageTimer(trace_memory=trace_memory)
+    if report is None or report in ("","1") :
+        report = "%s-timing.json"%os.path.basename(sys.argv[0]).replace(".py","")
+    _report_filename = report
+    if cprofile is not None :
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(_write_at_exit, cprofile)
+    return _timer
+
+def _top_functions(profiler, n=20) :
+    import pstats
+    stats = pstats.Stats(profiler).stats
+    items = sorted(stats.items(), key=lambda item : -item[1][3])[:n]
+    return [{"function":"%s:%d(%s)"%key, "calls":value[1], "tottime":value[2], "cumtime":value[3]} for key,value in items]
+
+def _write_at_exit(cprofile) :
+    report = _timer.report()
+    if _profiler is not None :
+        _profiler.disable()
+        _profiler.dump_stats(cprofile)
+        report["cprofile"] = cprofile
+        report["top_functions"] = _top_functions(_profiler)
+    write_report(report, _report_filename)
+
+def write_report(report, filename) :
+    with open(filename,"w") as file :
+        json.dump(report,file,indent=1)
+    get_logger().info("wrote timing report %s"%filename)
+
+def enable_from_env() :
+    """Enable the stage timers if $TESTSTAND_PROFILE is set"""
+    if env_var in os.environ :
+        enable(report=os.environ[env_var], trace_memory=(os.environ.get(env_var_memory,"0")=="1"),
+               cprofile=os.environ.get(env_var_cprofile))
+
+def add_arguments(parser) :
+    """Add the --profile, --profile-memory and --cprofile options to an argparse parser"""
+    parser.add_argument('--profile', type = str, default = None, required = False, nargs = "?", const = "",
+                        help = 'write a JSON timing report of the processing stages to this file (default is <tool>-timing.json)')
+    parser.add_argument('--profile-memory', action = 'store_true', help = 'also record the peak memory of each stage (slow)')
+    parser.add_argument('--cprofile', type = str, default = None, required = False, help = 'write cProfile stats to this file')
+
+def init(args) :
+    """Enable the stage timers from the options of add_arguments or from $TESTSTAND_PROFILE"""
+    if args.profile is not None or args.cprofile is not None :
+        enable(report=args.profile, trace_memory=args.profile_memory, cprofile=args.cprofile)
+    else :
+        enable_from_env()
+
+@contextlib.contextmanager
+def stage(name) :
+    """Context manager timing a processing stage, does nothing if the instrumentation is not enabled"""
+    if _timer is None :
+        yield
+        return
+    _timer.start(name)
+    try :
+        yield
+    finally :
+        _timer.stop()
+
+def start_stage(name) :
+    """Start a stage (for long script sections where a with block is not practical), see stop_stage"""
+    if _timer is not None :
+        _timer.start(name)
+
+def stop_stage() :
+    """Stop the last started stage"""
+    if _timer is not None :
+        _timer.stop()
+
+def timed(name=None) :
+    """Decorator timing each call of a function as a stage (named after the function by default)"""
+    def decorator(func) :
+        stage_name = func.__name__ if name is None else name
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) :
+            if _timer is None :
+                return func(*args, **kwargs)
+            with stage(stage_name) :
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# library code is instrumented as soon as the environment variable is set
+enable_from_env()
@@ -0,0 +1,172 @@
+import numpy as np
+import astropy.io.fits as pyfits
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from desispec.log import get_logger
+from teststand.prefetch import prefetch, read_fits
+
+def mean_spectra(filenames, hdu=0) :
+    """Running mean of the spectra of a list of frames, only the current frame and the frames read in advance
+    (see teststand.prefetch) are in memory
+
+        -------
+        Returns
+        -------
+
+        mean spectra, wavelength array of the first frame
+
+        """
+    log=get_logger()
+    mean=None
+    wave=None
+    # the next frames are read while the current one is added
+    for n,(filename,h) in enumerate(prefetch(filenames, reader=functools.partial(read_fits, hdus=[hdu,"WAVELENGTH"]))) :
+        log.debug("reading %s"%filename)
+        data=h[hdu].data
+        if mean is None :
+            mean=data.astype(float)
+            wave=h["WAVELENGTH"].data.copy()
+        else :
+            mean += (data-mean)/(n+1)
+    return mean, wave
+
+def median_spectra(filenames, hdu=0, max_bytes=256*1024**2) :
+    """Median of the spectra of a list of frames computed by blocks of fibers on memory mapped files,
+    so that the memory usage is bounded by max_bytes whatever the number of frames
+
+        -------
+        Returns
+        -------
+
+        median spectra, wavelength array of the first frame
+
+        """
+    log=get_logger()
+    hdulists=[pyfits.open(filename,memmap=True) for filename in filenames]
+    try :
+        shape=hdulists[0][hdu].data.shape
+        wave=hdulists[0]["WAVELENGTH"].data.copy()
+        nfibers=shape[0]
+        row_bytes=8*int(np.prod(shape[1:]))*len(hdulists)
+        block=max(1,min(nfibers,max_bytes//row_bytes))
+        log.debug("median of %d frames by blocks of %d fibers"%(len(hdulists),block))
+        median=np.zeros(shape)
+        for begin in range(0,nfibers,block) :
+            end=min(nfibers,begin+block)
+            stack=np.array([h[hdu].data[begin:end] for h in hdulists],dtype=float)
+            median[begin:end]=np.median(stack,axis=0)
+    finally :
+        for h in hdulists :
+            h.close()
+    return median, wave
+
+def _bin_index(xx, bins) :
+    # same binning as np.histogram : last bin includes its upper edge, values outside are -1
+    nbins=bins.size-1
+    index=np.searchsorted(bins,xx,side="right")-1
+    index[xx==bins[-1]]=nbins-1
+    index[(xx<bins[0])|(xx>bins[-1])]=-1
+    return index
+
+def profile(xx, yy, bins, group=None, ngroups=1, minentries=10) :
+    """Mean and uncertainty of the mean of yy in bins of xx, in a single binned pass
+
+        ----------
+        Parameters
+        ----------
+
+        xx, yy : 1D arrays
+        bins : bin edges (as in np.histogram)
+        group : optional integer array in [0,ngroups[ to compute a profile per group (for instance per fiber)
+        minentries : bins with less than (or equal to) this number of entries are discarded
+
+        -------
+        Returns
+        -------
+
+        x, y, ey : mean of xx, mean of yy and its uncertainty for the valid bins,
+        or a list of such tuples (one per group) if group is not None
+
+        """
+    nbins=bins.size-1
+    index=_bin_index(xx,bins)
+    if group is not None :
+        index[index>=0] += nbins*np.asarray(group)[index>=0]
+    ok=(index>=0)
+    index=index[ok]
+    xx=xx[ok]
+    yy=yy[ok]
+    n=nbins*ngroups
+    s1=np.bincount(index,minlength=n).reshape(ngroups,nbins)
+    sx=np.bincount(index,weights=xx,minlength=n).reshape(ngroups,nbins)
+    sy=np.bincount(index,weights=yy,minlength=n).reshape(ngroups,nbins)
+    sy2=np.bincount(index,weights=yy**2,minlength=n).reshape(ngroups,nbins)
+    res=[]
+    for g in range(ngroups) :
+        i=(s1[g]>minentries)
+        x=sx[g][i]/s1[g][i]
+        y=sy[g][i]/s1[g][i]
+        ey=np.sqrt((sy2[g][i]/s1[g][i]-y**2)/(s1[g][i]-1))
+        res.append((x,y,ey))
+    if group is None :
+        return res[0]
+    return res
+
+def flux_ratio(spectra1, spectra2, fibers, yy, minflux) :
+    """Gather flux of sample 2 and ratio of sample 1 / sample 2 for the given fibers and rows where flux2>minflux
+
+        -------
+        Returns
+        -------
+
+        x, y, fiber_index : flux2, ratio, and index in the fibers array of each selected pixel
+
+        """
+    fibers=np.asarray(fibers)
+    f2=spectra2[fibers[:,None],yy[None,:]]
+    f1=spectra1[fibers[:,None],yy[None,:]]
+    ok=(f2>minflux)
+    fiber_index=np.repeat(np.arange(fibers.size),yy.size).reshape(f2.shape)[ok]
+    x=f2[ok]
+    y=f1[ok]/x
+    return x, y, fiber_index
+
+def amp_flux_ratio_profiles(spectra1, spectra2, fibers, yy, bins, minflux, sum_fibers=False) :
+    """Profiles of the flux ratio of two samples as a function of flux for one amplifier
+
+        -------
+        Returns
+        -------
+
+        list of (x, y, ey) profiles, one for all fibers if sum_fibers, otherwise one per fiber
+
+        """
+    x, y, fiber_index = flux_ratio(spectra1, spectra2, fibers, yy, minflux)
+    if sum_fibers :
+        return [profile(x,y,bins)]
+    return profile(x,y,bins,group=fiber_index,ngroups=len(fibers))
+
+def flux_ratio_profiles(spectra1, spectra2, amp_fibers, amp_rows, bins, minflux, sum_fibers=False) :
+    """Compute amp_flux_ratio_profiles for several amplifiers concurrently
+
+        ----------
+        Parameters
+        ----------
+
+        amp_fibers : dictionary amp -> array of fibers
+        amp_rows : dictionary amp -> array of CCD rows
+
+        -------
+        Returns
+        -------
+
+        dictionary amp -> list of profiles
+
+        """
+    amps=list(amp_fibers.keys())
+    def func(amp) :
+        return amp_flux_ratio_profiles(spectra1, spectra2, amp_fibers[amp], amp_rows[amp], bins, minflux, sum_fibers)
+    with ThreadPoolExecutor(max_workers=max(1,len(amps))) as executor :
+        results=list(executor.map(func,amps))
+    return dict(zip(amps,results))
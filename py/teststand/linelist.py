@@ -0,0 +1,157 @@
+import numpy as np
+import os.path
+from functools import lru_cache
+
+from desispec.log import get_logger
+
+# convert air to vacuum, this is IDL routine airtovac for instance :
+# http://idlastro.gsfc.nasa.gov/ftp/pro/astro/airtovac.pro
+def convert_air_to_vacuum(air_wave) :
+    """Converts air wavelengths (A, scalar or array) to vacuum
+    """
+    air_wave = np.asarray(air_wave, dtype=float)
+    sigma2   = (1e4/air_wave)**2
+    fact     = 1. +  5.792105e-2/(238.0185 - sigma2) +  1.67917e-3/( 57.362 - sigma2)
+    # comparison with http://www.sdss.org/dr7/products/spectra/vacwavelength.html
+    # where : AIR = VAC / (1.0 + 2.735182E-4 + 131.4182 / VAC^2 + 2.76249E8 / VAC^4)
+    # air_wave=numpy.array([4861.363,4958.911,5006.843,6548.05,6562.801,6583.45,6716.44,6730.82])
+    # expected_vacuum_wave=numpy.array([4862.721,4960.295,5008.239,6549.86,6564.614,6585.27,6718.29,6732.68])
+    # test ok
+    return air_wave*fact
+
+def read_line_list(filename) :
+    """Reads an ASCII line list with columns WAVE ION INTENSITY (like the files in data/)
+
+        -------
+        Returns
+        -------
+
+        wave, ion, intensity arrays
+
+        """
+    log=get_logger()
+    wave=[]
+    ion=[]
+    intensity=[]
+    ifile=open(filename)
+    for line in ifile.readlines() :
+        if line[0]=="#" :
+            continue
+        vals=line.strip().split()
+        if len(vals)==0 :
+            continue
+        if len(vals)==3 :
+            wave.append(float(vals[0]))
+            ion.append(vals[1])
+            intensity.append(float(vals[2]))
+        else :
+            log.warning("ignore line '%s' in %s"%(line.strip(),filename))
+    ifile.close()
+    return np.array(wave), np.array(ion), np.array(intensity)
+
+class LineIndex(object) :
+    """Line catalogue partitioned by ion and sorted by wavelength for fast nearest neighbour matching
+
+        ----------
+        Parameters
+        ----------
+
+        wave, ion, intensity : arrays of the catalogue lines
+
+        """
+    def __init__(self, wave, ion, intensity=None) :
+        wave = np.asarray(wave, dtype=float)
+        ion  = np.asarray(ion).astype(str)
+        if intensity is None :
+            intensity = np.zeros(wave.size)
+        # sort by ion, then by wavelength
+        order           = np.lexsort((wave,ion))
+        self.wave       = wave[order]
+        self.ion        = ion[order]
+        self.intensity  = np.asarray(intensity, dtype=float)[order]
+        self.ions, self._begin = np.unique(self.ion, return_index=True)
+        self._end       = np.append(self._begin[1:], self.wave.size)
+
+    def __len__(self) :
+        return self.wave.size
+
+    def _range(self, ion) :
+        i = np.searchsorted(self.ions, ion)
+        if i>=self.ions.size or self.ions[i]!=ion :
+            return 0,0
+        return self._begin[i],self._end[i]
+
+    def match(self, wave, ion, tolerance=1.) :
+        """Finds the nearest catalogue line of the same ion for each input line
+
+            ----------
+            Parameters
+            ----------
+
+            wave : wavelengths of the lines to match (same air/vacuum convention as the catalogue)
+            ion  : ion name (one per line, or a single string for all)
+            tolerance : max allowed wavelength difference in A
+
+            -------
+            Returns
+            -------
+
+            index, delta : index in the catalogue arrays (-1 if no match within tolerance),
+            and absolute difference of wavelength (inf if no line of this ion)
+
+            """
+        wave  = np.atleast_1d(np.asarray(wave, dtype=float))
+        ion   = np.asarray(ion).astype(str)
+        if ion.ndim == 0 :
+            ion = np.repeat(ion, wave.size)
+        index = -np.ones(wave.size, dtype=int)
+        delta = np.inf*np.ones(wave.size)
+        for name in np.unique(ion) :
+            begin,end = self._range(name)
+            if end == begin :
+                continue
+            ii    = np.where(ion==name)[0]
+            cwave = self.wave[begin:end]
+            # candidates are the two neighbours of the insertion point
+            j     = np.searchsorted(cwave, wave[ii])
+            jlo   = np.clip(j-1, 0, cwave.size-1)
+            jhi   = np.clip(j, 0, cwave.size-1)
+            dlo   = np.abs(wave[ii]-cwave[jlo])
+            dhi   = np.abs(wave[ii]-cwave[jhi])
+            best  = np.where(dhi<dlo, jhi, jlo)
+            index[ii] = begin + best
+            delta[ii] = np.minimum(dlo, dhi)
+        index[delta>tolerance] = -1
+        return index, delta
+
+    def window(self, wavemin, wavemax, ion=None) :
+        """Returns the indices of the catalogue lines with wavemin <= wave <= wavemax, optionally for one ion only
+        """
+        if ion is not None :
+            begin,end = self._range(ion)
+            return begin + np.arange(np.searchsorted(self.wave[begin:end], wavemin, side="left"),
+                                     np.searchsorted(self.wave[begin:end], wavemax, side="right"))
+        ok = np.where((self.wave>=wavemin)&(self.wave<=wavemax))[0]
+        return ok[np.argsort(self.wave[ok])]
+
+@lru_cache(maxsize=None)
+def nist_line_index(vacuum=True) :
+    """Returns a (cached) LineIndex of the NIST arc line list used by desispec.bootcalib
+    """
+    import desispec.bootcalib
+    nist_list = desispec.bootcalib.load_arcline_list(camera="all", vacuum=vacuum, lamps=None)
+    return LineIndex(np.array(nist_list["wave"]), np.array(nist_list["Ion"]), np.array(nist_list["RelInt"]))
+
+@lru_cache(maxsize=None)
+def _file_line_index(filename, mtime, vacuum) :
+    wave, ion, intensity = read_line_list(filename)
+    if vacuum :
+        wave = convert_air_to_vacuum(wave)
+    return LineIndex(wave, ion, intensity)
+
+def file_line_index(filename, vacuum=False) :
+    """Returns a (cached) LineIndex of an ASCII line list,
+    optionally converting air wavelengths to vacuum (only for air line lists like vendor-peaks-manual-edits.data)
+    """
+    filename = os.path.abspath(filename)
+    return _file_line_index(filename, os.path.getmtime(filename), vacuum)
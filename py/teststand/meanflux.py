@@ -0,0 +1,58 @@
+import numpy as np
+
+# header line of the ASCII table read by shutter_timing_and_linearity.py (the last column is the side band flux)
+meanflux_header = "# expnum exptime expreq nd fiber flux"
+
+def wavelength_bins(wmin, wmax, wavestep=10) :
+    return np.linspace(wmin,wmax,int((wmax-wmin)/wavestep))
+
+def median_flux(wave, flux, bins) :
+    """Median wavelength and flux in each wavelength bin with at least 2 pixels"""
+    x=[]
+    y=[]
+    for i in range(bins.size-1) :
+        j=np.where((wave>=bins[i])&(wave<bins[i+1]))[0]
+        if j.size<2 : continue
+        x.append(np.median(wave[j]))
+        y.append(np.median(flux[j]))
+    return np.array(x),np.array(y)
+
+def frame_meanflux(frame, fibers=None, wmin=3700, wmax=9700, side_bands=False, wavestep=10) :
+    """Mean of the median flux in wavelength bins of each fiber of a frame
+
+        ----------
+        Parameters
+        ----------
+
+        frame : File Descriptor of a frame (FLUX, IVAR, WAVELENGTH)
+        fibers : Optional. If left empty, will use all fibers.
+        wmin, wmax : wavelength range
+        side_bands : subtract the median flux in 200A wide bands on each side of the wavelength range
+
+        -------
+        Returns
+        -------
+
+        list of rows (expnum, exptime, expreq, ndnum, fiber, flux, side band flux)
+
+        """
+    header = frame[0].header
+    bins   = wavelength_bins(wmin,wmax,wavestep)
+    if fibers is None :
+        fibers = np.arange(frame[0].data.shape[0])
+    rows = []
+    for fiber in fibers :
+        flux=frame[0].data[fiber]
+        ivar=frame[1].data[fiber]
+        fwave=frame["WAVELENGTH"].data[fiber]
+        x,y=median_flux(fwave[ivar!=0],flux[ivar!=0],bins)
+        sflux=np.mean(y)
+        sbflux=0
+        if side_bands :
+            sbflux = np.median(flux[(ivar>0)&(((fwave>wmin-200)&(fwave<wmin))|((fwave>wmax)&(fwave<wmax+200)))])
+            sflux -= sbflux
+        rows.append((header["EXPNUM"],header["EXPTIME"],header["EXPREQ"],header["NDNUM"],fiber,sflux,sbflux))
+    return rows
+
+def format_meanflux_row(row) :
+    return "%d %f %f %d %02d %g %g"%row
@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import hashlib
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from desispec.log import get_logger
+from teststand.cache import file_hash
+
+class Step(object) :
+    """A node of the pipeline : a command reading input files and writing output files
+
+        ----------
+        Parameters
+        ----------
+
+        name : unique name of the step
+        command : argument list of the command (the first item is a script of the bin directory or an executable)
+        inputs : list of input files
+        outputs : list of output files
+        stdout : optional file where the standard output of the command is written (it is added to the outputs)
+        params : optional dictionary of parameters that change the result but are not in the command line (like a software version)
+
+        """
+    def __init__(self, name, command, inputs, outputs, stdout=None, params=None) :
+        self.name    = name
+        self.command = list(command)
+        self.inputs  = list(inputs)
+        self.outputs = list(outputs)
+        self.stdout  = stdout
+        if stdout is not None and not stdout in self.outputs :
+            self.outputs.append(stdout)
+        self.params  = params if params is not None else {}
+
+    def __repr__(self) :
+        return "Step(%s)"%self.name
+
+class Pipeline(object) :
+    """Steps linked by their input and output files, run in parallel with a content hash cache
+
+        The cache key of a step is the sha256 of its command, parameters and of the content of its input files.
+        Keys and output hashes of the steps that succeeded are stored in a JSON manifest.
+        A step is run only if its key changed or if its outputs are missing or were modified,
+        so an upstream step that is rerun but writes identical files does not invalidate its dependents.
+
+        ----------
+        Parameters
+        ----------
+
+        manifest : path of the JSON manifest
+
+        """
+    def __init__(self, manifest) :
+        self.manifest_filename = manifest
+        self.steps = []
+        self.manifest = {"steps":{}, "files":{}}
+        if os.path.isfile(manifest) :
+            with open(manifest) as file :
+                self.manifest = json.load(file)
+        self.lock = threading.Lock()
+
+    def add(self, step) :
+        if step.name in [s.name for s in self.steps] :
+            raise ValueError("duplicated step name '%s'"%step.name)
+        self.steps.append(step)
+        return step
+
+    def producers(self) :
+        """dictionary output file -> step"""
+        res = {}
+        for step in self.steps :
+            for output in step.outputs :
+                path = os.path.abspath(output)
+                if path in res :
+                    raise ValueError("%s is an output of both %s and %s"%(output,res[path].name,step.name))
+                res[path] = step
+        return res
+
+    def dependencies(self) :
+        """dictionary step name -> set of names of the steps producing its inputs"""
+        producers = self.producers()
+        return dict([(step.name,set([producers[os.path.abspath(i)].name for i in step.inputs if os.path.abspath(i) in producers]))
+                     for step in self.steps])
+
+    def hash(self, filename) :
+        """Content hash of a file, cached in the manifest by path, size and modification time"""
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        with self.lock :
+            cached = self.manifest["files"].get(path)
+        if cached is not None and cached["size"]==stat.st_size and cached["mtime"]==stat.st_mtime :
+            return cached["sha256"]
+        value = file_hash(path)
+        with self.lock :
+            self.manifest["files"][path] = {"size":stat.st_size, "mtime":stat.st_mtime, "sha256":value}
+        return value
+
+    def key(self, step) :
+        h = hashlib.sha256()
+        h.update(json.dumps({"command":step.command, "params":step.params}, sort_keys=True).encode())
+        for filename in step.inputs :
+            h.update(filename.encode())
+            h.update(self.hash(filename).encode())
+        return h.hexdigest()
+
+    def up_to_date(self, step, key) :
+        record = self.manifest["steps"].get(step.name)
+        if record is None or record["key"] != key :
+            return False
+        for output in step.outputs :
+            if not os.path.isfile(output) or self.hash(output) != record["outputs"].get(os.path.abspath(output)) :
+                return False
+        return True
+
+    def save(self) :
+        with self.lock :
+            tmp = self.manifest_filename+".tmp"
+            with open(tmp,"w") as file :
+                json.dump(self.manifest,file,indent=1)
+            os.replace(tmp,self.manifest_filename)
+
+    def _run_step(self, step, dry_run=False) :
+        log = get_logger()
+        key = self.key(step)
+        if self.up_to_date(step, key) :
+            log.info("%s is up to date"%step.name)
+            return "cached"
+        log.info("running %s : %s"%(step.name," ".join(step.command)))
+        if dry_run :
+            return "run"
+        for output in step.outputs :
+            dirname = os.path.dirname(os.path.abspath(output))
+            if not os.path.isdir(dirname) :
+                os.makedirs(dirname, exist_ok=True)
+        command = list(step.command)
+        # scripts of this package are run with the current interpreter
+        if command[0].endswith(".py") or command[0].startswith("desi_") :
+            from teststand.benchmark import script_path
+            path = script_path(command[0])
+            if os.path.isfile(path) :
+                command = [sys.executable, path]+command[1:]
+        env = dict(os.environ, MPLBACKEND="Agg")
+        with self.lock :
+            self.manifest["steps"].pop(step.name, None)
+        if step.stdout is not None :
+            with open(step.stdout+".tmp","w") as file :
+                status = subprocess.call(command, stdout=file, env=env)
+            if status == 0 :
+                os.replace(step.stdout+".tmp", step.stdout)
+            else :
+                os.remove(step.stdout+".tmp")
+        else :
+            status = subprocess.call(command, env=env)
+        if status != 0 :
+            log.error("%s failed with status %d"%(step.name,status))
+            return "failed"
+        missing = [o for o in step.outputs if not os.path.isfile(o)]
+        if len(missing) > 0 :
+            log.error("%s did not write %s"%(step.name," ".join(missing)))
+            return "failed"
+        outputs = dict([(os.path.abspath(o),self.hash(o)) for o in step.outputs])
+        with self.lock :
+            self.manifest["steps"][step.name] = {"key":key, "outputs":outputs}
+        self.save()
+        return "run"
+
+    def run(self, nproc=None, targets=None, dry_run=False) :
+        """Run the steps that are not up to date, independent steps in parallel
+
+            ----------
+            Parameters
+            ----------
+
+            nproc : number of commands run in parallel, default is the number of cores
+            targets : optional list of step names, only these steps and their dependencies are run
+            dry_run : only print the steps that would be run (assuming that the steps that are run change their outputs)
+
+            -------
+            Returns
+            -------
+
+            dictionary step name -> 'cached', 'run', 'failed' or 'skipped' (a dependency failed)
+
+            """
+        log = get_logger()
+        dependencies = self.dependencies()
+        steps = dict([(step.name,step) for step in self.steps])
+        if targets is not None :
+            selected = set()
+            todo = list(targets)
+            while len(todo) > 0 :
+                name = todo.pop()
+                if not name in steps :
+                    raise ValueError("unknown step '%s'"%name)
+                if not name in selected :
+                    selected.add(name)
+                    todo += list(dependencies[name])
+            steps = dict([(name,steps[name]) for name in selected])
+        if nproc is None :
+            nproc = os.cpu_count()
+        status = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1,nproc)) as executor :
+            while len(status) < len(steps) :
+                nstatus = len(status)
+                for name in sorted(steps.keys()) :
+                    if name in status or name in running.values() :
+                        continue
+                    deps = [d for d in dependencies[name] if d in steps]
+                    if any([status.get(d) in ("failed","skipped") for d in deps]) :
+                        log.warning("skip %s, a dependency failed"%name)
+                        status[name] = "skipped"
+                    elif dry_run and any([status.get(d) == "run" for d in deps]) :
+                        log.info("running %s : %s"%(name," ".join(steps[name].command)))
+                        status[name] = "run"
+                    elif all([d in status for d in deps]) :
+                        running[executor.submit(self._run_step, steps[name], dry_run)] = name
+                if len(running) == 0 :
+                    if len(status) == nstatus :
+                        raise ValueError("cyclic dependencies between steps %s"%(",".join(sorted(set(steps.keys())-set(status.keys())))))
+                    continue
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done :
+                    name = running.pop(future)
+                    try :
+                        status[name] = future.result()
+                    except Exception as e :
+                        log.error("%s failed : %s"%(name,str(e)))
+                        status[name] = "failed"
+        self.save()
+        return status
+
+def linearity_pipeline(inputs, workdir, psf, camera, amp, fibers=None, width=9, side_bands=False,
+                       wmin=3700., wmax=9700., preprocessed=False, reformat=True) :
+    """Pipeline from raw ICS files to the shutter timing and linearity results of a camera and amplifier :
+    format_raw_data_from_ics.py, desi_preproc, desi_extract_boxcar, meanflux_for_shutter_timing_and_linearity.py,
+    shutter_timing_and_linearity.py
+
+        ----------
+        Parameters
+        ----------
+
+        inputs : list of raw data files (or of preprocessed images if preprocessed=True), must not be empty
+        workdir : directory of the intermediate and final products, and of the manifest
+        psf : psf file of the camera
+        fibers : fibers option of the scripts (string like '0:20')
+        reformat : run format_raw_data_from_ics.py (not needed for recent ICS versions)
+
+        -------
+        Returns
+        -------
+
+        Pipeline, the final step is named 'linearity'
+
+        """
+    import astropy.io.fits as pyfits
+    if len(inputs) == 0 :
+        raise ValueError("no input file for the linearity pipeline")
+    pipeline = Pipeline(os.path.join(workdir,"pipeline-manifest.json"))
+    fibers_args = ["--fibers",fibers] if fibers is not None else []
+    frames = []
+    for filename in inputs :
+        expnum = pyfits.getheader(filename,0)["EXPNUM"]
+        if preprocessed :
+            preproc = filename
+        else :
+            raw = filename
+            if reformat :
+                raw = os.path.join(workdir,"raw",os.path.basename(filename))
+                pipeline.add(Step("format-%08d"%expnum,["format_raw_data_from_ics.py","-i",filename,"-o",raw],[filename],[raw]))
+            preproc = os.path.join(workdir,"preproc-%s-%08d.fits"%(camera,expnum))
+            pipeline.add(Step("preproc-%s-%08d"%(camera,expnum),["desi_preproc","--infile",raw,"--outfile",preproc,"--cameras",camera],
+                              [raw],[preproc]))
+        frame = os.path.join(workdir,"frame-%s-%08d.fits"%(camera,expnum))
+        pipeline.add(Step("extract-%s-%08d"%(camera,expnum),
+                          ["desi_extract_boxcar","-p",psf,"-i",preproc,"-o",frame,"--width",str(width)]+fibers_args+(["--sb"] if side_bands else []),
+                          [psf,preproc],[frame]))
+        frames.append(frame)
+    # the frames only contain the selected fibers, so the meanflux step uses all of them
+    meanflux = os.path.join(workdir,"meanflux-%s.txt"%camera)
+    pipeline.add(Step("meanflux-%s"%camera,
+                      ["meanflux_for_shutter_timing_and_linearity.py","-f"]+frames+["--wmin",str(wmin),"--wmax",str(wmax)]+(["--sb"] if side_bands else []),
+                      frames,[],stdout=meanflux))
+    pipeline.add(Step("linearity",["shutter_timing_and_linearity.py","-i",meanflux,"--camera",camera,"--amp",amp],
+                      [meanflux],[],stdout=os.path.join(workdir,"linearity-%s-%s.txt"%(camera,amp))))
+    return pipeline
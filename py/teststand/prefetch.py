@@ -0,0 +1,88 @@
+import os
+import collections
+import astropy.io.fits as pyfits
+from concurrent.futures import ThreadPoolExecutor
+
+from teststand.instrument import stage
+
+def read_fits(filename, hdus=None) :
+    """Read a FITS file in memory and close it
+
+        ----------
+        Parameters
+        ----------
+
+        hdus : optional list of HDU indices or names to read, default is all.
+               All headers are read, the data of the other HDUs are not accessible.
+
+        -------
+        Returns
+        -------
+
+        HDUList with decoded data
+
+        """
+    hdulist = pyfits.open(filename, memmap=False)
+    try :
+        len(hdulist) # read all headers
+        if hdus is None :
+            hdus = range(len(hdulist))
+        for hdu in hdus :
+            hdulist[hdu].data
+    finally :
+        hdulist.close()
+    return hdulist
+
+def prefetch(filenames, reader=read_fits, nahead=2, nthreads=2, max_bytes=1024**3, size=os.path.getsize) :
+    """Iterate on files read in advance by a pool of threads, in the order of the list
+
+        The next files are read and decoded in the background while the current one is processed,
+        which hides the I/O latency of network file systems.
+
+        ----------
+        Parameters
+        ----------
+
+        filenames : list of files
+        reader : function filename -> value, default is read_fits
+        nahead : max number of files read in advance
+        nthreads : number of reading threads
+        max_bytes : max size of the files read in advance but not yet consumed (one file is always read)
+        size : function filename -> estimated size in bytes, default is the file size
+
+        -------
+        Returns
+        -------
+
+        generator of (filename, value), an exception of the reader is raised when its file is reached
+
+        """
+    filenames = list(filenames)
+    pending = collections.deque()
+    state = {"inflight":0, "next":0}
+    executor = ThreadPoolExecutor(max_workers=max(1,min(nthreads,nahead)))
+
+    def fill() :
+        while state["next"] < len(filenames) and len(pending) < max(1,nahead) :
+            filename = filenames[state["next"]]
+            nbytes = size(filename)
+            if len(pending) > 0 and state["inflight"]+nbytes > max_bytes :
+                break
+            pending.append((filename, executor.submit(reader, filename), nbytes))
+            state["inflight"] += nbytes
+            state["next"] += 1
+
+    try :
+        fill()
+        while len(pending) > 0 :
+            filename, future, nbytes = pending.popleft()
+            with stage("wait for read") :
+                value = future.result()
+            state["inflight"] -= nbytes
+            # read the next files while this one is processed
+            fill()
+            yield filename, value
+    finally :
+        for filename, future, nbytes in pending :
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,134 @@
+import numpy as np
+import astropy.io.fits as pyfits
+import os
+import pickle
+import hashlib
+from numpy.polynomial.legendre import legval
+
+from desispec.log import get_logger
+from teststand.cache import MemoryLRUCache, file_key
+from teststand.boxcar_extraction import u
+from teststand.psfparams import legendre_grid
+
+# directory of the pickled psf cache, not used if not set
+env_var_disk_cache = "TESTSTAND_PSF_CACHE"
+
+# loaded psfs, shared by all the callers of read_psf
+psf_cache = MemoryLRUCache(maxbytes=512*1024**2)
+
+class BootcalibPSF(object) :
+    """Trace coordinates of a bootcalib psf, with the same x, y, xy methods as specter psfs
+
+        ----------
+        Parameters
+        ----------
+
+        filename : path of the bootcalib psf file (XCOEF in primary HDU, YCOEF and XSIGMA extensions)
+
+        """
+    def __init__(self, filename) :
+        psf = pyfits.open(filename)
+        self.wmin   = psf[0].header["WAVEMIN"]
+        self.wmax   = psf[0].header["WAVEMAX"]
+        self.xcoef  = psf[0].data.astype(float)
+        self.ycoef  = psf[1].data.astype(float)
+        self.xsigcoef = psf[2].data.astype(float) if len(psf)>2 else None
+        psf.close()
+        self.nspec  = self.xcoef.shape[0]
+
+    def _legval(self, coef, ispec, wavelength) :
+        x = u(np.asarray(wavelength,dtype=float),self.wmin,self.wmax)
+        if ispec is None :
+            return legendre_grid(coef,wavelength,self.wmin,self.wmax).reshape((coef.shape[0],)+x.shape)
+        return legval(x,coef[ispec])
+
+    def x(self, ispec=None, wavelength=None) :
+        return self._legval(self.xcoef,ispec,wavelength)
+
+    def y(self, ispec=None, wavelength=None) :
+        return self._legval(self.ycoef,ispec,wavelength)
+
+    def xy(self, ispec=None, wavelength=None) :
+        return self.x(ispec,wavelength), self.y(ispec,wavelength)
+
+    def xsigma(self, ispec=None, wavelength=None) :
+        if self.xsigcoef is None :
+            raise ValueError("no XSIGMA in this bootcalib psf")
+        return self._legval(self.xsigcoef,ispec,wavelength)
+
+def _psf_class(psftype) :
+    if psftype == "GAUSS-HERMITE" :
+        import specter.psf
+        return specter.psf.GaussHermitePSF
+    if psftype == "SPOTGRID" :
+        import specter.psf
+        return specter.psf.SpotGridPSF
+    if psftype == "bootcalib" :
+        return BootcalibPSF
+    return None
+
+def _disk_cache_filename(directory, key) :
+    return os.path.join(directory,"psf-%s.pickle"%hashlib.sha1(repr(key).encode()).hexdigest())
+
+def load_psf(filename, disk_cache=None) :
+    """Load a psf file with the class of its PSFTYPE (GAUSS-HERMITE, SPOTGRID or bootcalib), without the memory cache
+
+        ----------
+        Parameters
+        ----------
+
+        disk_cache : optional directory where the loaded psf objects are pickled, default is $TESTSTAND_PSF_CACHE
+
+        """
+    log = get_logger()
+    header = pyfits.getheader(filename,0)
+    psftype = header.get("PSFTYPE","")
+    psf_class = _psf_class(psftype)
+    if psf_class is None :
+        raise ValueError("unknown PSFTYPE '%s' in %s"%(psftype,filename))
+    if disk_cache is None :
+        disk_cache = os.environ.get(env_var_disk_cache)
+    cache_filename = None
+    if disk_cache is not None :
+        cache_filename = _disk_cache_filename(disk_cache,file_key(filename))
+        if os.path.isfile(cache_filename) :
+            try :
+                with open(cache_filename,"rb") as file :
+                    return pickle.load(file)
+            except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e :
+                log.warning("ignore corrupted psf cache file %s : %s"%(cache_filename,str(e)))
+    log.debug("reading %s psf %s"%(psftype,filename))
+    psf = psf_class(filename)
+    if cache_filename is not None :
+        if not os.path.isdir(disk_cache) :
+            os.makedirs(disk_cache, exist_ok=True)
+        tmp = "%s.tmp%d"%(cache_filename,os.getpid())
+        with open(tmp,"wb") as file :
+            pickle.dump(psf,file,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp,cache_filename)
+    return psf
+
+def read_psf(filename, cache=True, disk_cache=None) :
+    """Read a psf file, GAUSS-HERMITE and SPOTGRID psfs are read with specter, bootcalib psfs with BootcalibPSF
+
+        Loaded psfs are kept in a memory cache (psf_cache) keyed by path, modification time and size,
+        so reading the same file again returns the same object. Callers that modify the psf must use cache=False.
+
+        ----------
+        Parameters
+        ----------
+
+        filename : path of the psf file
+        cache : use the memory cache
+        disk_cache : optional directory where the loaded psf objects are pickled, default is $TESTSTAND_PSF_CACHE
+
+        -------
+        Returns
+        -------
+
+        psf object. Raises ValueError if the PSFTYPE is unknown.
+
+        """
+    if not cache :
+        return load_psf(filename, disk_cache)
+    return psf_cache.get_or_compute(("psf",)+file_key(filename), lambda : load_psf(filename, disk_cache))
@@ -0,0 +1,99 @@
+import numpy as np
+
+# header line of the ASCII table of delta_table rows
+delta_header = "# fiber wmin wmax max_dx rms_dx max_dy rms_dy"
+
+def truth_traces(psf, fibers, wave) :
+    """x and y (nfibers, nwave) of the traces of a simulation truth psf (desimodel specter psf)
+
+        All fibers are evaluated at once with psf.x(None,wave) (specter TraceSet),
+        psfs that only accept one fiber at a time are evaluated fiber per fiber.
+
+        ----------
+        Parameters
+        ----------
+
+        psf : specter psf
+        fibers : array of fiber numbers in the truth psf
+        wave : array of wavelengths
+
+        """
+    fibers = np.asarray(fibers).astype(int)
+    try :
+        x = np.asarray(psf.x(None,wave))
+        y = np.asarray(psf.y(None,wave))
+    except (TypeError, ValueError) :
+        x = None
+    if x is None or x.ndim != 2 or x.shape[0] <= np.max(fibers) :
+        x = np.array([psf.x(int(fiber),wave) for fiber in fibers])
+        y = np.array([psf.y(int(fiber),wave) for fiber in fibers])
+        return x, y
+    return x[fibers], y[fibers]
+
+def trace_deltas(params, truth, fibers=None, wave=None) :
+    """Fitted minus true trace coordinates of all the fibers of a psf
+
+        ----------
+        Parameters
+        ----------
+
+        params : teststand.psfparams.PSFParams of the fitted psf
+        truth : simulation truth psf (see truth_traces)
+        fibers : fiber numbers in the simulation of the psf spectra, default is the first params.nspec fibers
+        wave : wavelength grid, default is params.wavelength_grid()
+
+        -------
+        Returns
+        -------
+
+        wave, fibers, dx, dy (nfibers, nwave)
+
+        """
+    if wave is None :
+        wave = params.wavelength_grid()
+    if fibers is None :
+        fibers = np.arange(params.nspec)
+    fibers = np.asarray(fibers).astype(int)
+    nfibers = min(fibers.size,params.nspec)
+    fibers = fibers[:nfibers]
+    x_truth, y_truth = truth_traces(truth,fibers,wave)
+    dx = params.eval("X",wave)[:nfibers]-x_truth
+    dy = params.eval("Y",wave)[:nfibers]-y_truth
+    return wave, fibers, dx, dy
+
+def delta_table(wave, fibers, dx, dy, nbins=10) :
+    """Maximum absolute value and rms of the trace deltas per fiber and wavelength bin
+
+        ----------
+        Parameters
+        ----------
+
+        wave, fibers, dx, dy : as returned by trace_deltas
+        nbins : number of wavelength bins of equal width
+
+        -------
+        Returns
+        -------
+
+        list of rows (fiber, wmin, wmax, max_dx, rms_dx, max_dy, rms_dy)
+
+        """
+    edges = np.linspace(wave[0],wave[-1],nbins+1)
+    # index of the bin of each wavelength, the last edge is in the last bin
+    ibin = np.clip(np.searchsorted(edges,wave,side="right")-1,0,nbins-1)
+    stats = []
+    for b in range(nbins) :
+        j = (ibin==b)
+        if np.sum(j) == 0 :
+            stats.append(np.full((4,len(fibers)),np.nan))
+            continue
+        stats.append([np.max(np.abs(dx[:,j]),axis=1),np.sqrt(np.mean(dx[:,j]**2,axis=1)),
+                      np.max(np.abs(dy[:,j]),axis=1),np.sqrt(np.mean(dy[:,j]**2,axis=1))])
+    rows = []
+    for i,fiber in enumerate(fibers) :
+        for b in range(nbins) :
+            rows.append((fiber,edges[b],edges[b+1])+tuple([s[i] for s in stats[b]]))
+    return rows
+
+def format_delta_row(row) :
+    return "%d %.1f %.1f %f %f %f %f"%row
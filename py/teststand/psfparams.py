@@ -0,0 +1,108 @@
+import numpy as np
+import astropy.io.fits as pyfits
+from numpy.polynomial.legendre import legvander
+
+from teststand.boxcar_extraction import u
+
+def legendre_grid(coef, wave, wavemin, wavemax) :
+    """Evaluate the Legendre polynomials of all fibers on a wavelength grid with one matrix product
+
+        ----------
+        Parameters
+        ----------
+
+        coef : array (nfibers, ncoef) of Legendre coefficients (or (ncoef) for one fiber)
+        wave : wavelength or array of wavelengths
+        wavemin, wavemax : wavelength range mapped to [-1,1]
+
+        -------
+        Returns
+        -------
+
+        array (nfibers, nwave)
+
+        """
+    coef = np.atleast_2d(coef)
+    vander = legvander(u(np.atleast_1d(wave).astype(float),wavemin,wavemax),coef.shape[1]-1)
+    return coef.dot(vander.T)
+
+class PSFParams(object) :
+    """Legendre coefficients of the parameters of a bootcalib or GAUSS-HERMITE psf
+
+        The parameters of a bootcalib psf are X, Y and XSIGMA (if present),
+        those of a GAUSS-HERMITE psf are the rows of its PARAM table (X, Y, GHSIGX, GHSIGY, ...).
+
+        ----------
+        Parameters
+        ----------
+
+        filename : path of the psf file
+
+        """
+    def __init__(self, filename) :
+        psf = pyfits.open(filename)
+        self.psftype = psf[0].header.get("PSFTYPE","")
+        self.coeff   = {}
+        self.wavemin = {}
+        self.wavemax = {}
+        if self.psftype == "bootcalib" :
+            self.camera = psf[0].header.get("CAMERA","").strip()
+            wavemin = psf[0].header["WAVEMIN"]
+            wavemax = psf[0].header["WAVEMAX"]
+            for name,hdu in [("X",0),("Y",1),("XSIGMA",2)] :
+                if hdu < len(psf) :
+                    self.coeff[name]   = psf[hdu].data.astype(float)
+                    self.wavemin[name] = wavemin
+                    self.wavemax[name] = wavemax
+            self.fibermin = 0
+        elif self.psftype == "GAUSS-HERMITE" or psf[1].header.get("PSFTYPE","") == "GAUSS-HERMITE" :
+            self.psftype = "GAUSS-HERMITE"
+            self.camera = psf[1].header.get("CAMERA","").strip().replace("'","").strip()
+            table = psf[1].data
+            coeff = np.array(table["COEFF"]).astype(float)
+            for i,param in enumerate(table["PARAM"]) :
+                name = str(param).strip()
+                self.coeff[name]   = coeff[i]
+                self.wavemin[name] = float(table["WAVEMIN"][i])
+                self.wavemax[name] = float(table["WAVEMAX"][i])
+            self.fibermin = int(psf[1].header.get("FIBERMIN",0))
+        else :
+            psf.close()
+            raise ValueError("unknown PSFTYPE '%s' in %s"%(self.psftype,filename))
+        psf.close()
+        self.nspec = self.coeff["X"].shape[0]
+        self.wmin  = self.wavemin["X"]
+        self.wmax  = self.wavemax["X"]
+
+    def names(self) :
+        return list(self.coeff.keys())
+
+    def wavelength_grid(self, nwave=100) :
+        return np.linspace(self.wmin,self.wmax,nwave)
+
+    def eval(self, name, wave=None, fibers=None) :
+        """Values of a parameter for the fibers on a wavelength grid
+
+            ----------
+            Parameters
+            ----------
+
+            name : parameter name
+            wave : wavelength or array of wavelengths, default is wavelength_grid()
+            fibers : optional list of fiber indices in the psf, default is all
+
+            -------
+            Returns
+            -------
+
+            array (nfibers, nwave)
+
+            """
+        if not name in self.coeff :
+            raise KeyError("no parameter %s in %s psf"%(name,self.psftype))
+        if wave is None :
+            wave = self.wavelength_grid()
+        coef = self.coeff[name]
+        if fibers is not None :
+            coef = coef[np.atleast_1d(fibers)]
+        return legendre_grid(coef,wave,self.wavemin[name],self.wavemax[name])
@@ -0,0 +1,123 @@
+import numpy as np
+import astropy.io.fits as pyfits
+import os.path
+from concurrent.futures import ProcessPoolExecutor
+
+from desispec.log import get_logger
+from teststand.fibers import parse_fibers
+from teststand.resample import rebin
+
+default_amp_fibers = "A=0:10,B=10:20"
+
+def parse_amp_fibers(amp_string) :
+    """Parse a fiber->amp map like "A=0:10,B=10:20" (fiber ranges with the syntax of --fibers, separated by ';' if needed)
+
+        -------
+        Returns
+        -------
+
+        dictionary amp -> array of fibers (ordered as in the input string)
+
+        """
+    amp_fibers = {}
+    amp = None
+    for item in amp_string.replace(";",",").split(",") :
+        if item.find("=")>=0 :
+            amp,fibers = item.split("=")
+            amp = amp.strip()
+            amp_fibers[amp] = []
+        elif amp is None :
+            raise ValueError("cannot parse '%s', expect amplifier fiber ranges like '%s'"%(amp_string,default_amp_fibers))
+        else :
+            fibers = item
+        amp_fibers[amp] = np.append(amp_fibers[amp],parse_fibers(fibers.strip())).astype(int)
+    return amp_fibers
+
+def frame_chi2(flux, ivar, wave, amp_fibers, rebin_factor=8) :
+    """Chi2 per wavelength bin of the spectra of the fibers of each amplifier with respect to their weighted mean
+
+        ----------
+        Parameters
+        ----------
+
+        flux, ivar : arrays (nfibers, nwave)
+        wave : wavelength array (nwave) or (nfibers, nwave)
+        amp_fibers : dictionary amp -> array of fibers
+        rebin_factor : number of wavelength pixels per bin
+
+        -------
+        Returns
+        -------
+
+        dictionary amp -> (rwave, chi2pdf) arrays for each wavelength bin
+
+        """
+    nfibers = flux.shape[0]
+    res = {}
+    for amp in amp_fibers :
+        fibers = np.asarray(amp_fibers[amp])
+        fibers = fibers[fibers<nfibers]
+        if fibers.size < 2 :
+            continue
+        aivar   = ivar[fibers]
+        aflux   = flux[fibers]
+        sw      = np.sum(aivar,axis=0)
+        mflux   = np.sum(aivar*aflux,axis=0)/(sw+(sw==0))
+        chi2    = rebin(np.sum(aivar*(aflux-mflux)**2,axis=0),rebin_factor)
+        chi2pdf = chi2/(fibers.size-1)/rebin_factor
+        if wave.ndim == 2 :
+            awave = np.mean(wave[fibers],axis=0)
+        else :
+            awave = wave
+        res[amp] = (rebin(awave,rebin_factor,np.mean),chi2pdf)
+    return res
+
+def _frame_chi2_file(args) :
+    filename, amp_fibers, rebin_factor = args
+    frame_file = pyfits.open(filename)
+    res = frame_chi2(frame_file[0].data,frame_file[1].data,frame_file["WAVELENGTH"].data,amp_fibers,rebin_factor)
+    frame_file.close()
+    return filename, res
+
+def frame_chi2_table(filenames, amp_fibers, rebin_factor=8, nproc=1) :
+    """Compute frame_chi2 for a list of frame files in parallel and gather the results in a table
+
+        -------
+        Returns
+        -------
+
+        numpy structured array with columns FRAME, AMP, WAVE, CHI2PDF (one row per frame, amp and wavelength bin)
+
+        """
+    log = get_logger()
+    jobs = [(filename,amp_fibers,rebin_factor) for filename in filenames]
+    if nproc > 1 :
+        with ProcessPoolExecutor(max_workers=nproc) as executor :
+            results = list(executor.map(_frame_chi2_file,jobs))
+    else :
+        results = list(map(_frame_chi2_file,jobs))
+
+    frame=[]
+    amp=[]
+    wave=[]
+    chi2pdf=[]
+    for filename,res in results :
+        log.debug("%s : %d amps"%(filename,len(res)))
+        for a in res :
+            rwave,rchi2pdf = res[a]
+            frame.append(np.repeat(os.path.basename(filename),rwave.size))
+            amp.append(np.repeat(a,rwave.size))
+            wave.append(rwave)
+            chi2pdf.append(rchi2pdf)
+    if len(frame) == 0 :
+        frame=amp=[np.array([],dtype=str)]
+        wave=chi2pdf=[np.array([])]
+    table = np.rec.fromarrays([np.concatenate(frame),np.concatenate(amp),
+                               np.concatenate(wave).astype(np.float32),np.concatenate(chi2pdf).astype(np.float32)],
+                              names=["FRAME","AMP","WAVE","CHI2PDF"])
+    return table
+
+def write_chi2_table(table, filename) :
+    """Write the table of frame_chi2_table in a FITS binary table (extension CHI2)"""
+    hdulist = pyfits.HDUList([pyfits.PrimaryHDU(),pyfits.BinTableHDU(table,name="CHI2")])
+    hdulist.writeto(filename,overwrite=True)
@@ -1,8 +1,8 @@
 import numpy as np
 
-from desispec.interpolation import resample_flux
 
 def resample_to_same_wavelength_grid(spectra, ivar, wave) :
+    from desispec.interpolation import resample_flux
 
     #   Choose the average wavelength of all fibers
     same_wave   = np.mean(wave, axis=0)
@@ -17,3 +17,43 @@ def resample_to_same_wavelength_grid(spectra, ivar, wave) :
         resampled_spectra[fiber], resampled_ivar[fiber] = resample_flux(same_wave, wave[fiber], spectra[fiber], ivar[fiber])
     
     return (resampled_spectra, resampled_ivar, same_wave)
+
+def interpolation_weights(x, xp) :
+    """Linear interpolation weights of the grid x for each row of xp, computed for all rows at once
+
+        ----------
+        Parameters
+        ----------
+
+        x  : 1D output grid
+        xp : 2D array (nfibers, n), each row increasing
+
+        -------
+        Returns
+        -------
+
+        index, weight : 2D arrays (nfibers, x.size) such that the interpolated value is
+        fp[index]*(1-weight)+fp[index+1]*weight (with the same edge values as np.interp)
+
+        """
+    nfibers, n = xp.shape
+    # shift the rows so that they are all sorted in a single flattened array
+    span    = np.max(xp) - np.min(xp) + 1.
+    offset  = span*np.arange(nfibers)
+    flat_xp = (xp + offset[:,None]).ravel()
+    xx      = x[None,:] + offset[:,None]
+    index   = np.searchsorted(flat_xp, xx.ravel(), side="right").reshape(xx.shape) - 1 - n*np.arange(nfibers)[:,None]
+    index   = np.clip(index, 0, n-2)
+    x0      = np.take_along_axis(xp, index, axis=1)
+    x1      = np.take_along_axis(xp, index+1, axis=1)
+    weight  = np.clip((x[None,:]-x0)/(x1-x0+(x1==x0)), 0., 1.)
+    return index, weight
+
+def apply_interpolation_weights(fp, index, weight) :
+    """Interpolate the rows of fp (nfibers, n) with the weights of interpolation_weights"""
+    return np.take_along_axis(fp, index, axis=1)*(1.-weight) + np.take_along_axis(fp, index+1, axis=1)*weight
+
+def rebin(array, n, func=np.sum) :
+    """Rebin the last axis of an array by n (the last incomplete bin is dropped)"""
+    size = (array.shape[-1]//n)*n
+    return func(array[...,:size].reshape(array.shape[:-1]+(size//n,n)),axis=-1)
@@ -0,0 +1,124 @@
+import numpy as np
+
+# columns of the SPOTS table of a psf file that are kept in the index
+spot_columns = ["FIBER","STATUS","EFLUX","X","Y","WAVE","FLUX"]
+
+# header line of the ASCII table of format_summary_row rows
+summary_header = "# fiber nfiles nspots nvalid valid_fraction mean_snr max_snr"
+
+class SpotIndex(object) :
+    """Group-by fiber index of the SPOTS table of a psf
+
+        The table is sorted by FIBER once, and the spots of a fiber are a contiguous slice
+        of the sorted columns, so selecting fibers does not scan the whole table.
+        S/N (FLUX/EFLUX, NaN where EFLUX<=0) and the status selection are computed for all spots at once.
+
+        ----------
+        Parameters
+        ----------
+
+        spots : SPOTS table (FITS_rec or any mapping of column name to array)
+
+        """
+    def __init__(self, spots) :
+        fiber = np.asarray(spots["FIBER"])
+        order = np.argsort(fiber, kind="stable")
+        self.columns = {}
+        for name in spot_columns :
+            try :
+                self.columns[name] = np.asarray(spots[name])[order]
+            except KeyError :
+                pass
+        self.fibers, self.start, self.count = np.unique(self.columns["FIBER"], return_index=True, return_counts=True)
+        self.stop = self.start+self.count
+        self.has_eflux = (self.columns["EFLUX"]>0)
+        self.valid = (self.columns["STATUS"]==1)
+        self.snr = np.full(self.has_eflux.shape,np.nan)
+        self.snr[self.has_eflux] = self.columns["FLUX"][self.has_eflux]/self.columns["EFLUX"][self.has_eflux]
+
+    def __len__(self) :
+        return self.columns["FIBER"].size
+
+    def __getitem__(self, name) :
+        """sorted column, or SNR"""
+        if name == "SNR" :
+            return self.snr
+        return self.columns[name]
+
+    def rows(self, fiber) :
+        """slice of the sorted columns for one fiber (empty if the fiber has no spot)"""
+        i = np.searchsorted(self.fibers,fiber)
+        if i >= self.fibers.size or self.fibers[i] != fiber :
+            return slice(0,0)
+        return slice(self.start[i],self.stop[i])
+
+    def select(self, fibers=None) :
+        """boolean mask of the sorted spots of a list of fibers (all spots if None)"""
+        if fibers is None :
+            return np.ones(len(self),dtype=bool)
+        i = np.searchsorted(self.fibers,fibers)
+        i = i[(i<self.fibers.size)]
+        i = i[np.isin(self.fibers[i],fibers)]
+        # mark the first spot of each selected fiber +1 and the one after its last spot -1
+        steps = np.zeros(len(self)+1,dtype=int)
+        np.add.at(steps,self.start[i],1)
+        np.add.at(steps,self.stop[i],-1)
+        return np.cumsum(steps)[:-1]>0
+
+    def fiber_statistics(self, fibers=None) :
+        """Number of spots, of valid spots (STATUS=1), sum and max (-inf if none) of the S/N of the valid spots with EFLUX>0, for each fiber
+
+            -------
+            Returns
+            -------
+
+            dictionary of arrays (nfibers) with keys FIBER, NSPOTS, NVALID, NSNR, SUMSNR, MAXSNR
+
+            """
+        good = self.valid&self.has_eflux
+        snr  = np.where(good,self.snr,0.)
+        res = {"FIBER"  : self.fibers,
+               "NSPOTS" : self.count,
+               "NVALID" : np.add.reduceat(self.valid.astype(int),self.start),
+               "NSNR"   : np.add.reduceat(good.astype(int),self.start),
+               "SUMSNR" : np.add.reduceat(snr,self.start),
+               "MAXSNR" : np.maximum.reduceat(np.where(good,self.snr,-np.inf),self.start)}
+        if fibers is not None :
+            keep = np.isin(self.fibers,fibers)
+            res = dict([(k,res[k][keep]) for k in res])
+        return res
+
+def read_spot_index(filename) :
+    """SpotIndex of the SPOTS HDU of a psf file"""
+    import astropy.io.fits as pyfits
+    with pyfits.open(filename) as psf :
+        return SpotIndex(psf["SPOTS"].data)
+
+def aggregate_statistics(statistics) :
+    """Combine the fiber_statistics of several psfs per fiber
+
+        -------
+        Returns
+        -------
+
+        dictionary of arrays (nfibers) with keys FIBER, NFILES, NSPOTS, NVALID, VALIDFRAC, MEANSNR, MAXSNR
+
+        """
+    fiber = np.concatenate([s["FIBER"] for s in statistics])
+    fibers, index = np.unique(fiber, return_inverse=True)
+    def total(key) :
+        return np.bincount(index,weights=np.concatenate([s[key] for s in statistics]),minlength=fibers.size)
+    nspots = total("NSPOTS")
+    nsnr   = total("NSNR")
+    maxsnr = np.full(fibers.size,-np.inf)
+    np.maximum.at(maxsnr,index,np.concatenate([s["MAXSNR"] for s in statistics]))
+    return {"FIBER"     : fibers,
+            "NFILES"    : np.bincount(index,minlength=fibers.size),
+            "NSPOTS"    : nspots.astype(int),
+            "NVALID"    : total("NVALID").astype(int),
+            "VALIDFRAC" : total("NVALID")/np.maximum(nspots,1),
+            "MEANSNR"   : np.where(nsnr>0,total("SUMSNR")/np.maximum(nsnr,1),np.nan),
+            "MAXSNR"    : np.where(np.isfinite(maxsnr),maxsnr,np.nan)}
+
+def format_summary_row(summary, i) :
+    return "%d %d %d %d %f %f %f"%tuple([summary[k][i] for k in ["FIBER","NFILES","NSPOTS","NVALID","VALIDFRAC","MEANSNR","MAXSNR"]])
@@ -0,0 +1,200 @@
+import numpy as np
+import os
+import json
+import fcntl
+import atexit
+import hashlib
+import threading
+
+from teststand.cache import MemoryLRUCache, file_hash, file_key
+
+# directory of the on-disk stamp stores, stamps are only cached in memory if not set
+env_var = "TESTSTAND_STAMP_CACHE"
+
+# stamps of all the psfs in memory
+stamp_cache = MemoryLRUCache(maxbytes=1024**3)
+
+class StampStore(object) :
+    """Append-only on-disk store of the stamps of one psf, read with a memory map
+
+        Stamps are appended to a raw data file, and an index (JSON) gives their offset, shape, dtype
+        and pixel offsets. Several processes can share a store, appending and index updates are done
+        under a file lock.
+
+        ----------
+        Parameters
+        ----------
+
+        directory : directory of the store (one per psf)
+        flush_every : number of new stamps after which the index is written (it is also written at exit)
+
+        """
+    def __init__(self, directory, flush_every=1000) :
+        if not os.path.isdir(directory) :
+            os.makedirs(directory, exist_ok=True)
+        self.data_filename  = os.path.join(directory,"stamps.dat")
+        self.index_filename = os.path.join(directory,"index.json")
+        self.lock_filename  = os.path.join(directory,"lock")
+        self.flush_every = flush_every
+        self.lock  = threading.Lock()
+        self.index = self._read_index()
+        self.new   = {}
+        self.memmap = None
+
+    def _read_index(self) :
+        if not os.path.isfile(self.index_filename) :
+            return {}
+        with open(self.index_filename) as file :
+            return json.load(file)
+
+    def _map(self, end) :
+        if self.memmap is None or self.memmap.size < end :
+            self.memmap = np.memmap(self.data_filename, dtype=np.uint8, mode="r")
+        return self.memmap
+
+    def get(self, key) :
+        """Returns (pixels, extra) or None if key is not in the store"""
+        entry = self.index.get(key)
+        if entry is None :
+            return None
+        offset, shape, dtype, extra = entry
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))*dtype.itemsize
+        if size == 0 :
+            return np.zeros(shape,dtype=dtype), extra
+        with self.lock :
+            data = self._map(offset+size)
+        return data[offset:offset+size].view(dtype).reshape(shape), extra
+
+    def put(self, key, pixels, extra=None) :
+        pixels = np.ascontiguousarray(pixels)
+        with self.lock :
+            with open(self.lock_filename,"a") as lock, open(self.data_filename,"ab") as file :
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                file.seek(0,os.SEEK_END)
+                offset = file.tell()
+                file.write(pixels.tobytes())
+            entry = [offset, list(pixels.shape), pixels.dtype.str, extra]
+            self.index[key] = entry
+            self.new[key] = entry
+            nnew = len(self.new)
+        if nnew >= self.flush_every :
+            self.flush()
+
+    def flush(self) :
+        """Write the new entries in the index, merged with the entries written by other processes"""
+        with self.lock :
+            if len(self.new) == 0 :
+                return
+            with open(self.lock_filename,"a") as lock :
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                index = self._read_index()
+                index.update(self.new)
+                tmp = "%s.tmp%d"%(self.index_filename,os.getpid())
+                with open(tmp,"w") as file :
+                    json.dump(index,file)
+                os.replace(tmp,self.index_filename)
+            index.update(self.index)
+            self.index = index
+            self.new = {}
+
+class StampCache(object) :
+    """Wraps a specter psf and caches the stamps of xypix and _value
+
+        Stamps are kept in a memory-bounded LRU shared by all psfs (stamp_cache) and, if a directory is given,
+        in a StampStore keyed by the psf checksum, so that repeated studies of the same psfs (for instance with
+        other fibers or other metrics) do not evaluate them again.
+        All the other attributes and methods are those of the psf. xypix and _value return copies of the cached
+        stamps (those of the on-disk store are read-only memory maps), the caller can modify them.
+
+        ----------
+        Parameters
+        ----------
+
+        psf : specter psf (or any object with xypix and _value methods)
+        checksum : psf identifier, like the file content hash (required for the on-disk store)
+        directory : optional directory of the on-disk stores
+        memory : memory cache, default is stamp_cache
+
+        """
+    def __init__(self, psf, checksum=None, directory=None, memory=None) :
+        self.psf = psf
+        self.checksum = checksum
+        self.memory = memory if memory is not None else stamp_cache
+        # the key prefix of the stamps of this psf in the memory cache
+        self.prefix = checksum if checksum is not None else "psf%d"%id(psf)
+        self.store = None
+        if directory is not None :
+            if checksum is None :
+                raise ValueError("need a psf checksum for the on-disk stamp store")
+            self.store = StampStore(os.path.join(directory,checksum))
+            atexit.register(self.store.flush)
+
+    def __getattr__(self, name) :
+        return getattr(self.psf, name)
+
+    def _cached(self, key, compute) :
+        value = self.memory.get((self.prefix,key))
+        if value is not None :
+            return value
+        if self.store is not None :
+            value = self.store.get(key)
+        if value is None :
+            value = compute()
+            if self.store is not None :
+                self.store.put(key, *value)
+        self.memory.put((self.prefix,key), value)
+        return value
+
+    def xypix(self, ispec, wavelength, xmin=0, xmax=None, ymin=0, ymax=None) :
+        """Same as the psf xypix, cached when called without pixel range"""
+        if xmin != 0 or ymin != 0 or xmax is not None or ymax is not None :
+            return self.psf.xypix(ispec, wavelength, xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax)
+        def compute() :
+            xslice, yslice, pix = self.psf.xypix(ispec, wavelength)
+            return pix, [int(xslice.start), int(xslice.stop), int(yslice.start), int(yslice.stop)]
+        pix, extra = self._cached("xypix:%d:%.6f"%(ispec,wavelength), compute)
+        return slice(extra[0],extra[1]), slice(extra[2],extra[3]), pix.copy()
+
+    def _value(self, x, y, ispec, wavelength) :
+        """Same as the psf _value, cached for the pixel grid x, y"""
+        x = np.asarray(x)
+        y = np.asarray(y)
+        grid = hashlib.sha1(x.tobytes()+y.tobytes()+str((x.shape,y.shape,x.dtype.str,y.dtype.str)).encode()).hexdigest()[:16]
+        def compute() :
+            return np.asarray(self.psf._value(x, y, ispec, wavelength)), None
+        pix, extra = self._cached("value:%d:%.6f:%s"%(ispec,wavelength,grid), compute)
+        return pix.copy()
+
+    def stats(self) :
+        """Statistics of the memory cache (all psfs) and number of stamps in the on-disk store of this psf"""
+        res = self.memory.stats()
+        if self.store is not None :
+            res["stored"] = len(self.store.index)
+        return res
+
+# content hashes of psf files, by path, mtime and size
+_checksums = {}
+
+def read_psf_with_stamp_cache(filename, directory=None) :
+    """teststand.psf.read_psf wrapped in a StampCache
+
+        ----------
+        Parameters
+        ----------
+
+        directory : directory of the on-disk stamp stores, default is $TESTSTAND_STAMP_CACHE (only memory cache if not set)
+
+        """
+    from teststand.psf import read_psf
+    if directory is None :
+        directory = os.environ.get(env_var)
+    key = file_key(filename)
+    if directory is None :
+        # only used as memory cache key
+        checksum = "%s:%f:%d"%key
+    else :
+        if not key in _checksums :
+            _checksums[key] = file_hash(filename)
+        checksum = _checksums[key]
+    return StampCache(read_psf(filename), checksum=checksum, directory=directory)
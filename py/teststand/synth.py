@@ -0,0 +1,408 @@
+import numpy as np
+import astropy.io.fits as pyfits
+import os
+from numpy.polynomial.legendre import legval, legfit
+from scipy.special import erf
+
+from desispec.log import get_logger
+
+# wavelength range per spectrograph arm
+wavelength_ranges = {"b":(3569.,5949.),"r":(5625.,7741.),"z":(7435.,9834.)}
+
+amplifiers = ["A","B","C","D"]
+
+def u(wave, wavemin, wavemax) :
+    return 2. * (wave - wavemin)/(wavemax - wavemin) - 1.
+
+def integrated_gaussian(x, center, sigma) :
+    """Integral of a normalized gaussian over pixels of unit size centered on x"""
+    a = 1./(np.sqrt(2.)*sigma)
+    return 0.5*(erf((x+0.5-center)*a)-erf((x-0.5-center)*a))
+
+def amplifier_sections(npix_x, npix_y) :
+    """CCDSEC keywords of the 4 amplifiers, A and B on the bottom half, C and D on the top half
+
+        -------
+        Returns
+        -------
+
+        dictionary amp -> FITS section string like '[1:2048,1:2048]'
+
+        """
+    hx = npix_x//2
+    hy = npix_y//2
+    return {"A":"[1:%d,1:%d]"%(hx,hy),
+            "B":"[%d:%d,1:%d]"%(hx+1,npix_x,hy),
+            "C":"[1:%d,%d:%d]"%(hx,hy+1,npix_y),
+            "D":"[%d:%d,%d:%d]"%(hx+1,npix_x,hy+1,npix_y)}
+
+def amplifier_slices(npix_x, npix_y) :
+    """Same as amplifier_sections as python slices (y,x)"""
+    hx = npix_x//2
+    hy = npix_y//2
+    return {"A":(slice(0,hy),slice(0,hx)),
+            "B":(slice(0,hy),slice(hx,npix_x)),
+            "C":(slice(hy,npix_y),slice(0,hx)),
+            "D":(slice(hy,npix_y),slice(hx,npix_x))}
+
+def arc_lines(wavemin, wavemax, nlines=40, seed=0) :
+    """Random emission lines in the wavelength range, returns wave, intensity (in electrons)"""
+    rng  = np.random.RandomState(seed)
+    wave = np.sort(rng.uniform(wavemin+20,wavemax-20,size=nlines))
+    intensity = 10**rng.uniform(3,5,size=nlines)
+    return wave, intensity
+
+def continuum(wave, wavemin, wavemax, amplitude=1000.) :
+    """Smooth continuum lamp spectrum in electrons per row, peaking at amplitude"""
+    x = u(wave, wavemin, wavemax)
+    return amplitude*(1.-0.3*x**2+0.1*x)/1.1
+
+class SynthSpectrograph(object) :
+    """Synthetic spectrograph camera with Legendre traces
+
+        All outputs are deterministic for a given seed. The number of fibers and the
+        CCD size can be anything from 20 fibers x 1k rows to 500 fibers x 4k rows.
+
+        ----------
+        Parameters
+        ----------
+
+        nfibers : number of fibers, evenly spread over the CCD width in bundles of 25
+        npix_y  : number of CCD rows (along the wavelength direction)
+        npix_x  : number of CCD columns, default is 200 pixels per fiber up to 4096
+        camera  : like 'b1', used for the wavelength range and the headers
+        legdeg  : degree of the Legendre polynomials of the traces
+        xsig, ysig : gaussian PSF sigma in pixels
+        seed : random seed
+
+        """
+    def __init__(self, nfibers=20, npix_y=4096, npix_x=None, camera="b1", legdeg=5, xsig=1.1, ysig=1.2, seed=0) :
+        self.nfibers = nfibers
+        self.npix_y  = npix_y
+        if npix_x is None :
+            npix_x = min(4096,200*nfibers)
+        self.npix_x  = npix_x
+        self.camera  = camera
+        self.legdeg  = legdeg
+        self.seed    = seed
+        self.wavemin, self.wavemax = wavelength_ranges[camera[0]]
+        self.xsig = xsig*np.ones((nfibers,legdeg+1))*np.eye(1,legdeg+1)
+        self.ysig = ysig*np.ones((nfibers,legdeg+1))*np.eye(1,legdeg+1)
+        self.xcoef, self.ycoef = self._trace_coefficients()
+        self._x_of_y    = None
+        self._wave_of_y = None
+
+    def _trace_coefficients(self) :
+        rng = np.random.RandomState(self.seed)
+        nf  = self.nfibers
+        # fiber positions, with a gap of one fiber spacing between bundles of 25
+        slot = np.arange(nf)+np.arange(nf)//25
+        spacing = (self.npix_x-20.)/(slot[-1]+1)
+        x0 = 10.+spacing*(slot+0.5)
+        c  = (x0-self.npix_x/2.)/(self.npix_x/2.)
+        # trace positions along a fine wavelength grid
+        wave = np.linspace(self.wavemin,self.wavemax,200)
+        uu = u(wave,self.wavemin,self.wavemax)
+        # x : slight tilt and bowing increasing toward the edges of the CCD
+        x = x0[:,None] + 3.*c[:,None]*uu[None,:] - 0.002*self.npix_x*c[:,None]**2*(uu[None,:]**2-1./3) + 0.1*rng.randn(nf)[:,None]
+        # y : roughly linear dispersion, with a small fiber dependent distortion
+        y = (self.npix_y/2.)*(1.+0.96*uu[None,:]+0.01*(uu[None,:]**2-1./3)) - 0.004*self.npix_y*c[:,None]**2
+        xcoef = np.array([legfit(uu,x[f],self.legdeg) for f in range(nf)])
+        ycoef = np.array([legfit(uu,y[f],self.legdeg) for f in range(nf)])
+        return xcoef, ycoef
+
+    def x_of_wave(self, wave) :
+        """x coordinates (nfibers, nwave) of the traces for the wavelength array wave"""
+        return legval(u(wave,self.wavemin,self.wavemax),self.xcoef.T)
+
+    def y_of_wave(self, wave) :
+        """y coordinates (nfibers, nwave) of the traces for the wavelength array wave"""
+        return legval(u(wave,self.wavemin,self.wavemax),self.ycoef.T)
+
+    def _compute_traces(self) :
+        # slightly extended wavelength range so that all rows are covered
+        margin = 0.1*(self.wavemax-self.wavemin)
+        wave = np.linspace(self.wavemin-margin,self.wavemax+margin,2*self.npix_y)
+        yy   = self.y_of_wave(wave)
+        rows = np.arange(self.npix_y).astype(float)
+        self._wave_of_y = np.array([np.interp(rows,yy[f],wave) for f in range(self.nfibers)])
+        self._x_of_y    = legval(u(self._wave_of_y,self.wavemin,self.wavemax),self.xcoef.T[:,:,None],tensor=False)
+
+    @property
+    def wave_of_y(self) :
+        """wavelength of the center of each row for each fiber (nfibers, npix_y)"""
+        if self._wave_of_y is None :
+            self._compute_traces()
+        return self._wave_of_y
+
+    @property
+    def x_of_y(self) :
+        """x coordinate of the trace at each row for each fiber (nfibers, npix_y)"""
+        if self._x_of_y is None :
+            self._compute_traces()
+        return self._x_of_y
+
+    def header(self, expnum=0, flavor="arc", exptime=1., expreq=None, ndnum=0, night="20170101") :
+        """Primary header of preprocessed images and frames"""
+        header = pyfits.Header()
+        header["CAMERA"]   = self.camera
+        header["EXPNUM"]   = expnum
+        header["FLAVOR"]   = flavor
+        header["EXPTIME"]  = exptime
+        header["EXPREQ"]   = exptime if expreq is None else expreq
+        header["NDNUM"]    = ndnum
+        header["NIGHT"]    = night
+        header["DATE-OBS"] = "%s-%s-%sT00:00:00"%(night[:4],night[4:6],night[6:])
+        header["SIMSEED"]  = (self.seed,"synthetic data random seed")
+        return header
+
+    def bootcalib_psf(self) :
+        """bootcalib PSF : XCOEF in primary HDU, YCOEF and XSIGMA extensions"""
+        hdulist = pyfits.HDUList([pyfits.PrimaryHDU(self.xcoef),
+                                  pyfits.ImageHDU(self.ycoef,name="YCOEF"),
+                                  pyfits.ImageHDU(self.xsig,name="XSIGMA")])
+        header = hdulist[0].header
+        header["EXTNAME"] = "XCOEF"
+        header["PSFTYPE"] = "bootcalib"
+        header["CAMERA"]  = self.camera
+        header["WAVEMIN"] = self.wavemin
+        header["WAVEMAX"] = self.wavemax
+        return hdulist
+
+    def gauss_hermite_psf(self, ghdeg=2, hsize=8) :
+        """GAUSS-HERMITE PSF table (PSFVER 3 layout) with a pure gaussian core and no tails"""
+        nf = self.nfibers
+        ncoef = self.legdeg+1
+        params = [("X",self.xcoef),("Y",self.ycoef),("GHSIGX",self.xsig),("GHSIGY",self.ysig)]
+        for i in range(ghdeg+1) :
+            for j in range(ghdeg+1) :
+                coef = np.zeros((nf,ncoef))
+                if i==0 and j==0 :
+                    coef[:,0] = 1.
+                params.append(("GH-%d-%d"%(i,j),coef))
+        tails = {"TAILAMP":0.,"TAILCORE":1.,"TAILXSCA":1.,"TAILYSCA":1.,"TAILINDE":2.,"CONT":0.}
+        for name in tails :
+            coef = np.zeros((nf,ncoef))
+            coef[:,0] = tails[name]
+            params.append((name,coef))
+        nparams = len(params)
+        columns = [pyfits.Column(name="PARAM",format="8A",array=np.array([p[0] for p in params])),
+                   pyfits.Column(name="WAVEMIN",format="D",array=self.wavemin*np.ones(nparams)),
+                   pyfits.Column(name="WAVEMAX",format="D",array=self.wavemax*np.ones(nparams)),
+                   pyfits.Column(name="COEFF",format="%dD"%(nf*ncoef),dim="(%d,%d)"%(ncoef,nf),array=np.array([p[1] for p in params]))]
+        table = pyfits.BinTableHDU.from_columns(columns,name="PSF")
+        header = table.header
+        header["PSFTYPE"]  = "GAUSS-HERMITE"
+        header["PSFVER"]   = "3"
+        header["CAMERA"]   = self.camera
+        header["NPIX_X"]   = self.npix_x
+        header["NPIX_Y"]   = self.npix_y
+        header["HSIZEX"]   = hsize
+        header["HSIZEY"]   = hsize
+        header["FIBERMIN"] = 0
+        header["FIBERMAX"] = nf-1
+        header["BUNDLMIN"] = 0
+        header["BUNDLMAX"] = (nf-1)//25
+        header["NPARAMS"]  = nparams
+        header["LEGDEG"]   = self.legdeg
+        header["GHDEGX"]   = ghdeg
+        header["GHDEGY"]   = ghdeg
+        primary = pyfits.PrimaryHDU()
+        primary.header["PSFTYPE"] = "GAUSS-HERMITE"
+        primary.header["CAMERA"]  = self.camera
+        return pyfits.HDUList([primary,table])
+
+    def spectra(self, lines=None, continuum_amplitude=0., fibertrans=None) :
+        """Electrons per CCD row of each fiber (nfibers, npix_y)
+
+            ----------
+            Parameters
+            ----------
+
+            lines : optional (wave, intensity) of emission lines, convolved with the PSF in y
+            continuum_amplitude : amplitude of a smooth continuum (see continuum())
+            fibertrans : optional relative transmission of each fiber
+
+            """
+        flux = np.zeros((self.nfibers,self.npix_y))
+        if continuum_amplitude > 0 :
+            flux += continuum(self.wave_of_y,self.wavemin,self.wavemax,continuum_amplitude)
+        if lines is not None :
+            lwave, lflux = lines
+            rows  = np.arange(self.npix_y).astype(float)
+            yline = self.y_of_wave(np.asarray(lwave))
+            sig   = self.ysig[:,0]
+            for f in range(self.nfibers) :
+                flux[f] += np.sum(lflux[None,:]*integrated_gaussian(rows[:,None],yline[f][None,:],sig[f]),axis=1)
+        if fibertrans is not None :
+            flux *= np.asarray(fibertrans)[:,None]
+        return flux
+
+    def image(self, spectra) :
+        """Noiseless image (npix_y, npix_x) in electrons, each row of a fiber spread along x with the PSF"""
+        image = np.zeros((self.npix_y,self.npix_x))
+        hw    = int(np.ceil(5*np.max(self.xsig[:,0])))
+        dx    = np.arange(-hw,hw+1)
+        rows  = np.arange(self.npix_y)
+        for f in range(self.nfibers) :
+            xc   = self.x_of_y[f]
+            cols = np.floor(xc).astype(int)[:,None]+dx[None,:]
+            prof = integrated_gaussian(cols,xc[:,None],self.xsig[f,0])*spectra[f][:,None]
+            ok   = (cols>=0)&(cols<self.npix_x)
+            image[np.broadcast_to(rows[:,None],cols.shape)[ok],cols[ok]] += prof[ok]
+        return image
+
+    def preproc(self, electrons, header, gains=None, nonlinearity=None, readnoise=3., calibrated=True, nbadcols=0) :
+        """Preprocessed image with FLUX/IVAR/MASK from a noiseless image in electrons
+
+            The image is realized with Poisson and read noise, converted to ADU with the gain of each
+            amplifier and distorted by a quadratic non-linearity adu*(1+nonlinearity*adu).
+
+            ----------
+            Parameters
+            ----------
+
+            electrons : noiseless image (npix_y, npix_x)
+            header : primary header (see header())
+            gains : dictionary amp -> gain in e/ADU (default 1 for all amps)
+            nonlinearity : dictionary amp -> quadratic coefficient (default 0)
+            readnoise : in electrons
+            calibrated : if True, the output is ADU x gain (as a preproc image), otherwise ADU
+            nbadcols : number of random bad columns flagged in the mask
+
+            -------
+            Returns
+            -------
+
+            HDUList (IMAGE, IVAR, MASK)
+
+            """
+        rng = np.random.RandomState(self.seed+int(header.get("EXPNUM",0))+1)
+        if gains is None :
+            gains = {}
+        if nonlinearity is None :
+            nonlinearity = {}
+        header = header.copy()
+        data = rng.poisson(np.clip(electrons,0,None)).astype(float)+readnoise*rng.randn(*electrons.shape)
+        var  = np.clip(electrons,0,None)+readnoise**2
+        sections = amplifier_sections(self.npix_x,self.npix_y)
+        for amp,(sy,sx) in amplifier_slices(self.npix_x,self.npix_y).items() :
+            gain = gains.get(amp,1.)
+            nl   = nonlinearity.get(amp,0.)
+            adu  = data[sy,sx]/gain
+            avar = var[sy,sx]/gain**2
+            # d(measured)/d(adu) = 1+2*nl*adu
+            avar *= (1.+2*nl*adu)**2
+            adu  *= (1.+nl*adu)
+            scale = gain if calibrated else 1.
+            data[sy,sx] = adu*scale
+            var[sy,sx]  = avar*scale**2
+            header["CCDSEC%s"%amp] = sections[amp]
+            header["GAIN%s"%amp]   = scale
+            header["SIMGAIN%s"%amp] = (gain,"true gain e/ADU")
+            header["SIMNL%s"%amp]   = (nl,"true non-linearity coefficient")
+        mask = np.zeros(data.shape,dtype=np.int32)
+        if nbadcols > 0 :
+            mask[:,rng.randint(0,self.npix_x,size=nbadcols)] = 1
+        ivar = (mask==0)/var
+        hdulist = pyfits.HDUList([pyfits.PrimaryHDU(data,header=header),
+                                  pyfits.ImageHDU(ivar,name="IVAR"),
+                                  pyfits.ImageHDU(mask,name="MASK")])
+        hdulist[0].header["EXTNAME"] = "IMAGE"
+        return hdulist
+
+    def frame(self, spectra, header, readnoise=3., width=7) :
+        """Frame with the layout of desi_extract_boxcar (FLUX, IVAR, WAVELENGTH) with noise,
+        for a boxcar of width pixels"""
+        rng  = np.random.RandomState(self.seed+int(header.get("EXPNUM",0))+1)
+        var  = np.clip(spectra,0,None)+width*readnoise**2
+        flux = spectra+np.sqrt(var)*rng.randn(*spectra.shape)
+        hdulist = pyfits.HDUList([pyfits.PrimaryHDU(flux,header=header.copy()),
+                                  pyfits.ImageHDU(1./var,name="IVAR"),
+                                  pyfits.ImageHDU(self.wave_of_y,name="WAVELENGTH")])
+        hdulist[0].header["EXTNAME"] = "FLUX"
+        return hdulist
+
+def _write(hdulist, filename) :
+    hdulist.writeto(filename,overwrite=True)
+    get_logger().debug("wrote %s"%filename)
+    return filename
+
+def write_psfs(spectro, outdir) :
+    """Write bootcalib and GAUSS-HERMITE PSF files, returns their paths"""
+    return [_write(spectro.bootcalib_psf(),os.path.join(outdir,"psfboot-%s.fits"%spectro.camera)),
+            _write(spectro.gauss_hermite_psf(),os.path.join(outdir,"psf-%s.fits"%spectro.camera))]
+
+def write_arc(spectro, outdir, expnum=1, nlines=40, exptime=10.) :
+    """Write a preprocessed arc lamp image and its frame, returns their paths"""
+    lines  = arc_lines(spectro.wavemin,spectro.wavemax,nlines,seed=spectro.seed)
+    flux   = spectro.spectra(lines=lines)
+    header = spectro.header(expnum=expnum,flavor="arc",exptime=exptime)
+    return [_write(spectro.preproc(spectro.image(flux),header),os.path.join(outdir,"preproc-%s-%08d.fits"%(spectro.camera,expnum))),
+            _write(spectro.frame(flux,header),os.path.join(outdir,"frame-%s-%08d.fits"%(spectro.camera,expnum)))]
+
+def write_ptc_ladder(spectro, outdir, levels=(500.,1000.,2000.,5000.,10000.,20000.), nexp=3, gains=None, nonlinearity=None,
+                     first_expnum=100, readnoise=3.) :
+    """Write preprocessed continuum lamp images at increasing illumination levels (nexp per level),
+    with known gains and non-linearity stored in the SIMGAIN? and SIMNL? keywords
+
+        The images are in ADU (GAIN?=1) as expected by desi_compute_gains.
+
+        -------
+        Returns
+        -------
+
+        list of paths
+
+        """
+    filenames = []
+    expnum = first_expnum
+    for level in levels :
+        # level is the peak flux per row, spread over about 2.5*xsig pixels
+        flux  = spectro.spectra(continuum_amplitude=level*np.sqrt(2*np.pi)*spectro.xsig[0,0])
+        image = spectro.image(flux)
+        for e in range(nexp) :
+            header = spectro.header(expnum=expnum,flavor="flat",exptime=level/100.)
+            header["SIMLEVEL"] = (level,"peak pixel flux in electrons")
+            filenames.append(_write(spectro.preproc(image,header,gains=gains,nonlinearity=nonlinearity,readnoise=readnoise,calibrated=False),
+                                    os.path.join(outdir,"preproc-%s-%08d.fits"%(spectro.camera,expnum))))
+            expnum += 1
+    return filenames
+
+def write_shutter_sequence(spectro, outdir, exptimes=(1.,2.,5.,10.,20.,50.), ndnums=(0,1), delta_t=0.05,
+                           nd_transmission=None, rate=100., first_expnum=200) :
+    """Write frames of a shutter timing / linearity sequence
+
+        The effective exposure time is EXPREQ+delta_t and the flux is scaled by the transmission of
+        the ND filter NDNUM, so that a shutter timing analysis should recover delta_t.
+
+        ----------
+        Parameters
+        ----------
+
+        exptimes : requested exposure times (EXPREQ and EXPTIME keywords)
+        ndnums : ND filter numbers, all exposure times are taken with each filter
+        delta_t : true shutter timing offset in seconds
+        nd_transmission : dictionary ndnum -> transmission, default is 10**(-ndnum/2.)
+        rate : continuum electrons per row and per second without ND filter
+
+        -------
+        Returns
+        -------
+
+        list of paths
+
+        """
+    if nd_transmission is None :
+        nd_transmission = dict([(nd,10**(-nd/2.)) for nd in ndnums])
+    filenames = []
+    expnum = first_expnum
+    for nd in ndnums :
+        for exptime in exptimes :
+            flux   = spectro.spectra(continuum_amplitude=rate*(exptime+delta_t)*nd_transmission[nd])
+            header = spectro.header(expnum=expnum,flavor="flat",exptime=exptime,ndnum=nd)
+            header["SIMDT"]   = (delta_t,"true shutter timing offset (s)")
+            header["SIMNDTR"] = (nd_transmission[nd],"true ND filter transmission")
+            filenames.append(_write(spectro.frame(flux,header),os.path.join(outdir,"frame-%s-%08d.fits"%(spectro.camera,expnum))))
+            expnum += 1
+    return filenames
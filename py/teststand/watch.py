@@ -0,0 +1,267 @@
+import numpy as np
+import astropy.io.fits as pyfits
+import os
+import glob
+import time
+import queue
+import threading
+
+from desispec.log import get_logger
+from teststand.cache import MemoryLRUCache, file_key
+from teststand.ics import format_ics_file
+from teststand.boxcar_extraction import psf_traces, trace_geometry, boxcar, make_frame
+from teststand.meanflux import frame_meanflux, format_meanflux_row, meanflux_header
+from teststand.qa.frame_chi2 import frame_chi2, parse_amp_fibers, default_amp_fibers
+from teststand.instrument import stage
+
+qa_header = "# expnum camera amp chi2pdf"
+
+def parse_psfs(values) :
+    """Parse a list of 'camera=psf file' like ['b1=psf-b1.fits','r1=psf-r1.fits'] into a dictionary"""
+    psfs = {}
+    for value in values :
+        if value.find("=")<0 :
+            raise ValueError("expect camera=psf file, got '%s'"%value)
+        camera,filename = value.split("=",1)
+        psfs[camera.strip().lower()] = filename.strip()
+    return psfs
+
+def stable_files(directory, pattern, previous) :
+    """Files of a directory whose size and modification time did not change since the previous call,
+    so that files still being written by the data acquisition are not read
+
+        ----------
+        Parameters
+        ----------
+
+        previous : dictionary filename -> (size,mtime) returned by the previous call (empty the first time)
+
+        -------
+        Returns
+        -------
+
+        sorted list of stable files, dictionary filename -> (size,mtime) for the next call
+
+        """
+    current = {}
+    for filename in glob.glob(os.path.join(directory,pattern)) :
+        try :
+            stat = os.stat(filename)
+        except OSError :
+            continue
+        current[filename] = (stat.st_size,stat.st_mtime)
+    stable = [f for f in current if previous.get(f)==current[f] and current[f][0]>0]
+    return sorted(stable), current
+
+class ExposurePipeline(object) :
+    """Processing of one exposure as it lands : ICS reformatting, preprocessing, boxcar extraction
+    with the night's psf, and rows appended to the mean flux and QA tables of the output directory
+
+        Files that already have an IVAR extension are considered as preprocessed images and are extracted directly.
+
+        ----------
+        Parameters
+        ----------
+
+        psfs : dictionary camera -> psf file, only these cameras are processed
+        outdir : output directory for preproc images, frames and tables
+        fibers, width, side_bands : boxcar extraction parameters (see desi_extract_boxcar)
+        wmin, wmax : wavelength range of the mean flux (see meanflux_for_shutter_timing_and_linearity.py)
+        amp_fibers : fibers of each amplifier for the QA chi2 (see desi_frame_chi2)
+
+        """
+    def __init__(self, psfs, outdir, fibers=None, width=9, side_bands=False, wmin=3700., wmax=9700., amp_fibers=None) :
+        self.psfs       = psfs
+        self.outdir     = outdir
+        self.fibers     = fibers
+        self.width      = width
+        self.side_bands = side_bands
+        self.wmin       = wmin
+        self.wmax       = wmax
+        if amp_fibers is None :
+            amp_fibers = parse_amp_fibers(default_amp_fibers)
+        self.amp_fibers = amp_fibers
+        self.meanflux_table  = os.path.join(outdir,"meanflux.txt")
+        self.qa_table        = os.path.join(outdir,"qa.txt")
+        self.processed_table = os.path.join(outdir,"processed.txt")
+        # the trace geometry is computed once per camera for the whole sequence
+        self.geometries = MemoryLRUCache()
+        self.geometry_lock = threading.Lock()
+        self.table_lock = threading.Lock()
+        for dirname in [outdir,os.path.join(outdir,"raw")] :
+            if not os.path.isdir(dirname) :
+                os.makedirs(dirname)
+
+    def processed(self) :
+        """Set of input file names already processed (read back from processed.txt when restarting)"""
+        if not os.path.isfile(self.processed_table) :
+            return set()
+        with open(self.processed_table) as file :
+            return set([line.strip() for line in file if line.strip() != ""])
+
+    def _append(self, filename, header, lines) :
+        with self.table_lock :
+            new = not os.path.isfile(filename)
+            with open(filename,"a") as file :
+                if new and header is not None :
+                    file.write(header+"\n")
+                for line in lines :
+                    file.write(line+"\n")
+
+    def geometry(self, camera, npix_y) :
+        psf = self.psfs[camera]
+        key = (camera,npix_y)+file_key(psf)
+        def compute() :
+            with pyfits.open(psf) as psf_file :
+                return trace_geometry(psf_traces(psf_file), npix_y, self.fibers, self.width)
+        with self.geometry_lock :
+            return self.geometries.get_or_compute(key, compute)
+
+    def preproc(self, filename) :
+        """Reformat and preprocess a raw ICS file
+
+            -------
+            Returns
+            -------
+
+            list of (camera, preprocessed image filename)
+
+            """
+        log = get_logger()
+        with pyfits.open(filename) as file :
+            if "IVAR" in file :
+                camera = file[0].header["CAMERA"].strip().lower()
+                return [(camera,filename)] if camera in self.psfs else []
+            expnum = file[0].header["EXPNUM"]
+        rawfile = os.path.join(self.outdir,"raw",os.path.basename(filename))
+        with stage("format") :
+            if not format_ics_file(filename,rawfile) :
+                rawfile = filename
+        # desispec.io is only needed for raw data
+        from desispec.io import read_raw, write_image
+        res = []
+        for camera in sorted(self.psfs.keys()) :
+            outfile = os.path.join(self.outdir,"preproc-%s-%08d.fits"%(camera,expnum))
+            with stage("preproc") :
+                try :
+                    image = read_raw(rawfile,camera)
+                except KeyError :
+                    log.warning("no camera %s in %s"%(camera,rawfile))
+                    continue
+                write_image(outfile,image)
+            res.append((camera,outfile))
+        return res
+
+    def extract(self, camera, preproc_filename) :
+        """Boxcar extraction of a preprocessed image, returns the frame HDUList"""
+        with pyfits.open(preproc_filename) as image_file :
+            header   = image_file[0].header.copy()
+            geometry = self.geometry(camera, header["NAXIS2"])
+            spectra, ivar, wave = boxcar(None, image_file, side_bands=self.side_bands, geometry=geometry)
+        return make_frame(spectra, ivar, wave, header)
+
+    def process(self, filename) :
+        """Process one exposure, returns the list of frame files written"""
+        log = get_logger()
+        frames = []
+        for camera,preproc_filename in self.preproc(filename) :
+            frame = self.extract(camera,preproc_filename)
+            expnum = frame[0].header["EXPNUM"]
+            outfile = os.path.join(self.outdir,"frame-%s-%08d.fits"%(camera,expnum))
+            with stage("write") :
+                frame.writeto(outfile,overwrite=True)
+            log.info("wrote %s"%outfile)
+            # frame fibers are the extracted fibers, indexed from 0
+            with stage("tables") :
+                rows = frame_meanflux(frame, wmin=self.wmin, wmax=self.wmax, side_bands=self.side_bands)
+                self._append(self.meanflux_table, meanflux_header, [format_meanflux_row(row) for row in rows])
+                chi2 = frame_chi2(frame[0].data, frame["IVAR"].data, frame["WAVELENGTH"].data, self.amp_fibers)
+                self._append(self.qa_table, qa_header,
+                             ["%d %s %s %g"%(expnum,camera,amp,np.median(chi2[amp][1])) for amp in sorted(chi2.keys())])
+            frames.append(outfile)
+        self._append(self.processed_table, None, [os.path.basename(filename)])
+        return frames
+
+def watch(directory, pipeline, pattern="*.fits*", nworkers=2, queue_size=4, poll=2., idle_timeout=None, once=False) :
+    """Watch a directory and process each new exposure with a pool of worker threads
+
+        The directory is polled every poll seconds. New files are put in a bounded queue,
+        so that the polling waits when the workers fall behind.
+
+        ----------
+        Parameters
+        ----------
+
+        pipeline : ExposurePipeline (or any object with methods process(filename) and processed())
+        nworkers : number of worker threads
+        queue_size : max number of exposures waiting to be processed
+        idle_timeout : stop if there is no new file for this number of seconds (default is to run until interrupted)
+        once : process the files already in the directory and stop
+
+        -------
+        Returns
+        -------
+
+        number of files processed
+
+        """
+    log = get_logger()
+    jobs = queue.Queue(maxsize=queue_size)
+    counts = {"ok":0, "failed":0}
+    lock = threading.Lock()
+
+    def worker() :
+        while True :
+            filename = jobs.get()
+            try :
+                if filename is None :
+                    return
+                log.info("processing %s"%filename)
+                t0 = time.time()
+                pipeline.process(filename)
+                log.info("done %s in %.1f s"%(filename,time.time()-t0))
+                with lock :
+                    counts["ok"] += 1
+            except Exception as e :
+                log.error("failed to process %s : %s"%(filename,str(e)))
+                with lock :
+                    counts["failed"] += 1
+            finally :
+                jobs.task_done()
+
+    threads = [threading.Thread(target=worker, name="watch-worker-%d"%i) for i in range(nworkers)]
+    for thread in threads :
+        thread.daemon = True
+        thread.start()
+
+    done = pipeline.processed()
+    log.info("watching %s (%d files already processed)"%(directory,len(done)))
+    state = {}
+    last_new = time.time()
+    try :
+        while True :
+            if once :
+                # no need to wait for the files to be stable
+                files = sorted(glob.glob(os.path.join(directory,pattern)))
+            else :
+                files, state = stable_files(directory, pattern, state)
+            for filename in files :
+                if os.path.basename(filename) in done :
+                    continue
+                done.add(os.path.basename(filename))
+                jobs.put(filename)
+                last_new = time.time()
+            if once :
+                break
+            if idle_timeout is not None and time.time()-last_new > idle_timeout :
+                log.info("no new file for %d s, stop watching"%idle_timeout)
+                break
+            time.sleep(poll)
+    except KeyboardInterrupt :
+        log.warning("interrupted, waiting for the exposures in the queue")
+    for thread in threads :
+        jobs.put(None)
+    for thread in threads :
+        thread.join()
+    log.info("processed %d files, %d failed"%(counts["ok"],counts["failed"]))
+    return counts["ok"]